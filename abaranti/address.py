@@ -0,0 +1,129 @@
+import re
+import unicodedata
+
+from django.db.models import Q
+
+# -------------------------------------------------------------------
+# 住所の構造化
+# 「都道府県 / 市区町村 / 町域 / 丁目・番地」に分解して検索用の列に保存する
+# -------------------------------------------------------------------
+PREFECTURES = (
+    '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県',
+    '茨城県', '栃木県', '群馬県', '埼玉県', '千葉県', '東京都', '神奈川県',
+    '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県', '岐阜県',
+    '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県',
+    '奈良県', '和歌山県', '鳥取県', '島根県', '岡山県', '広島県', '山口県',
+    '徳島県', '香川県', '愛媛県', '高知県', '福岡県', '佐賀県', '長崎県',
+    '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県',
+)
+
+# 名前の途中に「市・区・町・村・郡」を含む市区町村（最短一致では「大町」「東村」「大和郡」のように途中で切れるため、先に判定する）
+COMPOUND_MUNICIPALITIES = (
+    '四日市市', '廿日市市', '野々市市', '大町市', '十日町市', '東村山市', '武蔵村山市', '羽村市', '田村市', '大村市',
+    '大和郡山市', '郡山市', '郡上市', '蒲郡市', '小郡市',
+)
+COMPOUND_TOWNS = ('大町町', '玉村町')
+# 名前に「市」を含む郡（市より先に判定する）
+COMPOUND_COUNTIES = ('高市郡',)
+
+
+def _names_pattern(names):
+    # 長い名前から順に試す
+    return '|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+
+
+# 市区町村（上記の市区町村・郡 → 市 → 郡部の町村 → 区町村の順に判定する）
+# 市を郡より先に判定し、町域名の「郡」（「大和郡山市北郡山町」など）で郡部と誤らないようにする
+# 市の名前は区・郡・町・村をまたがない（「千代田区市ヶ谷」「芳賀郡市貝町」の「市」では切らない）
+_TOWN_PATTERN = rf'(?:{_names_pattern(COMPOUND_TOWNS)}|.+?[町村])'
+MUNICIPALITY_RE = re.compile(
+    rf'^({_names_pattern(COMPOUND_MUNICIPALITIES)}|(?:{_names_pattern(COMPOUND_COUNTIES)}){_TOWN_PATTERN}'
+    rf'|[^区郡町村]+?市|.+?郡{_TOWN_PATTERN}|.+?[市区町村])'
+)
+# 政令指定都市の区（「横浜市中区」のように市と合わせて市区町村とする）
+WARD_RE = re.compile(r'^(.+?区)')
+
+# 検索用に保存する列
+ADDRESS_FIELDS = ('address_prefecture', 'address_municipality', 'address_town', 'address_number')
+
+KANJI_DIGITS = {'〇': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+KANJI_NUMBER_RE = re.compile(r'([〇一二三四五六七八九十]+)(?=丁目|番|号)')
+NUMBER_RE = re.compile(r'\d+')
+
+
+def _kanji_to_int(text):
+    # 「二十三」「十五」「三」などの漢数字を整数に変換する
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return (KANJI_DIGITS.get(tens, 1) if tens else 1) * 10 + (KANJI_DIGITS.get(ones, 0) if ones else 0)
+    value = 0
+    for ch in text:
+        value = value * 10 + KANJI_DIGITS[ch]
+    return value
+
+
+def normalize_address(address):
+    text = unicodedata.normalize('NFKC', address or '')
+    text = re.sub(r'\s+', '', text)
+    text = KANJI_NUMBER_RE.sub(lambda m: str(_kanji_to_int(m.group(1))), text)
+    # 番地の区切り（ハイフン・長音記号）の揺れを揃える
+    return re.sub(r'(?<=\d)[‐―−–—ー](?=\d)', '-', text)
+
+
+def parse_address(address):
+    text = normalize_address(address)
+    prefecture = ''
+    for name in PREFECTURES:
+        if text.startswith(name):
+            prefecture = name
+            text = text[len(name):]
+            break
+
+    municipality = ''
+    match = MUNICIPALITY_RE.match(text)
+    if match and not NUMBER_RE.search(match.group(1)):
+        municipality = match.group(1)
+        text = text[len(municipality):]
+        ward = WARD_RE.match(text) if municipality.endswith('市') else None
+        if ward and not NUMBER_RE.search(ward.group(1)):
+            municipality += ward.group(1)
+            text = text[len(ward.group(1)):]
+
+    # 最初の数字までを町域、それ以降を丁目・番地・号として扱う
+    digits = NUMBER_RE.search(text)
+    if digits:
+        town = text[:digits.start()]
+        number = '-'.join(NUMBER_RE.findall(text[digits.start():]))
+    else:
+        town = text
+        number = ''
+    return dict(zip(ADDRESS_FIELDS, (prefecture, municipality, town, number)))
+
+
+def address_query(address):
+    # 検索語も同じ規則で分解し、各列の完全一致・前方一致（インデックス参照）で絞り込む
+    parts = parse_address(address)
+    prefecture = parts['address_prefecture']
+    municipality = parts['address_municipality']
+    town = parts['address_town']
+    number = parts['address_number']
+
+    query = Q()
+    if prefecture:
+        query &= Q(address_prefecture=prefecture)
+    if municipality:
+        if town or number:
+            query &= Q(address_municipality=municipality)
+        elif prefecture:
+            query &= Q(address_municipality__startswith=municipality)
+        else:
+            # 「山下町」のように町域名だけが入力された場合にも対応する
+            query &= Q(address_municipality__startswith=municipality) | Q(address_town__startswith=municipality)
+    if town:
+        if municipality:
+            query &= Q(address_town=town) if number else Q(address_town__startswith=town)
+        else:
+            query &= Q(address_municipality__startswith=town) | Q(address_town__startswith=town)
+    if number:
+        query &= Q(address_number__startswith=number)
+    return query
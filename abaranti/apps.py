@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AbarantiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'abaranti'
+
+    def ready(self):
+        from . import signals  # noqa: F401  シグナルの登録
@@ -0,0 +1,85 @@
+from contextvars import ContextVar
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedTreatment, Treatment, TreatmentArchiveWatermark
+from .routers import PRIMARY
+
+# -------------------------------------------------------------------
+# 処置の保管（古い処置を保管用の表へ移す）
+# TREATMENT_ARCHIVE_DAYS 日より前の処置を、古い順に一定件数ずつ1トランザクションで移す
+# 移し終えた位置は移した処置と同じトランザクションで記録するため、途中で止めても続きから再実行できる
+# 処置履歴は移し終えた日時（archived_through）以前を検索する場合だけ保管用の表を読む
+# -------------------------------------------------------------------
+ARCHIVED_THROUGH_KEY = 'abaranti:archive:treatment'
+FIELDS = ('id', 'patient_id', 'medicine_id', 'quantity', 'date', 'doctor_id')
+_MISSING = object()
+_moving = ContextVar('abaranti_archive_moving', default=False)
+
+
+def moving_to_archive():
+    # 保管用の表へ移すための削除中か（削除のシグナルで使用量の集計表を戻さないために参照する）
+    return _moving.get()
+
+
+def archive_cutoff(today=None, days=None):
+    today = today or timezone.localdate()
+    days = days if days is not None else getattr(settings, 'TREATMENT_ARCHIVE_DAYS', 365)
+    return timezone.make_aware(datetime.combine(today - timedelta(days=days), time.min))
+
+
+def archived_through():
+    # 保管用の表にある処置の最も新しい日時（まだ移していなければ None）
+    value = cache.get(ARCHIVED_THROUGH_KEY, _MISSING)
+    if value is _MISSING:
+        watermark = TreatmentArchiveWatermark.objects.using(PRIMARY).first()
+        value = watermark.archived_through if watermark else None
+        cache.set(ARCHIVED_THROUGH_KEY, value, timeout=None)
+    return value
+
+
+def archive_batch(cutoff, batch_size):
+    # 戻り値: 移した件数
+    with transaction.atomic():
+        rows = list(Treatment.objects.filter(date__lt=cutoff).order_by('date', 'id')
+                    .select_for_update().values_list(*FIELDS)[:batch_size])
+        if not rows:
+            return 0
+        ArchivedTreatment.objects.bulk_create([ArchivedTreatment(**dict(zip(FIELDS, row))) for row in rows])
+        # 移す処置は取り消すわけではなく、在庫・使用量の集計は変わらない
+        # そのため、削除のシグナル（signals.remove_medicine_usage）が集計表を戻さないよう、移している間だけ目印を立てる
+        token = _moving.set(True)
+        try:
+            Treatment.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        finally:
+            _moving.reset(token)
+        last_id, last_date = rows[-1][0], rows[-1][4]
+        watermark = TreatmentArchiveWatermark.objects.select_for_update().first()
+        if watermark is None:
+            watermark = TreatmentArchiveWatermark(archived_through=last_date, last_id=last_id)
+        elif last_date >= watermark.archived_through:
+            watermark.archived_through, watermark.last_id = last_date, last_id
+        watermark.save()
+        through = watermark.archived_through
+        transaction.on_commit(lambda: cache.set(ARCHIVED_THROUGH_KEY, through, timeout=None))
+    return len(rows)
+
+
+def archive_treatments(cutoff=None, batch_size=5000, max_batches=None, progress=None):
+    # 戻り値: 移した件数の合計
+    cutoff = cutoff or archive_cutoff()
+    report = progress or (lambda moved: None)
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        report(moved)
+    return moved
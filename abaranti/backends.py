@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .models import Employee
+
+# -------------------------------------------------------------------
+# ログイン中の従業員のキャッシュ
+# リクエストごとの従業員テーブルの検索をなくすため、必要な項目だけをキャッシュに保存する
+# -------------------------------------------------------------------
+SNAPSHOT_FIELDS = ('username', 'first_name', 'last_name', 'role', 'is_active', 'is_staff', 'is_superuser',
+                   'session_auth_hash')
+
+
+def employee_cache_key(username):
+    return f'abaranti:employee:{username}'
+
+
+class EmployeeSnapshot:
+    __slots__ = SNAPSHOT_FIELDS + ('_employee', 'backend')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, *values):
+        for name, value in zip(SNAPSHOT_FIELDS, values):
+            setattr(self, name, value)
+        self._employee = None
+
+    @classmethod
+    def from_employee(cls, employee):
+        # session_auth_hash はパスワードハッシュから作られる値で、パスワード変更時のログアウト判定に使う
+        return cls(*(getattr(employee, name) for name in SNAPSHOT_FIELDS[:-1]), employee.get_session_auth_hash())
+
+    def to_tuple(self):
+        return tuple(getattr(self, name) for name in SNAPSHOT_FIELDS)
+
+    @property
+    def pk(self):
+        return self.username
+
+    def get_username(self):
+        return self.username
+
+    def get_session_auth_hash(self):
+        return self.session_auth_hash
+
+    def get_session_auth_fallback_hash(self):
+        return iter(())
+
+    def get_employee(self):
+        # 更新などでモデルが必要な場合だけ DB から読み込む
+        if self._employee is None:
+            self._employee = Employee._default_manager.get(pk=self.username)
+        return self._employee
+
+    def __getattr__(self, name):
+        # スナップショットにない属性（権限の確認など）は従業員モデルに委ねる
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get_employee(), name)
+
+    def __eq__(self, other):
+        return isinstance(other, (EmployeeSnapshot, Employee)) and self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.username)
+
+    def __str__(self):
+        return self.username
+
+
+class CachedEmployeeBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = employee_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            employee = Employee._default_manager.filter(pk=user_id).first()
+            if employee is None:
+                return None
+            snapshot = EmployeeSnapshot.from_employee(employee)
+            cache.set(key, snapshot.to_tuple(), getattr(settings, 'EMPLOYEE_CACHE_TTL', 300))
+        else:
+            snapshot = EmployeeSnapshot(*values)
+        return snapshot if self.user_can_authenticate(snapshot) else None
+
+
+def invalidate_employee(username):
+    cache.delete(employee_cache_key(username))
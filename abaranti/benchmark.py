@@ -0,0 +1,124 @@
+import json
+import statistics
+import time
+from contextlib import ExitStack
+from datetime import date, timedelta
+
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Hospital, Patient
+from .seed import BENCHMARK_PASSWORD, BENCHMARK_USERS
+
+# -------------------------------------------------------------------
+# 画面ごとの性能測定
+# テストクライアントから各画面を繰り返し呼び出し、所要時間（p50 / p95）と発行クエリ数を記録する
+# -------------------------------------------------------------------
+HOSPITAL_LIST_DEEP_PAGE = 50
+
+
+def percentile(sorted_values, ratio):
+    return sorted_values[min(int(len(sorted_values) * ratio), len(sorted_values) - 1)]
+
+
+def build_scenarios(client):
+    # 測定に使う検索条件は登録済みのデータから決める
+    patient = Patient.objects.order_by('pk').first()
+    hospital = Hospital.objects.exclude(address_municipality='').order_by('pk').first()
+    if patient is None or hospital is None:
+        raise ValueError('測定用のデータがありません。先に seed_benchmark_data を実行してください。')
+
+    # 一覧の深いページのカーソルは、先頭から次ページをたどって取得しておく
+    cursor = None
+    for _ in range(HOSPITAL_LIST_DEEP_PAGE - 1):
+        page_obj = client.get(reverse('hospital_list'), {'cursor': cursor} if cursor else {}).context['page_obj']
+        if not page_obj.has_next():
+            break
+        cursor = page_obj.next_cursor
+
+    username, _ = BENCHMARK_USERS['reception']
+    return {
+        # ログイン画面（login_view）の表示と、認証・セッションの作成を測る
+        # （login_view の遷移先の役割ごとのメニュー画面はこのリポジトリに未実装のため、送信後の遷移は含めない）
+        'login': lambda: (client.get(reverse('login')),
+                          client.login(username=username, password=BENCHMARK_PASSWORD))[0],
+        'patient_search_by_name': lambda: client.post(reverse('patient_search_by_name'),
+                                                      {'patientName': patient.last_name}),
+        'patient_autocomplete': lambda: client.get(reverse('patient_autocomplete'),
+                                                   {'q': patient.last_name_kana[:2] or patient.last_name}),
+        'hospital_search_by_address': lambda: client.post(reverse('hospital_search_by_address'),
+                                                          {'address': hospital.address_municipality}),
+        'hospital_search_by_capital': lambda: client.get(reverse('hospital_search_by_capital'),
+                                                         {'capital_min': 1000, 'capital_max': 50000,
+                                                          'emergency': 1}),
+        'hospital_list': lambda: client.get(reverse('hospital_list')),
+        f'hospital_list_page_{HOSPITAL_LIST_DEEP_PAGE}': lambda: client.get(reverse('hospital_list'),
+                                                                            {'cursor': cursor} if cursor else {}),
+        'hospital_list_by_capital': lambda: client.get(reverse('hospital_list'), {'sort': '-capital'}),
+        'treatment_history': lambda: client.get(reverse('treatment_history_api'),
+                                                {'patient_id': patient.patient_id}),
+        'insurance_expiry': lambda: client.get(reverse('patient_check_insurance_expiry'), {'bucket': '30'}),
+        'medicine_usage_daily': lambda: client.get(reverse('medicine_usage_report'), {
+            'period': 'day', 'date_from': date.today() - timedelta(days=30), 'date_to': date.today()}),
+        'medicine_usage_monthly': lambda: client.get(reverse('medicine_usage_report'), {
+            'period': 'month', 'date_from': date.today() - timedelta(days=730), 'date_to': date.today()}),
+    }
+
+
+def measure(request, iterations, warmup=2):
+    for _ in range(warmup):
+        request()
+    timings = []
+    queries = 0
+    status = None
+    for _ in range(iterations):
+        with ExitStack() as stack:
+            captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            response = request()
+            timings.append(time.perf_counter() - started)
+        queries = max(queries, sum(len(capture) for capture in captures))
+        status = response.status_code
+    timings.sort()
+    return {
+        'status': status,
+        'queries': queries,
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'iterations': iterations,
+    }
+
+
+def run(iterations=20, only=None):
+    username, _ = BENCHMARK_USERS['reception']
+    client = Client()
+    client.login(username=username, password=BENCHMARK_PASSWORD)
+    scenarios = build_scenarios(client)
+    results = {}
+    for name, request in scenarios.items():
+        if only and name not in only:
+            continue
+        results[name] = measure(request, iterations)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    # p95 が基準値より threshold の割合以上遅くなった画面、クエリ数が増えた画面を返す
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {base["p95_ms"]}ms → {result["p95_ms"]}ms')
+        if result['queries'] > base['queries']:
+            regressions.append(f'{name}: クエリ数 {base["queries"]} → {result["queries"]}')
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
@@ -0,0 +1,51 @@
+from django.core.cache import cache
+
+from .models import Medicine
+
+# -------------------------------------------------------------------
+# 薬剤マスタのキャッシュ（プロセス内）
+# 世代番号を Django のキャッシュに置き、他のプロセスでの更新も世代の変化で検知する
+# -------------------------------------------------------------------
+GENERATION_KEY = 'abaranti:medicine_catalog:generation'
+
+# (世代番号, {薬剤ID: (薬剤名, 単位)})
+_catalog = (None, {})
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def get_catalog():
+    global _catalog
+    generation = _generation()
+    if _catalog[0] != generation:
+        medicines = Medicine.objects.order_by('medicineid').values_list('medicineid', 'medicinename', 'unit')
+        _catalog = (generation, {medicine_id: (name, unit) for medicine_id, name, unit in medicines})
+    return _catalog[1]
+
+
+def invalidate():
+    global _catalog
+    _catalog = (None, {})
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # キーがない（期限切れ・未作成）場合は新しい世代として作成する
+        cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def medicine_choices():
+    return [(medicine_id, name) for medicine_id, (name, _) in get_catalog().items()]
+
+
+def get_medicine(medicine_id):
+    # テンプレート表示用に、DB を参照せずに薬剤オブジェクトを組み立てる
+    entry = get_catalog().get(medicine_id)
+    if entry is None:
+        return None
+    return Medicine(medicineid=medicine_id, medicinename=entry[0], unit=entry[1])
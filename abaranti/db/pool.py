@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError
+
+# -------------------------------------------------------------------
+# DB 接続のプール（ワーカープロセスごと）
+# リクエストの終了時に接続を閉じずにプールへ返し、次のリクエストで再利用する
+# 同時に開く接続の数は SIZE までに制限する
+# -------------------------------------------------------------------
+POOL_DEFAULTS = {
+    'SIZE': 5,        # 1プロセスあたりの最大接続数
+    'RECYCLE': 300,   # この秒数以上使われていない接続は閉じて作り直す
+    'TIMEOUT': 10,    # 空きがない場合に待つ秒数
+}
+
+logger = logging.getLogger('abaranti.db.pool')
+
+
+class ConnectionPool:
+    # errors: 接続の確認・切断で失敗とみなすドライバの例外（それ以外の例外はそのまま送出する）
+    def __init__(self, size, recycle, timeout, errors):
+        if size < 1:
+            raise ImproperlyConfigured('POOL の SIZE は1以上を指定してください。')
+        self.size = size
+        self.recycle = recycle
+        self.timeout = timeout
+        self.errors = errors
+        self.idle = deque()  # (接続, 返却時刻) 最後に返却された接続から使う
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f'DB 接続プールに空きがありません（最大 {self.size}）。')
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    raw, returned_at = self.idle.pop()
+                if time.monotonic() - returned_at >= self.recycle or not self.is_alive(raw):
+                    self.discard(raw)
+                    continue
+                self.reused += 1
+                return raw
+            raw = connect()
+            self.created += 1
+            return raw
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, raw):
+        try:
+            # 未確定のトランザクションを次の利用者に持ち越さない
+            raw.rollback()
+        except self.errors as e:
+            logger.debug('プールへ返却する接続のロールバックに失敗しました: %r', e)
+            self.discard(raw)
+        else:
+            with self.lock:
+                self.idle.append((raw, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for raw, _ in idle:
+            self.discard(raw)
+
+    def is_alive(self, raw):
+        # 再利用の前に接続が生きているかを確認する
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.errors as e:
+            logger.debug('プール内の接続が切れていたため作り直します: %r', e)
+            return False
+        return True
+
+    def discard(self, raw):
+        try:
+            raw.close()
+        except self.errors as e:
+            logger.debug('プール内の接続を閉じられませんでした: %r', e)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict, errors):
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            options = {**POOL_DEFAULTS, **(settings_dict.get('POOL') or {})}
+            pool = _pools[alias] = ConnectionPool(int(options['SIZE']), float(options['RECYCLE']),
+                                                  float(options['TIMEOUT']), errors)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.clear()
+
+
+class PooledDatabaseWrapperMixin:
+    # Django の接続クラスに重ねて、接続の作成・切断をプールからの貸出・返却に置き換える
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict,
+                        (self.Database.DatabaseError, self.Database.InterfaceError))
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire(lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -0,0 +1,72 @@
+from django.db.models import Count, Q
+
+from .models import BLOCKING_KEY_FIELDS, Patient
+from .text import insurance_key, name_birth_key
+
+# -------------------------------------------------------------------
+# 患者の重複候補
+# 登録時: 検出キー（読み + 生年月日、保険証記号番号のハッシュ値）のどちらかが一致する患者を、索引の検索1回で求める
+# 一括: キーごとに2件以上ある値だけを集計で求め、同じキーを持つ患者を union-find でまとめる（患者数にほぼ比例）
+# -------------------------------------------------------------------
+DUPLICATE_LIMIT = 10
+REASONS = {'name_birth_key': '読み・生年月日', 'insurance_key': '保険証記号番号'}
+
+
+def probable_duplicates(data, exclude_pk=None, limit=DUPLICATE_LIMIT):
+    # data: 登録フォームの入力値（cleaned_data など）
+    # 戻り値: (患者, 一致したキーの説明のリスト) のリスト
+    keys = {
+        'name_birth_key': name_birth_key(data['last_name'], data['first_name'], data.get('last_name_kana', ''),
+                                         data.get('first_name_kana', ''), data['birthdate']),
+        'insurance_key': insurance_key(data['insurance_number']),
+    }
+    query = Q()
+    for field, value in keys.items():
+        if value:
+            query |= Q(**{field: value})
+    if not query:
+        return []
+    patients = Patient.objects.filter(query).order_by('patient_id')
+    if exclude_pk is not None:
+        patients = patients.exclude(pk=exclude_pk)
+    return [
+        (patient, [REASONS[field] for field, value in keys.items() if value and getattr(patient, field) == value])
+        for patient in patients[:limit]
+    ]
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        # 経路を圧縮する
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def find_clusters(batch_size=1000):
+    # 戻り値: 重複候補の患者IDのまとまり（患者IDの順）のリスト
+    groups = UnionFind()
+    for field in BLOCKING_KEY_FIELDS:
+        # 2件以上の患者が持つキーの値だけを集計で求め、その患者だけを読み込む
+        shared = list(Patient.objects.exclude(**{field: ''}).values(field).annotate(count=Count('pk'))
+                      .filter(count__gt=1).values_list(field, flat=True).order_by())
+        for i in range(0, len(shared), batch_size):
+            first_by_key = {}
+            rows = Patient.objects.filter(**{f'{field}__in': shared[i:i + batch_size]}).values_list(field, 'pk')
+            for key, patient_id in rows.iterator(chunk_size=batch_size):
+                groups.union(first_by_key.setdefault(key, patient_id), patient_id)
+    clusters = {}
+    for patient_id in groups.parent:
+        clusters.setdefault(groups.find(patient_id), []).append(patient_id)
+    return sorted(sorted(members) for members in clusters.values() if len(members) > 1)
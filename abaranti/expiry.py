@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import InsuranceExpiryCount, Patient
+
+# -------------------------------------------------------------------
+# 保険証有効期限の区分
+# expired: 期限切れ / 7, 30, 90: 本日から N 日以内に期限切れ
+# -------------------------------------------------------------------
+EXPIRY_BUCKETS = (
+    ('expired', '期限切れ'),
+    ('7', '7日以内'),
+    ('30', '30日以内'),
+    ('90', '90日以内'),
+)
+
+
+def bucket_range(bucket, today=None):
+    # 区分に対応する有効期限の範囲 (開始日, 終了日)。None は上限・下限なし
+    today = today or date.today()
+    if bucket == 'expired':
+        return None, today - timedelta(days=1)
+    return today, today + timedelta(days=int(bucket))
+
+
+def bucket_filter(bucket, field='insurance_exp', today=None):
+    start, end = bucket_range(bucket, today)
+    query = Q(**{f'{field}__lte': end})
+    if start is not None:
+        query &= Q(**{f'{field}__gte': start})
+    return query
+
+
+def bucket_counts(today=None):
+    # 集計表（有効期限ごとの件数）から、区分ごとの件数を1回の集計で求める
+    totals = InsuranceExpiryCount.objects.aggregate(**{
+        bucket: Sum('count', filter=bucket_filter(bucket, today=today)) for bucket, _ in EXPIRY_BUCKETS
+    })
+    return [(bucket, label, totals[bucket] or 0) for bucket, label in EXPIRY_BUCKETS]
+
+
+def adjust_count(insurance_exp, delta):
+    if insurance_exp is None or delta == 0:
+        return
+    updated = InsuranceExpiryCount.objects.filter(insurance_exp=insurance_exp).update(count=F('count') + delta)
+    if not updated:
+        try:
+            with transaction.atomic():
+                InsuranceExpiryCount.objects.create(insurance_exp=insurance_exp, count=delta)
+        except IntegrityError:
+            # 同時に作成された場合は加算し直す
+            InsuranceExpiryCount.objects.filter(insurance_exp=insurance_exp).update(count=F('count') + delta)
+
+
+def rebuild_counts():
+    rows = Patient.objects.values('insurance_exp').annotate(count=Count('pk')).order_by()
+    with transaction.atomic():
+        InsuranceExpiryCount.objects.all().delete()
+        InsuranceExpiryCount.objects.bulk_create(
+            [InsuranceExpiryCount(insurance_exp=row['insurance_exp'], count=row['count']) for row in rows],
+            batch_size=1000,
+        )
+    return len(rows)
@@ -0,0 +1,134 @@
+import csv
+import heapq
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .archive import archived_through
+from .expiry import bucket_filter
+from .models import ArchivedTreatment, Hospital, Patient, Treatment
+
+# -------------------------------------------------------------------
+# データ出力（CSV / JSON）
+# 主キー順に一定件数ずつ読み込み、1行ずつ書き出すため、件数に関わらずメモリ使用量は一定
+# -------------------------------------------------------------------
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = {
+    'patients': ('patient_id', 'last_name', 'first_name', 'gender', 'birthdate', 'insurance_number',
+                 'insurance_exp'),
+    'hospitals': ('hospital_id', 'hospital_name', 'hospital_address', 'phone_number', 'capital', 'emergency'),
+    'treatments': ('id', 'patient_id', 'medicine_id', 'medicine__medicinename', 'quantity', 'date'),
+}
+
+
+def export_querysets(kind, filters):
+    # 戻り値: 出力する行の検索のリスト（処置は、保管用の表に移した処置も含めるため2つになる場合がある）
+    if kind == 'patients':
+        queryset = Patient.objects.all()
+        if filters.get('bucket'):
+            queryset = queryset.filter(bucket_filter(filters['bucket']))
+    elif kind == 'hospitals':
+        queryset = Hospital.objects.all()
+        if filters.get('emergency') is not None:
+            queryset = queryset.filter(emergency=filters['emergency'])
+    elif kind == 'treatments':
+        conditions = {}
+        if filters.get('date_from'):
+            conditions['date__gte'] = timezone.make_aware(datetime.combine(filters['date_from'], time.min))
+        if filters.get('date_to'):
+            end = datetime.combine(filters['date_to'] + timedelta(days=1), time.min)
+            conditions['date__lt'] = timezone.make_aware(end)
+        querysets = [Treatment.objects.filter(**conditions)]
+        # 保管用の表は、期間が移し終えた日時以前に及ぶ場合だけ読む
+        cold_until = archived_through()
+        if cold_until is not None and conditions.get('date__gte', cold_until) <= cold_until:
+            querysets.append(ArchivedTreatment.objects.filter(**conditions))
+        return querysets
+    else:
+        raise ValueError(f'unknown export: {kind}')
+    return [queryset]
+
+
+def export_count(kind, filters):
+    return sum(queryset.count() for queryset in export_querysets(kind, filters))
+
+
+def iterate_rows(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    # OFFSET を使わず、前の塊の最後の主キーから続きを読む（MySQL でも結果全体を保持しない）
+    pk_name = queryset.model._meta.pk.attname
+    queryset = queryset.order_by(pk_name).values_list(*fields)
+    pk_index = fields.index(pk_name)
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(**{f'{pk_name}__gt': last_pk})
+        rows = list(chunk[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][pk_index]
+
+
+class _Echo:
+    # csv.writer の書き込み先（書いた文字列をそのまま返す）
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def json_chunks(rows, fields):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False)
+        separator = ',\n'
+    yield ']\n'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip 形式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def counting(rows, progress, every=EXPORT_CHUNK_SIZE):
+    # 一定件数ごとに、書き出した件数を progress に渡す
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            progress(count)
+    progress(count)
+
+
+def merged_rows(querysets, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    # 複数の表（新しい処置・保管した処置）の行を、主キーの順に並べて1つの出力にする
+    streams = [iterate_rows(queryset, fields, chunk_size) for queryset in querysets]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=itemgetter(fields.index(querysets[0].model._meta.pk.attname)))
+
+
+def export_chunks(kind, filters, output_format='csv', compress=False, progress=None):
+    fields = EXPORT_FIELDS[kind]
+    rows = merged_rows(export_querysets(kind, filters), fields)
+    if progress is not None:
+        rows = counting(rows, progress)
+    chunks = json_chunks(rows, fields) if output_format == 'json' else csv_chunks(rows, fields)
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -1,5 +1,9 @@
 from django import forms
-from .models import Employee, Hospital, Supplier, Patient, Medicine, Treatment
+from .models import Employee, Hospital, Patient, Medicine
+from .catalog import medicine_choices
+from .expiry import EXPIRY_BUCKETS
+from .text import normalize
+from .usage import REPORT_PERIODS
 
 
 class LoginForm(forms.Form):
@@ -36,6 +40,11 @@ class EmployeeRegistrationForm(forms.ModelForm):
 
 # 従業員更新フォーム (E102)
 class EmployeeUpdateForm(EmployeeRegistrationForm):
+    # 登録フォームで追加した項目は変更画面では使わない
+    user_id = None
+    password = None
+    confirm_password = None
+
     class Meta(EmployeeRegistrationForm.Meta):
         fields = ['first_name', 'last_name']  # パスワードとロールは変更不可
 
@@ -65,6 +74,26 @@ class HospitalRegistrationForm(forms.ModelForm):
             raise forms.ValidationError('資本金には数値を入力してください。')
 
 
+# 他病院検索フォーム (H104) 資本金の範囲・救急対応・住所で絞り込む
+class HospitalSearchForm(forms.Form):
+    capital_min = forms.IntegerField(label='資本金（下限）', min_value=0, required=False)
+    capital_max = forms.IntegerField(label='資本金（上限）', min_value=0, required=False)
+    emergency = forms.TypedChoiceField(label='救急対応', choices=(('', 'すべて'), (1, 'あり'), (0, 'なし')),
+                                       coerce=int, empty_value=None, required=False)
+    address = forms.CharField(label='住所', max_length=64, required=False)
+    sort = forms.ChoiceField(label='並び順', choices=(('capital', '資本金（昇順）'), ('-capital', '資本金（降順）')),
+                             required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        capital_min = cleaned_data.get('capital_min')
+        capital_max = cleaned_data.get('capital_max')
+
+        if capital_min is not None and capital_max is not None and capital_min > capital_max:
+            raise forms.ValidationError('資本金の下限は上限以下の値を入力してください。')
+        return cleaned_data
+
+
 # 他病院更新フォーム (H105)
 class HospitalUpdateForm(HospitalRegistrationForm):
     class Meta(HospitalRegistrationForm.Meta):
@@ -78,11 +107,14 @@ class PatientRegistrationForm(forms.ModelForm):
 
     class Meta:
         model = Patient
-        fields = ['patient_id', 'last_name', 'first_name', 'gender', 'birthdate', 'insurance_number', 'insurance_exp']
+        fields = ['patient_id', 'last_name', 'first_name', 'last_name_kana', 'first_name_kana', 'gender', 'birthdate',
+                  'insurance_number', 'insurance_exp']
         labels = {
             'patient_id': '患者ID',
             'last_name': '姓',
             'first_name': '名',
+            'last_name_kana': '姓（フリガナ）',
+            'first_name_kana': '名（フリガナ）',
             'gender': '性別',
             'birthdate': '生年月日',
             'insurance_number': '保険証記号番号',
@@ -98,6 +130,13 @@ class PatientRegistrationForm(forms.ModelForm):
             raise forms.ValidationError("保険証記号番号が一致しません")
         return cleaned_data
 
+    # 読みはひらがな・半角カナで入力されてもカタカナに揃える
+    def clean_last_name_kana(self):
+        return normalize(self.cleaned_data['last_name_kana'])
+
+    def clean_first_name_kana(self):
+        return normalize(self.cleaned_data['first_name_kana'])
+
 
 # 患者保険証変更フォーム (P102)
 class PatientInsuranceChangeForm(forms.ModelForm):
@@ -122,18 +161,108 @@ class PatientInsuranceChangeForm(forms.ModelForm):
         return cleaned_data
 
 
-# 薬剤投与指示フォーム (D101)
-class MedicationInstructionForm(forms.ModelForm):
+# 薬剤登録フォーム
+class MedicineRegistrationForm(forms.ModelForm):
     class Meta:
-        model = Treatment
-        fields = ['medicine', 'quantity']
+        model = Medicine
+        fields = ['medicineid', 'medicinename', 'unit']
         labels = {
-            'medicine': '薬剤',
-            'quantity': '数量',
+            'medicineid': '薬剤ID',
+            'medicinename': '薬剤名',
+            'unit': '単位',
         }
 
-    def __init__(self, *args, medicines=None, **kwargs):  # medicines を引数に追加
+
+# 薬剤投与指示フォーム（複数行入力の1行分）
+# 薬剤の存在確認は1行ずつではなく、フォームセット全体でまとめて行う
+class MedicationInstructionLineForm(forms.Form):
+    medicine = forms.CharField(label='薬剤', max_length=8, required=False, widget=forms.Select)
+    quantity = forms.IntegerField(label='数量', min_value=1, required=False)
+
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if medicines:
-            self.fields['medicine'].queryset = medicines  # ビュー関数から渡された medicines を使用する
+        # 選択肢は薬剤マスタのキャッシュから、画面表示時に読み込む
+        self.fields['medicine'].widget.choices = lambda: [('', '---------'), *medicine_choices()]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        medicine = cleaned_data.get('medicine')
+        quantity = cleaned_data.get('quantity')
+
+        if medicine and not quantity:
+            raise forms.ValidationError('数量を入力してください。')
+        if quantity and not medicine:
+            raise forms.ValidationError('薬剤を選択してください。')
+        return cleaned_data
+
+
+class BaseMedicationInstructionFormSet(forms.BaseFormSet):
+    def clean(self):
+        if any(self.errors):
+            return
+        self.lines = [(form.cleaned_data['medicine'], form.cleaned_data['quantity'])
+                      for form in self.forms if form.cleaned_data.get('medicine')]
+        if not self.lines:
+            raise forms.ValidationError('薬剤を1件以上入力してください。')
+        # 入力された薬剤IDを1回の IN 検索でまとめて確認する
+        medicine_ids = {medicine for medicine, _ in self.lines}
+        found = set(Medicine.objects.filter(pk__in=medicine_ids).values_list('pk', flat=True))
+        missing = medicine_ids - found
+        if missing:
+            raise forms.ValidationError(f'存在しない薬剤が含まれています: {", ".join(sorted(missing))}')
+
+
+MedicationInstructionFormSet = forms.formset_factory(
+    MedicationInstructionLineForm, formset=BaseMedicationInstructionFormSet, extra=5, max_num=20, validate_max=True,
+)
+
+
+# 処置履歴確認フォーム (D103)
+class TreatmentHistoryForm(forms.Form):
+    patient_id = forms.CharField(label='患者ID', max_length=8, required=True)
+    date_from = forms.DateField(label='開始日', required=False)
+    date_to = forms.DateField(label='終了日', required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError('開始日は終了日以前の日付を入力してください。')
+        return cleaned_data
 
+
+# データ出力フォーム（絞り込み条件）
+class ExportForm(forms.Form):
+    format = forms.ChoiceField(label='形式', choices=(('csv', 'CSV'), ('json', 'JSON')), required=False)
+    date_from = forms.DateField(label='開始日', required=False)
+    date_to = forms.DateField(label='終了日', required=False)
+    bucket = forms.ChoiceField(label='保険証有効期限', choices=(('', 'すべて'),) + EXPIRY_BUCKETS, required=False)
+    emergency = forms.TypedChoiceField(label='救急対応', choices=(('', 'すべて'), (1, 'あり'), (0, 'なし')),
+                                       coerce=int, empty_value=None, required=False)
+    gzip = forms.BooleanField(label='gzip 圧縮', required=False)
+    background = forms.BooleanField(label='バックグラウンドで作成', required=False)
+
+
+# 薬剤使用量の報告フォーム
+class MedicineUsageReportForm(forms.Form):
+    # 日別は1年分まで（報告は集計表の行数 = 日数 × 薬剤数に比例するため）
+    MAX_DAILY_RANGE = 366
+
+    period = forms.ChoiceField(label='集計単位', choices=REPORT_PERIODS, initial='day')
+    date_from = forms.DateField(label='開始日')
+    date_to = forms.DateField(label='終了日')
+    medicine = forms.CharField(label='薬剤ID', max_length=8, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+
+        if date_from and date_to:
+            if date_from > date_to:
+                raise forms.ValidationError('開始日は終了日以前の日付を入力してください。')
+            if cleaned_data.get('period') == 'day' and (date_to - date_from).days >= self.MAX_DAILY_RANGE:
+                raise forms.ValidationError('日別の集計は1年以内の期間を指定してください。')
+        return cleaned_data
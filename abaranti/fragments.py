@@ -0,0 +1,62 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+from . import metrics
+from .routers import PRIMARY, current_read_database
+
+# -------------------------------------------------------------------
+# 他病院の一覧・検索結果の描画結果のキャッシュ
+# 他病院の登録・変更で世代番号を進め、古い世代のキャッシュは参照されなくなる（期限切れで消える）
+# -------------------------------------------------------------------
+GENERATION_KEY = 'abaranti:hospital:generation'
+CHANGED_AT_KEY = 'abaranti:hospital:changed_at'
+
+
+def _generation():
+    values = cache.get_many([GENERATION_KEY, CHANGED_AT_KEY])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation, values.get(CHANGED_AT_KEY)
+
+
+def invalidate():
+    cache.set(CHANGED_AT_KEY, time.time(), timeout=None)
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def _key(name, generation, params):
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+    return f'abaranti:fragment:{name}:{generation}:{digest}'
+
+
+def _storable(changed_at):
+    # 変更直後はレプリカに未反映の場合があるため、レプリカから読んだ結果は保存しない
+    if current_read_database() == PRIMARY or changed_at is None:
+        return True
+    return time.time() - changed_at >= getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def cached_render(request, name, params, template_name, get_context):
+    # params は正規化済みの検索条件・ページ（同じ条件なら同じキーになる）
+    generation, changed_at = _generation()
+    key = _key(name, generation, params)
+    content = cache.get(key)
+    if content is not None:
+        metrics.observe('abaranti_fragment_cache_hits_total', name, 1)
+        return HttpResponse(content)
+    metrics.observe('abaranti_fragment_cache_misses_total', name, 1)
+    content = render_to_string(template_name, get_context(), request)
+    if _storable(changed_at):
+        cache.set(key, content, getattr(settings, 'FRAGMENT_CACHE_TTL', 600))
+    return HttpResponse(content)
@@ -0,0 +1,46 @@
+import heapq
+import math
+
+# -------------------------------------------------------------------
+# 位置情報（グリッドインデックスと近傍検索）
+# 緯度経度を一定幅の格子に区切り、格子番号 (grid_y, grid_x) で絞り込んでから距離を計算する
+# -------------------------------------------------------------------
+GRID_SIZE = 0.05  # 格子の幅（度）。緯度方向で約5.5km
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_RADIUS = 512  # 探索する最大の格子数（日本全域をカバー）
+
+
+def grid_cell(latitude, longitude):
+    return math.floor(latitude / GRID_SIZE), math.floor(longitude / GRID_SIZE)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # ハーバーサイン公式による2点間の距離
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _covered_km(latitude, radius):
+    # 中心の格子から radius 格子分の範囲で、確実に含まれる距離（経度方向は高緯度ほど狭い）
+    edge = min(abs(latitude) + (radius + 1) * GRID_SIZE, 89.0)
+    return radius * GRID_SIZE * KM_PER_DEGREE * math.cos(math.radians(edge))
+
+
+def nearest(queryset, latitude, longitude, k=5):
+    # 探索範囲を倍々に広げ、範囲内で k 件が確定した時点で打ち切る
+    cell_y, cell_x = grid_cell(latitude, longitude)
+    radius = 1
+    while True:
+        candidates = queryset.filter(
+            grid_y__range=(cell_y - radius, cell_y + radius),
+            grid_x__range=(cell_x - radius, cell_x + radius),
+        )
+        scored = [(distance_km(latitude, longitude, obj.latitude, obj.longitude), obj) for obj in candidates]
+        top = heapq.nsmallest(k, scored, key=lambda item: item[0])
+        if (len(top) == k and top[-1][0] <= _covered_km(latitude, radius)) or radius >= MAX_RADIUS:
+            return top
+        radius *= 2
@@ -0,0 +1,282 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import usage
+from .archive import archive_cutoff, archive_treatments
+from .expiry import rebuild_counts
+from .export import export_chunks, export_count
+from .forms import ExportForm
+from .models import Job, JobKindLock
+from .search import rebuild_index
+
+# -------------------------------------------------------------------
+# バックグラウンド処理（データ出力・インデックスの再作成・一括登録など）
+# 画面からは Job の行を登録するだけで、run_workers がプロセスプールで取り出して実行する
+# 外部のブローカーは使わず、取り出しは「待機中であれば実行中にする」UPDATE の件数で排他する（SQLite / MySQL 共通）
+# 実行中の処理の更新（完了・失敗）は、取り出した時のワーカー・試行回数のまま実行中の場合だけ行う
+# -------------------------------------------------------------------
+HANDLERS = {}
+
+
+def register(kind):
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def enqueue(kind, params=None, user=None, max_attempts=None):
+    if kind not in HANDLERS:
+        raise ValueError(f'unknown job: {kind}')
+    # user はログイン中の従業員のキャッシュ（EmployeeSnapshot）の場合もあるため、ID で関連付ける
+    return Job.objects.create(
+        kind=kind, params=params or {}, created_by_id=user.pk if user is not None and user.is_authenticated else None,
+        max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3), run_after=timezone.now(),
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# ---- 取り出し（run_workers の親プロセス） ----
+def running_counts():
+    return dict(Job.objects.filter(status=Job.Status.RUNNING).values_list('kind').annotate(count=Count('pk'))
+                .order_by())
+
+
+def saturated_kinds():
+    # 種類ごとの同時実行数の上限（JOB_CONCURRENCY）に達している種類
+    # 候補を絞るための目安で、上限を守るのは claim_job での確認
+    limits = getattr(settings, 'JOB_CONCURRENCY', {})
+    counts = running_counts()
+    return [kind for kind, limit in limits.items() if counts.get(kind, 0) >= limit]
+
+
+def lock_kind(kind, now):
+    # トランザクションが終わるまで、同じ種類の取り出しを待たせる
+    # 行の UPDATE でロックする（MySQL では行ロック、SQLite では書き込みのロックになる）
+    while not JobKindLock.objects.filter(kind=kind).update(locked_at=now):
+        JobKindLock.objects.get_or_create(kind=kind, defaults={'locked_at': now})
+
+
+def claim_job(job_id, kind, worker, now):
+    # 戻り値: 実行中にしたか
+    # 上限のある種類は、ロックを取ってから実行中の件数を数え、同じトランザクションで実行中にする
+    limit = getattr(settings, 'JOB_CONCURRENCY', {}).get(kind)
+    with transaction.atomic():
+        if limit is not None:
+            lock_kind(kind, now)
+            if Job.objects.filter(kind=kind, status=Job.Status.RUNNING).count() >= limit:
+                return False
+        # 他のワーカーが先に取り出した場合は更新件数が 0 になる
+        return bool(Job.objects.filter(pk=job_id, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING, worker=worker, started_at=now, heartbeat_at=now, finished_at=None,
+            attempts=F('attempts') + 1,
+        ))
+
+
+def claim(worker, candidates=5):
+    # 戻り値: 実行中にした Job（実行できるものがなければ None）
+    now = timezone.now()
+    queued = (Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=now, kind__in=list(HANDLERS))
+              .exclude(kind__in=saturated_kinds()).order_by('run_after', 'id').values_list('id', 'kind'))
+    for job_id, kind in queued[:candidates]:
+        if claim_job(job_id, kind, worker, now):
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def heartbeat(job_ids):
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status=Job.Status.RUNNING).update(heartbeat_at=timezone.now())
+
+
+@contextmanager
+def keep_alive(job_ids):
+    # 実行している間、別のスレッドから一定間隔で応答を送る
+    # 進み具合を報告しない処理が、応答の途絶えた処理として他のワーカーに再実行されないようにする
+    stopped = threading.Event()
+    interval = getattr(settings, 'JOB_STALE_SECONDS', 300) / 3
+
+    def beat():
+        try:
+            while not stopped.wait(interval):
+                heartbeat(job_ids)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def requeue_stale():
+    # 応答が JOB_STALE_SECONDS 秒以上途絶えた実行中の処理（ワーカーの停止など）を再試行に回す
+    threshold = timezone.now() - timedelta(seconds=getattr(settings, 'JOB_STALE_SECONDS', 300))
+    for job in Job.objects.filter(status=Job.Status.RUNNING, heartbeat_at__lt=threshold):
+        # 確認した後に応答があった処理はそのままにする
+        fail(job, 'ワーカーからの応答が途絶えました。', heartbeat_at__lt=threshold)
+
+
+# ---- 実行（プロセスプールの子プロセス） ----
+class Progress:
+    # 処理から進み具合を受け取り、一定間隔（JOB_PROGRESS_INTERVAL 秒）ごとに Job に書き込む
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.interval = getattr(settings, 'JOB_PROGRESS_INTERVAL', 1.0)
+        self.written_at = 0.0
+        self.pending = {}
+
+    def __call__(self, done=None, total=None, message=None):
+        if done is not None:
+            self.pending['progress'] = done
+        if total is not None:
+            self.pending['total'] = total
+        if message is not None:
+            self.pending['message'] = message[:255]
+        now = time.monotonic()
+        if now - self.written_at >= self.interval:
+            self.flush()
+            self.written_at = now
+
+    def flush(self):
+        if self.pending:
+            Job.objects.filter(pk=self.job_id).update(heartbeat_at=timezone.now(), **self.pending)
+            self.pending = {}
+
+
+class ProgressStream:
+    # 管理コマンドの出力を、最後の1行だけ進み具合の内容として報告する
+    def __init__(self, progress):
+        self.progress = progress
+
+    def write(self, text):
+        for line in text.splitlines():
+            if line.strip():
+                self.progress(message=line.strip())
+
+    def flush(self):
+        pass
+
+
+def owned(job):
+    # 取り出した時のワーカー・試行回数のまま実行中の Job
+    # 応答が途絶えたとして再試行に回された処理や、他のワーカーが取り出し直した処理は含まない
+    return Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, worker=job.worker, attempts=job.attempts)
+
+
+def run_job(job_id):
+    # 例外は Job に記録し、呼び出し元には返さない
+    job = Job.objects.get(pk=job_id)
+    progress = Progress(job.pk)
+    try:
+        result = HANDLERS[job.kind](job.params, progress)
+    except Exception:
+        progress.flush()
+        fail(job, traceback.format_exc())
+    else:
+        progress.flush()
+        owned(job).update(status=Job.Status.SUCCEEDED, result=result, error='', finished_at=timezone.now())
+
+
+def run_job_in_child(job_id):
+    # プロセスプールの子プロセスから呼ぶ。処理ごとに DB 接続を閉じ、次の処理は新しい接続で行う
+    try:
+        run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def fail(job, error, **conditions):
+    # job: 取り出した時点の Job（まだその試行のまま実行中の場合だけ更新する）
+    # 試行回数が残っていれば、待ち時間（JOB_RETRY_DELAY 秒 × 2^(試行回数-1)）の後に再試行する
+    now = timezone.now()
+    queryset = owned(job).filter(**conditions)
+    if job.attempts < job.max_attempts:
+        delay = getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** max(job.attempts - 1, 0)
+        queryset.update(status=Job.Status.QUEUED, error=error, worker='', run_after=now + timedelta(seconds=delay))
+    else:
+        queryset.update(status=Job.Status.FAILED, error=error, finished_at=now)
+
+
+def import_path(path):
+    # 一括登録で読み込めるのは、取り込み用のディレクトリ（JOB_IMPORT_DIR）の下のファイルだけ
+    # 相対パスは JOB_IMPORT_DIR からのパスとみなす
+    directory = Path(getattr(settings, 'JOB_IMPORT_DIR', settings.BASE_DIR / 'job-import')).resolve()
+    resolved = (directory / path).resolve()
+    if not path or not resolved.is_relative_to(directory):
+        raise ValueError(f'{path} は取り込み用のディレクトリ（{directory}）の下にありません。')
+    return resolved
+
+
+def output_path(job_id, suffix):
+    directory = Path(getattr(settings, 'JOB_OUTPUT_DIR', settings.BASE_DIR / 'job-output'))
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f'job-{job_id}{suffix}'
+
+
+# -------------------------------------------------------------------
+# 処理の種類
+# 引数: (params, progress)  戻り値: 結果（JSON にできる値）
+# progress(処理済みの件数, total=全体の件数, message=内容) で進み具合を報告する
+# -------------------------------------------------------------------
+@register('export')
+def export_job(params, progress):
+    form = ExportForm(params['filters'])
+    if not form.is_valid():
+        raise ValueError(form.errors.as_text())
+    kind = params['kind']
+    output_format = form.cleaned_data['format'] or 'csv'
+    compress = form.cleaned_data['gzip']
+    progress(0, total=export_count(kind, form.cleaned_data))
+    filename = f'{kind}.{output_format}' + ('.gz' if compress else '')
+    path = output_path(progress.job_id, ''.join(Path(filename).suffixes))
+    with open(path, 'wb') as f:
+        for chunk in export_chunks(kind, form.cleaned_data, output_format, compress, progress=progress):
+            f.write(chunk)
+    return {'path': str(path), 'filename': filename, 'size': path.stat().st_size}
+
+
+@register('import_master_data')
+def import_master_data_job(params, progress):
+    path = import_path(params.get('path', ''))
+    call_command('import_master_data', params['kind'], str(path), stdout=ProgressStream(progress))
+    return {'path': str(path)}
+
+
+@register('rebuild_patient_search_index')
+def rebuild_patient_search_index_job(params, progress):
+    return {'count': rebuild_index()}
+
+
+@register('rebuild_insurance_expiry_counts')
+def rebuild_insurance_expiry_counts_job(params, progress):
+    return {'count': rebuild_counts()}
+
+
+@register('rebuild_medicine_usage')
+def rebuild_medicine_usage_job(params, progress):
+    return usage.rebuild()
+
+
+@register('archive_treatments')
+def archive_treatments_job(params, progress):
+    cutoff = archive_cutoff(date.fromisoformat(params['before']), days=0) if params.get('before') else None
+    return {'moved': archive_treatments(cutoff, progress=progress)}
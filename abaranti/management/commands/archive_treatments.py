@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from abaranti.archive import archive_cutoff, archive_treatments, archived_through
+
+
+# 古い処置の保管（日次で実行する。途中で止めても続きから再実行できる）
+class Command(BaseCommand):
+    help = '一定期間より前の処置を、古い順に一定件数ずつ保管用の表へ移します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='この日数より前の処置を移す（既定は TREATMENT_ARCHIVE_DAYS）')
+        parser.add_argument('--before', type=date.fromisoformat, default=None, help='この日付より前の処置を移す（YYYY-MM-DD）')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--max-batches', type=int, default=None, help='1回の実行で移す回数の上限')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            cutoff = archive_cutoff(options['before'], days=0)
+        else:
+            cutoff = archive_cutoff(days=options['days'])
+        moved = archive_treatments(cutoff, batch_size=options['batch_size'], max_batches=options['max_batches'],
+                                   progress=lambda moved: self.stdout.write(f'{moved}件', ending='\r'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{cutoff:%Y-%m-%d} より前の処置 {moved}件を移しました（保管済み: {archived_through() or "なし"} まで）。'))
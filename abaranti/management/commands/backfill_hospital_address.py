@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from abaranti import fragments
+from abaranti.address import ADDRESS_FIELDS
+from abaranti.models import GEO_FIELDS, Hospital
+from abaranti.watermarks import touch
+
+
+# 既存の他病院データの住所を分解して検索用の列（位置情報を含む）に設定する
+class Command(BaseCommand):
+    help = '他病院の住所を分解し、住所検索用の列を設定します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        batch = []
+        count = 0
+        for hospital in Hospital.objects.order_by('pk').iterator(chunk_size=batch_size):
+            hospital.update_address_components()
+            batch.append(hospital)
+            if len(batch) >= batch_size:
+                count += self._flush(batch)
+                batch = []
+        count += self._flush(batch)
+        # bulk_update ではシグナルが呼ばれないため、検索結果のキャッシュをここで破棄する
+        fragments.invalidate()
+        touch('hospital')
+        self.stdout.write(self.style.SUCCESS(f'{count}件の病院の住所を更新しました。'))
+
+    def _flush(self, batch):
+        with transaction.atomic():
+            Hospital.objects.bulk_update(batch, ADDRESS_FIELDS + GEO_FIELDS)
+        return len(batch)
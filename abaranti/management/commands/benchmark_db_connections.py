@@ -0,0 +1,86 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from abaranti.db.pool import close_pools
+
+# 比較する接続方式（接続クラス, CONN_MAX_AGE）
+MODES = {
+    'connect': ('django.db.backends.{vendor}', 0),         # リクエストごとに接続・切断
+    'persistent': ('django.db.backends.{vendor}', None),   # スレッドごとに接続を持ち続ける
+    'pooled': ('abaranti.db.{vendor}', 0),                  # リクエストの終了時にプールへ返す
+}
+
+
+# リクエストごとの接続と接続プールの比較
+class Command(BaseCommand):
+    help = 'リクエストごとに接続する場合と接続を再利用する場合の所要時間を比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--requests', type=int, default=500, help='1スレッドあたりのリクエスト数')
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--pool-size', type=int, default=5)
+        parser.add_argument('--sqlite', action='store_true', help='一時ファイルの SQLite を代わりに使う')
+
+    def handle(self, *args, **options):
+        if options['sqlite']:
+            fd, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            base = {**connections[options['database']].settings_dict, 'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': path}
+        else:
+            path = None
+            base = connections[options['database']].settings_dict
+        vendor = base['ENGINE'].rsplit('.', 1)[-1]
+        if vendor not in ('mysql', 'sqlite3'):
+            raise CommandError(f'{base["ENGINE"]} には対応していません。')
+
+        try:
+            for mode, (engine, max_age) in MODES.items():
+                settings_dict = {**base, 'ENGINE': engine.format(vendor=vendor), 'CONN_MAX_AGE': max_age,
+                                 'POOL': {'SIZE': options['pool_size']}}
+                timings = self.run(mode, settings_dict, options['requests'], options['threads'])
+                timings.sort()
+                p50 = timings[len(timings) // 2] * 1000
+                p95 = timings[int(len(timings) * 0.95)] * 1000
+                self.stdout.write(f'{mode:<10} mean {statistics.fmean(timings) * 1000:.3f}ms / '
+                                  f'p50 {p50:.3f}ms / p95 {p95:.3f}ms（{len(timings)}リクエスト）')
+        finally:
+            close_pools()
+            if path:
+                os.remove(path)
+
+    def run(self, mode, settings_dict, requests, threads):
+        timings = []
+        lock = threading.Lock()
+
+        def worker():
+            # Django と同じくスレッドごとに接続オブジェクトを持つ
+            connection = load_backend(settings_dict['ENGINE']).DatabaseWrapper(dict(settings_dict),
+                                                                               alias=f'benchmark_{mode}')
+            local = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                # リクエストの終了時の処理（CONN_MAX_AGE を過ぎた接続を閉じる）
+                connection.close_if_unusable_or_obsolete()
+                local.append(time.perf_counter() - started)
+            connection.close()
+            with lock:
+                timings.extend(local)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return timings
@@ -0,0 +1,58 @@
+import json
+import platform
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from abaranti import benchmark
+
+
+# 画面ごとの性能測定（結果は JSON に保存し、基準の結果と比較できる）
+class Command(BaseCommand):
+    help = '各画面の所要時間（p50 / p95）とクエリ数を測定します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--compare', metavar='BASELINE', help='基準の結果（JSON）と比較する')
+        parser.add_argument('--threshold', type=float, default=0.2, help='p95 の悪化を回帰とみなす割合')
+        parser.add_argument('--only', nargs='*', help='測定する画面（省略時はすべて）')
+
+    def handle(self, *args, **options):
+        baseline = benchmark.load_results(options['compare']) if options['compare'] else None
+
+        # テストクライアントを使うための設定（testserver の許可・テンプレートの context の記録）
+        setup_test_environment()
+        try:
+            with override_settings(DEBUG=False):
+                results = benchmark.run(options['iterations'], options['only'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write(f'{name:<28} p50 {result["p50_ms"]:>9.3f}ms  p95 {result["p95_ms"]:>9.3f}ms  '
+                              f'クエリ {result["queries"]:>3}  ({result["status"]})')
+
+        Path(options['output']).write_text(json.dumps({
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+            },
+            'results': results,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(f'結果を {options["output"]} に保存しました。')
+
+        if baseline is not None:
+            regressions = benchmark.compare(results, baseline, options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(line)
+                raise CommandError(f'{len(regressions)}件の性能の悪化があります。')
+            self.stdout.write(self.style.SUCCESS('基準の結果からの悪化はありません。'))
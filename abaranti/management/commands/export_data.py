@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from abaranti.export import EXPORT_FIELDS, export_chunks
+from abaranti.forms import ExportForm
+
+
+# 患者・他病院・処置のデータ出力
+class Command(BaseCommand):
+    help = '患者・他病院・処置のデータを CSV / JSON で出力します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORT_FIELDS))
+        parser.add_argument('--format', default='csv', choices=['csv', 'json'])
+        parser.add_argument('--output', help='出力先ファイル（省略時は標準出力）')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--date-from')
+        parser.add_argument('--date-to')
+        parser.add_argument('--bucket')
+        parser.add_argument('--emergency')
+
+    def handle(self, *args, **options):
+        form = ExportForm({key: options[key] for key in ('format', 'date_from', 'date_to', 'bucket', 'emergency',
+                                                           'gzip') if options[key] not in (None, False)})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        chunks = export_chunks(options['kind'], form.cleaned_data, form.cleaned_data['format'] or 'csv',
+                               form.cleaned_data['gzip'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
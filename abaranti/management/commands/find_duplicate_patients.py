@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from abaranti.duplicates import find_clusters
+from abaranti.models import Patient
+
+
+# 登録済みの患者の重複候補の一覧（検出キーが一致する患者のまとまり）
+class Command(BaseCommand):
+    help = '読み・生年月日または保険証記号番号が一致する患者のまとまりを、重複の候補として出力します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        clusters = find_clusters(batch_size=options['batch_size'])
+        # 表示用の氏名は、まとまりをいくつか分ずつまとめて読み込む
+        for start in range(0, len(clusters), options['batch_size']):
+            chunk = clusters[start:start + options['batch_size']]
+            patients = Patient.objects.in_bulk([pk for members in chunk for pk in members])
+            for number, members in enumerate(chunk, start + 1):
+                self.stdout.write(f'[{number}] ' + ' / '.join(
+                    f'{pk} {patients[pk].last_name}{patients[pk].first_name} {patients[pk].birthdate}'
+                    for pk in members))
+        self.stdout.write(self.style.SUCCESS(
+            f'重複の候補 {len(clusters)}組（{sum(len(members) for members in clusters)}人）が見つかりました。'))
@@ -0,0 +1,170 @@
+import csv
+import json
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from abaranti import catalog, fragments
+from abaranti.expiry import adjust_count
+from abaranti.forms import HospitalRegistrationForm, MedicineRegistrationForm, PatientRegistrationForm
+from abaranti.models import GazetteerEntry
+from abaranti.search import bulk_index
+from abaranti.watermarks import touch
+
+
+class _SkipUniqueCheck:
+    # 主キーの重複はまとめて確認するため、1行ごとの存在確認クエリは行わない
+    def validate_unique(self):
+        pass
+
+
+class HospitalImportForm(_SkipUniqueCheck, HospitalRegistrationForm):
+    pass
+
+
+class PatientImportForm(_SkipUniqueCheck, PatientRegistrationForm):
+    pass
+
+
+class MedicineImportForm(_SkipUniqueCheck, MedicineRegistrationForm):
+    pass
+
+
+IMPORT_FORMS = {
+    'hospitals': HospitalImportForm,
+    'patients': PatientImportForm,
+    'medicines': MedicineImportForm,
+}
+
+
+# マスタデータ（他病院・患者・薬剤）の一括登録
+class Command(BaseCommand):
+    help = 'CSV / JSONL から他病院・患者・薬剤のマスタデータを一括登録します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORT_FORMS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='省略時は拡張子から判定')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--reject-file', help='不正な行の出力先（省略時は <path>.rejects.csv）')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} が見つかりません。')
+        input_format = options['format'] or ('jsonl' if path.suffix in ('.jsonl', '.json') else 'csv')
+        reject_path = options['reject_file'] or f'{path}.rejects.csv'
+        self.kind = options['kind']
+        self.form_class = IMPORT_FORMS[self.kind]
+        self.model = self.form_class._meta.model
+        self.pk_name = self.model._meta.pk.name
+        self.seen = set()
+        self.malformed = 0
+        self.locate = lru_cache(maxsize=None)(GazetteerEntry.objects.locate)
+        batch_size = options['batch_size']
+
+        started = time.monotonic()
+        total = imported = rejected = 0
+        with open(path, encoding='utf-8', newline='') as f, \
+                open(reject_path, 'w', encoding='utf-8', newline='') as reject_file:
+            self.rejects = csv.writer(reject_file)
+            self.rejects.writerow(['line', 'reason', 'data'])
+            batch = []
+            for line_number, row in self.read_rows(f, input_format):
+                total += 1
+                batch.append((line_number, row))
+                if len(batch) >= batch_size:
+                    ok, ng = self.import_batch(batch)
+                    imported += ok
+                    rejected += ng
+                    batch = []
+                    self.report(total, imported, rejected, started)
+            ok, ng = self.import_batch(batch)
+            imported += ok
+            rejected += ng
+
+        rejected += self.malformed
+        if imported:
+            touch(self.model._meta.model_name)
+        if self.kind == 'medicines' and imported:
+            catalog.invalidate()
+        if self.kind == 'hospitals' and imported:
+            fragments.invalidate()
+        self.report(total, imported, rejected, started)
+        self.stdout.write(self.style.SUCCESS(f'{imported}件を登録しました。不正な行: {rejected}件（{reject_path}）'))
+
+    def read_rows(self, f, input_format):
+        if input_format == 'csv':
+            # 1行目はヘッダー
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                # 1行が1件のオブジェクト（{...}）でなければ不正な行とする
+                if not isinstance(row, dict):
+                    self.rejects.writerow([line_number, 'JSON の形式が正しくありません', line.rstrip('\n')])
+                    self.malformed += 1
+                    continue
+                yield line_number, row
+
+    def import_batch(self, batch):
+        if not batch:
+            return 0, 0
+        valid = []
+        rejected = 0
+        for line_number, row in batch:
+            data = dict(row)
+            if self.kind == 'patients':
+                data.setdefault('confirm_insurance_number', data.get('insurance_number'))
+            form = self.form_class(data)
+            if not form.is_valid():
+                self.reject(line_number, form.errors.as_text().replace('\n', ' '), row)
+                rejected += 1
+                continue
+            valid.append((line_number, row, form))
+
+        # 登録済みの主キーを、この塊の分だけまとめて取得する
+        # 前後の空白などの揺れで別の値とみなさないよう、登録する値（フォームで整えた後の値）で比べる
+        keys = {form.cleaned_data[self.pk_name] for _, _, form in valid}
+        existing = set(self.model.objects.filter(pk__in=keys).values_list('pk', flat=True))
+
+        objects = []
+        for line_number, row, form in valid:
+            key = form.cleaned_data[self.pk_name]
+            if key in existing or key in self.seen:
+                self.reject(line_number, '主キーが重複しています', row)
+                rejected += 1
+                continue
+            instance = form.instance
+            if self.kind == 'hospitals':
+                instance.update_address_components(locate=self.locate)
+            elif self.kind == 'patients':
+                instance.update_blocking_keys()
+            self.seen.add(key)
+            objects.append(instance)
+
+        with transaction.atomic():
+            self.model.objects.bulk_create(objects)
+            if self.kind == 'patients':
+                # bulk_create ではシグナルが呼ばれないため、検索インデックスと期限集計をここで更新する
+                bulk_index(objects)
+                for insurance_exp, count in Counter(patient.insurance_exp for patient in objects).items():
+                    adjust_count(insurance_exp, count)
+        return len(objects), rejected
+
+    def reject(self, line_number, reason, row):
+        self.rejects.writerow([line_number, reason, json.dumps(row, ensure_ascii=False, default=str)])
+
+    def report(self, total, imported, rejected, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{total}行処理 / 登録 {imported}件 / 不正 {rejected}件 / {total / elapsed:.0f}行/秒')
@@ -0,0 +1,35 @@
+import csv
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from abaranti.models import GazetteerEntry
+
+DEFAULT_PATH = Path(__file__).resolve().parents[2] / 'data' / 'gazetteer.csv'
+
+
+# 地名辞書（住所→緯度経度）を CSV から読み込む
+class Command(BaseCommand):
+    help = '地名辞書を読み込みます（既定では同梱の gazetteer.csv）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8', newline='') as f:
+            entries = [
+                GazetteerEntry(
+                    prefecture=row['prefecture'],
+                    municipality=row['municipality'],
+                    town=row['town'],
+                    latitude=float(row['latitude']),
+                    longitude=float(row['longitude']),
+                )
+                for row in csv.DictReader(f)
+            ]
+        with transaction.atomic():
+            GazetteerEntry.objects.all().delete()
+            GazetteerEntry.objects.bulk_create(entries, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'{len(entries)}件の地点を読み込みました。'))
+        self.stdout.write('病院の位置情報は backfill_hospital_address で更新してください。')
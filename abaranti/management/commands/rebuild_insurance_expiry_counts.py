@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from abaranti.expiry import rebuild_counts
+
+
+# 保険証有効期限の集計表の再作成（既存データの取り込み用）
+class Command(BaseCommand):
+    help = '保険証有効期限ごとの患者数の集計表を再作成します'
+
+    def handle(self, *args, **options):
+        count = rebuild_counts()
+        self.stdout.write(self.style.SUCCESS(f'{count}件の有効期限を集計しました。'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from abaranti import usage
+
+
+# 薬剤使用量の集計表（日別・月別・医師別）の再作成（既存データの取り込み用）
+class Command(BaseCommand):
+    help = '処置の履歴から、薬剤使用量の日別・月別・医師別の集計表を再作成します'
+
+    def handle(self, *args, **options):
+        counts = usage.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'日別 {counts["daily"]}件・月別 {counts["monthly"]}件・医師別 {counts["doctor"]}件を集計しました。'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from abaranti.search import rebuild_index
+
+
+# 患者名検索インデックスの再構築（既存データの取り込み用）
+class Command(BaseCommand):
+    help = '患者名検索インデックスを再構築します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count}件の患者をインデックスに登録しました。'))
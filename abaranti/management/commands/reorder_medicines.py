@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from abaranti.stock import propose_orders
+
+
+# 薬剤の発注案の作成（日次で実行する）
+class Command(BaseCommand):
+    help = '日別の使用量と仕入先の納期から、在庫が不足する薬剤の発注案を作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None, help='基準日（YYYY-MM-DD、既定は本日）')
+        parser.add_argument('--dry-run', action='store_true', help='発注案を表示するだけで登録しない')
+
+    def handle(self, *args, **options):
+        orders, unlinked = propose_orders(options['date'], save=not options['dry_run'])
+        for order in orders:
+            self.stdout.write(f'{order.medicine_id}\t{order.supplier_id}\t{order.quantity}\t{order.expected_date}')
+        if unlinked:
+            self.stderr.write(self.style.WARNING('仕入先が登録されていない薬剤: ' + ', '.join(unlinked)))
+        if options['dry_run']:
+            self.stdout.write(f'発注案は{len(orders)}件です（登録していません）。')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'発注案を{len(orders)}件作成しました。'))
@@ -0,0 +1,111 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from abaranti import jobs
+
+
+# バックグラウンド処理のワーカー（Job を取り出し、プロセスプールで実行する）
+class Command(BaseCommand):
+    help = '待機中のバックグラウンド処理を取り出し、プロセスプールで実行します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help='同時に実行する数（既定は JOB_WORKERS）')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='待機中の処理がない場合の確認間隔（秒）')
+        parser.add_argument('--once', action='store_true', help='待機中の処理がなくなったら終了する')
+        parser.add_argument('--inline', action='store_true',
+                            help='子プロセスを使わずにこのプロセスで1件ずつ実行する（確認・調査用）')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        worker = jobs.worker_name()
+        concurrency = options['concurrency'] or getattr(settings, 'JOB_WORKERS', 2)
+        if options['inline']:
+            done = self.run_inline(worker, options)
+        else:
+            done = self.run_pool(worker, concurrency, options)
+        self.stdout.write(self.style.SUCCESS(f'{done}件の処理を実行しました。'))
+
+    def stop(self, signum, frame):
+        # 実行中の処理が終わるのを待って終了する
+        self.stopping = True
+
+    def log(self, job, action):
+        self.stdout.write(f'[{job.pk}] {job.kind} {action}（{job.attempts}回目）')
+
+    def run_inline(self, worker, options):
+        done = 0
+        while not self.stopping:
+            jobs.requeue_stale()
+            job = jobs.claim(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.log(job, '開始')
+            # 進み具合を報告しない処理でも、実行している間は応答を送り続ける
+            with jobs.keep_alive([job.pk]):
+                jobs.run_job(job.pk)
+            done += 1
+        return done
+
+    def run_pool(self, worker, concurrency, options):
+        done = 0
+        while True:
+            count, broken = self.run_pool_once(worker, concurrency, options)
+            done += count
+            if not broken:
+                return done
+            # 子プロセスが異常終了するとプール全体が使えなくなるため、作り直して続ける
+            self.stderr.write(self.style.WARNING('子プロセスが異常終了したため、プロセスプールを作り直します。'))
+
+    def run_pool_once(self, worker, concurrency, options):
+        # 戻り値: (実行した件数, プールが使えなくなったか)
+        # 子プロセスは fork ではなく spawn で起動し、親の DB 接続・スレッドを引き継がない
+        connections.close_all()
+        running = {}
+        done = 0
+        with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            while not (self.stopping and not running):
+                jobs.requeue_stale()
+                jobs.heartbeat([job.pk for job in running.values()])
+                while not self.stopping and len(running) < concurrency:
+                    job = jobs.claim(worker)
+                    if job is None:
+                        break
+                    self.log(job, '開始')
+                    try:
+                        running[pool.submit(jobs.run_job_in_child, job.pk)] = job
+                    except BrokenProcessPool as e:
+                        jobs.fail(job, repr(e))
+                        return done, True
+                if not running:
+                    if options['once'] or self.stopping:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                finished, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    job = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # 子プロセスの異常終了など、run_job の中で記録できなかった失敗
+                        jobs.fail(job, repr(error))
+                        broken = broken or isinstance(error, BrokenProcessPool)
+                    done += 1
+                if broken:
+                    for job in running.values():
+                        jobs.fail(job, 'プロセスプールが異常終了しました。')
+                    return done, True
+        return done, False
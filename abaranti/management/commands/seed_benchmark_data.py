@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from abaranti.models import Hospital, Medicine, Patient, Supplier, Treatment
+from abaranti.seed import DEFAULT_VOLUMES, seed
+
+
+# 性能測定用のデータ登録
+class Command(BaseCommand):
+    help = '性能測定用の患者・他病院・薬剤・処置データを登録します（既定: 患者10万件・処置500万件）'
+
+    def add_arguments(self, parser):
+        for kind, count in DEFAULT_VOLUMES.items():
+            parser.add_argument(f'--{kind}', type=int, default=count)
+        parser.add_argument('--scale', type=float, default=1.0, help='各件数に掛ける倍率（手元での確認用）')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if any(model.objects.exists() for model in (Hospital, Medicine, Patient, Supplier, Treatment)):
+            raise CommandError('性能測定用のデータは空のデータベースに登録してください。')
+        volumes = {kind: max(int(options[kind] * options['scale']), 1) for kind in DEFAULT_VOLUMES}
+
+        def progress(kind, done, total):
+            self.stdout.write(f'{kind}: {done}/{total}', ending='\r' if done < total else '\n')
+
+        seed(volumes, random_seed=options['seed'], batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            '登録しました: ' + ' / '.join(f'{kind} {count}件' for kind, count in volumes.items())))
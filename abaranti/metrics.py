@@ -0,0 +1,216 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+# -------------------------------------------------------------------
+# リクエスト単位の計測
+# 画面（URL 名）ごとに処理時間・DB 時間・クエリ数・重複クエリ・テンプレートの描画時間を記録し、
+# 固定のバケットのヒストグラムに集計して Prometheus のテキスト形式で出力する
+# テンプレートの描画時間は、設定（TEMPLATES）で指定する TimedDjangoTemplates で計測する
+# 集計はワーカープロセスごと（プロセスの再起動で初期化される）
+# -------------------------------------------------------------------
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+logger = logging.getLogger('abaranti.slow_requests')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+# 指標名 → (説明, 種類, バケット)
+METRICS = {
+    'abaranti_request_duration_seconds': ('リクエストの処理時間', 'histogram', DURATION_BUCKETS),
+    'abaranti_db_duration_seconds': ('リクエスト内の DB の処理時間', 'histogram', DURATION_BUCKETS),
+    'abaranti_db_queries': ('リクエスト内のクエリ数', 'histogram', QUERY_COUNT_BUCKETS),
+    'abaranti_template_render_seconds': ('テンプレートの描画時間', 'histogram', DURATION_BUCKETS),
+    'abaranti_duplicate_queries_total': ('同じ SQL が繰り返し実行された回数（N+1 の検出）', 'counter', None),
+    'abaranti_fragment_cache_hits_total': ('描画結果のキャッシュの命中回数', 'counter', None),
+    'abaranti_fragment_cache_misses_total': ('描画結果のキャッシュの不一致回数', 'counter', None),
+}
+
+_lock = threading.Lock()
+_series = {name: {} for name in METRICS}
+
+
+def observe(name, view, value):
+    with _lock:
+        series = _series[name]
+        if METRICS[name][1] == 'counter':
+            series[view] = series.get(view, 0) + value
+        else:
+            histogram = series.get(view)
+            if histogram is None:
+                histogram = series[view] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+
+def reset():
+    with _lock:
+        for series in _series.values():
+            series.clear()
+
+
+def _label(view):
+    escaped = view.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'view="{escaped}"'
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for name, (help_text, kind, _) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for view, value in sorted(_series[name].items()):
+                label = _label(view)
+                if kind == 'counter':
+                    lines.append(f'{name}{{{label}}} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}}} {value.sum:.6f}')
+                lines.append(f'{name}_count{{{label}}} {value.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []  # (sql, 秒)
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper から呼ばれ、クエリごとの時間を記録する
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        # パラメータを除いた SQL が同じクエリ（ループ内での関連オブジェクトの読み込みなど）
+        return {sql: count for sql, count in Counter(sql for sql, _ in self.queries).items() if count > 1}
+
+
+_current = ContextVar('abaranti_request_stats', default=None)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        # render_to_string の中で別のテンプレートを描画した場合などは、外側の時間に含める
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # 描画時間を計測する Django テンプレートのバックエンド（設定の TEMPLATES の BACKEND に指定する）
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def capture_queries(stats):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(stats))
+    return stack
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with capture_queries(stats):
+                response = self.get_response(request)
+        except Exception:
+            self.record(request, stats, time.perf_counter() - started)
+            raise
+        finally:
+            _current.reset(token)
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            # データ出力などの StreamingHttpResponse は、送信中（ビューが返った後）にもクエリを発行するため、
+            # 送信し終えた時点で記録する（ファイルの送信は DB を使わないため、sendfile が使えるよう包まない）
+            response.streaming_content = self.stream(response.streaming_content, request, stats, started)
+        else:
+            self.record(request, stats, time.perf_counter() - started)
+        return response
+
+    def stream(self, content, request, stats, started):
+        try:
+            with capture_queries(stats):
+                yield from content
+        finally:
+            self.record(request, stats, time.perf_counter() - started)
+
+    def record(self, request, stats, elapsed):
+        view = view_name(request)
+        duplicates = stats.duplicates()
+        observe('abaranti_request_duration_seconds', view, elapsed)
+        observe('abaranti_db_duration_seconds', view, stats.db_time)
+        observe('abaranti_db_queries', view, len(stats.queries))
+        observe('abaranti_template_render_seconds', view, stats.template_time)
+        if duplicates:
+            observe('abaranti_duplicate_queries_total', view, sum(count - 1 for count in duplicates.values()))
+
+        if elapsed >= getattr(settings, 'SLOW_REQUEST_THRESHOLD', 1.0):
+            top = sorted(stats.queries, key=lambda query: query[1], reverse=True)
+            top = top[:getattr(settings, 'SLOW_REQUEST_TOP_QUERIES', 5)]
+            logger.warning(
+                '遅いリクエスト %s %s (%s): %.3f秒 / DB %.3f秒・%d件 / テンプレート %.3f秒\n'
+                '時間のかかったクエリ:\n%s%s',
+                request.method, request.path, view, elapsed, stats.db_time, len(stats.queries),
+                stats.template_time,
+                '\n'.join(f'  {duration * 1000:.1f}ms {sql}' for sql, duration in top),
+                ''.join(f'\n重複 {count}回: {sql}' for sql, count in duplicates.items()),
+            )
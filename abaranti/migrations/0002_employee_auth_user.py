@@ -0,0 +1,170 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+import django.contrib.auth.models
+import django.db.models.deletion
+import django.utils.timezone
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import migrations, models
+
+
+def hash_plain_passwords(apps, schema_editor):
+    # 旧スキーマ（emppasswd）には平文のパスワードが残っている場合があるため、ハッシュ化して引き継ぐ
+    # ハッシュ化済み・使用不可（! で始まる）の値はそのまま
+    Employee = apps.get_model('abaranti', 'Employee')
+    for employee in Employee.objects.exclude(password='').exclude(password__startswith='!').only('pk', 'password'):
+        try:
+            identify_hasher(employee.password)
+        except ValueError:
+            employee.password = make_password(employee.password)
+            employee.save(update_fields=['password'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0001_initial'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        # 従業員: 独自の列（empid など）から、Django の認証（AbstractUser）の列に移す
+        migrations.RenameField(
+            model_name='employee',
+            old_name='empid',
+            new_name='username',
+        ),
+        migrations.RenameField(
+            model_name='employee',
+            old_name='empfname',
+            new_name='first_name',
+        ),
+        migrations.RenameField(
+            model_name='employee',
+            old_name='emplname',
+            new_name='last_name',
+        ),
+        migrations.RenameField(
+            model_name='employee',
+            old_name='emppasswd',
+            new_name='password',
+        ),
+        migrations.RenameField(
+            model_name='employee',
+            old_name='emprole',
+            new_name='role',
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='password',
+            field=models.CharField(max_length=128),
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='role',
+            field=models.IntegerField(choices=[(0, '受付'), (1, '医師')]),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='last_login',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last login'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='is_superuser',
+            field=models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, verbose_name='email address'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='is_staff',
+            field=models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='is_active',
+            field=models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='date_joined',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='user_permissions',
+            field=models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions'),
+        ),
+        migrations.AlterModelOptions(
+            name='employee',
+            options={'verbose_name': 'user', 'verbose_name_plural': 'users'},
+        ),
+        migrations.AlterModelManagers(
+            name='employee',
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.RunPython(hash_plain_passwords, migrations.RunPython.noop),
+        # 他病院・仕入先・患者・薬剤・処置（初期のマイグレーションに含まれていなかった表）
+        migrations.CreateModel(
+            name='Hospital',
+            fields=[
+                ('hospital_id', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('hospital_name', models.CharField(max_length=64)),
+                ('hospital_address', models.CharField(max_length=64)),
+                ('phone_number', models.CharField(max_length=13)),
+                ('capital', models.IntegerField()),
+                ('emergency', models.IntegerField(choices=[(1, 'あり'), (0, 'なし')])),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Medicine',
+            fields=[
+                ('medicineid', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('medicinename', models.CharField(max_length=64)),
+                ('unit', models.CharField(max_length=8)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Patient',
+            fields=[
+                ('patient_id', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('last_name', models.CharField(max_length=64)),
+                ('first_name', models.CharField(max_length=64)),
+                ('gender', models.IntegerField(choices=[(0, '男'), (1, '女')])),
+                ('birthdate', models.DateField()),
+                ('insurance_number', models.CharField(max_length=64)),
+                ('insurance_exp', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Supplier',
+            fields=[
+                ('supplier_id', models.CharField(max_length=8, primary_key=True, serialize=False)),
+                ('supplier_name', models.CharField(max_length=64)),
+                ('supplier_address', models.CharField(max_length=64)),
+                ('phone_number', models.CharField(max_length=13)),
+                ('capital', models.IntegerField()),
+                ('delivery_time', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Treatment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='abaranti.medicine')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.patient')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0002_employee_auth_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchEntry',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='abaranti.patient')),
+                ('last_name_norm', models.CharField(db_index=True, max_length=64)),
+                ('first_name_norm', models.CharField(db_index=True, max_length=64)),
+                ('full_name_norm', models.CharField(db_index=True, max_length=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PatientSearchGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_grams', to='abaranti.patient')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gram', 'patient'), name='patient_search_gram_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0003_patient_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hospital',
+            name='address_municipality',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='address_number',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='address_prefecture',
+            field=models.CharField(blank=True, default='', max_length=4),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='address_town',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['address_prefecture', 'address_municipality', 'address_town', 'address_number'], name='hospital_address_idx'),
+        ),
+    ]
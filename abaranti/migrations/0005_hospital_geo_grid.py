@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:54
+
+import csv
+from pathlib import Path
+
+from django.db import migrations, models
+
+GAZETTEER_PATH = Path(__file__).resolve().parent.parent / 'data' / 'gazetteer.csv'
+
+
+def load_bundled_gazetteer(apps, schema_editor):
+    # 同梱の地名辞書を登録する
+    GazetteerEntry = apps.get_model('abaranti', 'GazetteerEntry')
+    db_alias = schema_editor.connection.alias
+    with open(GAZETTEER_PATH, encoding='utf-8', newline='') as f:
+        GazetteerEntry.objects.using(db_alias).bulk_create([
+            GazetteerEntry(prefecture=row['prefecture'], municipality=row['municipality'], town=row['town'],
+                           latitude=float(row['latitude']), longitude=float(row['longitude']))
+            for row in csv.DictReader(f)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0004_hospital_address_components'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GazetteerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefecture', models.CharField(max_length=4)),
+                ('municipality', models.CharField(blank=True, default='', max_length=32)),
+                ('town', models.CharField(blank=True, default='', max_length=64)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='grid_x',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='grid_y',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='hospital',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['emergency', 'grid_y', 'grid_x'], name='hospital_grid_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='gazetteerentry',
+            constraint=models.UniqueConstraint(fields=('prefecture', 'municipality', 'town'), name='gazetteer_entry_unique'),
+        ),
+        migrations.RunPython(load_bundled_gazetteer, migrations.RunPython.noop),
+    ]
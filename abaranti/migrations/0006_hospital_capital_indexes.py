@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0005_hospital_geo_grid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['capital', 'hospital_id'], name='hospital_capital_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hospital',
+            index=models.Index(fields=['emergency', 'capital', 'hospital_id'], name='hospital_emergency_capital_idx'),
+        ),
+    ]
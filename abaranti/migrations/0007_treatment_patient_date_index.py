@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0006_hospital_capital_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['patient', '-date'], name='treatment_patient_date_idx'),
+        ),
+    ]
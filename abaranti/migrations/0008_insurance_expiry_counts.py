@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:58
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_insurance_expiry_counts(apps, schema_editor):
+    # 既存の患者から集計表を作成する
+    Patient = apps.get_model('abaranti', 'Patient')
+    InsuranceExpiryCount = apps.get_model('abaranti', 'InsuranceExpiryCount')
+    db_alias = schema_editor.connection.alias
+    rows = Patient.objects.using(db_alias).values('insurance_exp').annotate(count=Count('pk')).order_by()
+    InsuranceExpiryCount.objects.using(db_alias).bulk_create(
+        [InsuranceExpiryCount(insurance_exp=row['insurance_exp'], count=row['count']) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0007_treatment_patient_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsuranceExpiryCount',
+            fields=[
+                ('insurance_exp', models.DateField(primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='insurance_exp',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.RunPython(fill_insurance_expiry_counts, migrations.RunPython.noop),
+    ]
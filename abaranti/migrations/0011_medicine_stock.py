@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0010_patient_kana_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineStock',
+            fields=[
+                ('medicine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='abaranti.medicine')),
+                ('on_hand', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MedicineDailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'medicine'], name='medicine_daily_usage_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'date'), name='medicine_daily_usage_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('status', models.IntegerField(choices=[(1, '発注案'), (2, '発注済み'), (3, '入荷済み'), (4, '取消')], default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expected_date', models.DateField()),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.medicine')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='abaranti.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'medicine'], name='stock_order_status_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SupplierMedicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_size', models.IntegerField(default=1)),
+                ('preferred', models.BooleanField(default=False)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suppliers', to='abaranti.medicine')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.supplier')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('supplier', 'medicine'), name='supplier_medicine_unique')],
+            },
+        ),
+    ]
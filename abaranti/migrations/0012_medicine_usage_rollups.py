@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0011_medicine_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treatment',
+            name='doctor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='DoctorMonthlyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'doctor'], name='doctor_monthly_usage_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'medicine', 'month'), name='doctor_monthly_usage_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MedicineMonthlyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'medicine'], name='medicine_monthly_usage_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'month'), name='medicine_monthly_usage_unique')],
+            },
+        ),
+    ]
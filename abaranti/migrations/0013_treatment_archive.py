@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0012_medicine_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTreatment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField()),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TreatmentArchiveWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archived_through', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='treatment',
+            index=models.Index(fields=['date', 'id'], name='treatment_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedtreatment',
+            name='doctor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedtreatment',
+            name='medicine',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='abaranti.medicine'),
+        ),
+        migrations.AddField(
+            model_name='archivedtreatment',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='abaranti.patient'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtreatment',
+            index=models.Index(fields=['patient', '-date'], name='archived_treatment_patient_idx'),
+        ),
+    ]
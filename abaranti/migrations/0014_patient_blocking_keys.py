@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:24
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+
+# 検出キーの作り方は、このマイグレーションの作成時点の abaranti.text の内容を写したもの
+# （text.py を後で変更しても、既存データの設定結果が変わらないようにする）
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    chars = []
+    for ch in text:
+        if ch.isspace():
+            continue
+        if 'ぁ' <= ch <= 'ゖ':
+            ch = chr(ord(ch) + 0x60)
+        chars.append(ch)
+    return ''.join(chars)
+
+
+def name_birth_key(last_name, first_name, last_name_kana, first_name_kana, birthdate):
+    reading = normalize(last_name_kana + first_name_kana) or normalize(last_name + first_name)
+    if not reading or not birthdate:
+        return ''
+    return f'{reading}|{birthdate}'
+
+
+def insurance_key(insurance_number):
+    digits = ''.join(ch for ch in normalize(insurance_number) if ch.isalnum())
+    if not digits:
+        return ''
+    return hashlib.sha256(digits.encode()).hexdigest()
+
+
+def fill_blocking_keys(apps, schema_editor):
+    # 既存の患者の重複候補の検出キーを設定する
+    Patient = apps.get_model('abaranti', 'Patient')
+    db_alias = schema_editor.connection.alias
+    patients = []
+    for patient in Patient.objects.using(db_alias).iterator(chunk_size=1000):
+        patient.name_birth_key = name_birth_key(patient.last_name, patient.first_name, patient.last_name_kana,
+                                                patient.first_name_kana, patient.birthdate)
+        patient.insurance_key = insurance_key(patient.insurance_number)
+        patients.append(patient)
+        if len(patients) >= 1000:
+            Patient.objects.using(db_alias).bulk_update(patients, ['name_birth_key', 'insurance_key'])
+            patients = []
+    Patient.objects.using(db_alias).bulk_update(patients, ['name_birth_key', 'insurance_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0013_treatment_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='insurance_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='name_birth_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=160),
+        ),
+        migrations.RunPython(fill_blocking_keys, migrations.RunPython.noop),
+    ]
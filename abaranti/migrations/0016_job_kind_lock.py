@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abaranti', '0015_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobKindLock',
+            fields=[
+                ('kind', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('locked_at', models.DateTimeField()),
+            ],
+        ),
+    ]
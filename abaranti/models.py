@@ -1,6 +1,15 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractUser
 
+from .address import ADDRESS_FIELDS, parse_address
+from .geo import grid_cell
+from .text import insurance_key, name_birth_key
+
+# 住所から設定する位置情報の列
+GEO_FIELDS = ('latitude', 'longitude', 'grid_y', 'grid_x')
+# 患者の重複候補の検出キーの列
+BLOCKING_KEY_FIELDS = ('name_birth_key', 'insurance_key')
+
 
 class Employee(AbstractUser):
     class Role(models.IntegerChoices):
@@ -14,13 +23,49 @@ class Employee(AbstractUser):
 
     first_name = models.CharField(max_length=64)
     last_name = models.CharField(max_length=64)
-    password = models.CharField(max_length=64)  # ハッシュ化されたパスワードを保存
+    password = models.CharField(max_length=128)  # ハッシュ化されたパスワードを保存
     role = models.IntegerField(choices=Role.choices)
 
     def __str__(self):
         return self.username
 
 
+# 住所→緯度経度の対応表（オフラインで参照する地名辞書）
+class GazetteerManager(models.Manager):
+    def locate(self, prefecture, municipality='', town=''):
+        # 詳しい住所から順に探し、見つからなければ市区町村・都道府県の代表地点を使う
+        keys = [(prefecture, municipality, town), (prefecture, municipality, '')]
+        if municipality.endswith('区') and '市' in municipality:
+            keys.append((prefecture, municipality[:municipality.index('市') + 1], ''))
+        keys.append((prefecture, '', ''))
+        entries = {
+            (entry.prefecture, entry.municipality, entry.town): entry
+            for entry in self.filter(prefecture=prefecture, municipality__in={key[1] for key in keys})
+        }
+        for key in keys:
+            if key in entries:
+                return entries[key]
+        return None
+
+
+class GazetteerEntry(models.Model):
+    prefecture = models.CharField(max_length=4)
+    municipality = models.CharField(max_length=32, blank=True, default='')
+    town = models.CharField(max_length=64, blank=True, default='')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    objects = GazetteerManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['prefecture', 'municipality', 'town'], name='gazetteer_entry_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.prefecture}{self.municipality}{self.town}"
+
+
 class Hospital(models.Model):
     hospital_id = models.CharField(max_length=8, primary_key=True)
     hospital_name = models.CharField(max_length=64)
@@ -28,10 +73,58 @@ class Hospital(models.Model):
     phone_number = models.CharField(max_length=13)
     capital = models.IntegerField()
     emergency = models.IntegerField(choices=((1, 'あり'), (0, 'なし')))  # 救急対応の有無（詳細設計書に従い1/0で表現）
+    updated_at = models.DateTimeField(auto_now=True)  # 最終更新日時（条件付き GET 用）
+
+    # 住所検索用に分解した住所（保存時に hospital_address から設定）
+    address_prefecture = models.CharField(max_length=4, blank=True, default='')
+    address_municipality = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    address_town = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    address_number = models.CharField(max_length=32, blank=True, default='')
+
+    # 近傍検索用の位置情報（地名辞書から設定）
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    grid_y = models.IntegerField(null=True, blank=True)
+    grid_x = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['address_prefecture', 'address_municipality', 'address_town', 'address_number'],
+                         name='hospital_address_idx'),
+            models.Index(fields=['emergency', 'grid_y', 'grid_x'], name='hospital_grid_idx'),
+            # 資本金の範囲検索・並び替え用
+            models.Index(fields=['capital', 'hospital_id'], name='hospital_capital_idx'),
+            models.Index(fields=['emergency', 'capital', 'hospital_id'], name='hospital_emergency_capital_idx'),
+        ]
 
     def __str__(self):
         return self.hospital_name
 
+    def update_address_components(self, locate=None):
+        # locate: 地名辞書の検索関数（一括処理で検索結果を使い回す場合に指定）
+        # 分解できない住所で列の長さを超えた場合は切り詰める（MySQL では長さの超過が保存時のエラーになるため）
+        for name, value in parse_address(self.hospital_address).items():
+            setattr(self, name, value[:self._meta.get_field(name).max_length])
+        entry = None
+        if self.address_prefecture:
+            entry = (locate or GazetteerEntry.objects.locate)(self.address_prefecture, self.address_municipality,
+                                                              self.address_town)
+        if entry is not None:
+            self.latitude, self.longitude = entry.latitude, entry.longitude
+            self.grid_y, self.grid_x = grid_cell(entry.latitude, entry.longitude)
+        else:
+            self.latitude = self.longitude = self.grid_y = self.grid_x = None
+
+    def save(self, *args, **kwargs):
+        self.update_address_components()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'updated_at'}
+            if 'hospital_address' in update_fields:
+                update_fields |= set(ADDRESS_FIELDS) | set(GEO_FIELDS)
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
 
 class Supplier(models.Model):
     supplier_id = models.CharField(max_length=8, primary_key=True)
@@ -49,19 +142,53 @@ class Patient(models.Model):
     patient_id = models.CharField(max_length=8, primary_key=True)
     last_name = models.CharField(max_length=64)
     first_name = models.CharField(max_length=64)
+    # 読み（カタカナで保存する）
+    last_name_kana = models.CharField(max_length=64, blank=True, default='')
+    first_name_kana = models.CharField(max_length=64, blank=True, default='')
     gender = models.IntegerField(choices=((0, '男'), (1, '女')))  # 性別（詳細設計書に従い0/1で表現）
     birthdate = models.DateField()
     insurance_number = models.CharField(max_length=64)
-    insurance_exp = models.DateField()
+    insurance_exp = models.DateField(db_index=True)
+    # 最終更新日時（条件付き GET・患者の候補表示の差分更新用）
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # 重複候補の検出キー（読み + 生年月日、保険証記号番号のハッシュ値）
+    name_birth_key = models.CharField(max_length=160, blank=True, default='', db_index=True)
+    insurance_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     def __str__(self):
         return f"{self.last_name} {self.first_name}"
 
+    def update_blocking_keys(self):
+        self.name_birth_key = name_birth_key(self.last_name, self.first_name, self.last_name_kana,
+                                             self.first_name_kana, self.birthdate)
+        self.insurance_key = insurance_key(self.insurance_number)
+
+    def save(self, *args, **kwargs):
+        self.update_blocking_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(BLOCKING_KEY_FIELDS) | {'updated_at'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # 有効期限の集計を差分で更新するため、読み込んだ時点の値を覚えておく
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_insurance_exp = instance.__dict__.get('insurance_exp')
+        return instance
+
+
+# 保険証有効期限ごとの患者数（期限切れ・期限間近の件数表示用）
+class InsuranceExpiryCount(models.Model):
+    insurance_exp = models.DateField(primary_key=True)
+    count = models.IntegerField(default=0)
+
 
 class Medicine(models.Model):
     medicineid = models.CharField(max_length=8, primary_key=True)
     medicinename = models.CharField(max_length=64)
     unit = models.CharField(max_length=8)
+    updated_at = models.DateTimeField(auto_now=True)  # 最終更新日時（条件付き GET 用）
 
     def __str__(self):
         return self.medicinename
@@ -72,3 +199,197 @@ class Treatment(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT)
     quantity = models.IntegerField()
     date = models.DateTimeField(auto_now_add=True)
+    # 指示した医師（医師別の使用量の集計用。項目の追加前に登録された処置は空）
+    doctor = models.ForeignKey(Employee, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            # 患者ごとの処置履歴（新しい順）
+            models.Index(fields=['patient', '-date'], name='treatment_patient_date_idx'),
+            # 古い処置から順に保管用の表へ移すため
+            models.Index(fields=['date', 'id'], name='treatment_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # 処置の登録と、post_save での在庫・使用量の更新（signals.update_medicine_stock）を1トランザクションで行う
+        # （自動コミットのまま登録すると、在庫の更新に失敗しても処置だけが登録される）
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+# 保管用の処置（一定期間より前の処置を Treatment から移したもの。ID は移す前の値を引き継ぐ）
+class ArchivedTreatment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    medicine = models.ForeignKey(Medicine, on_delete=models.PROTECT)
+    quantity = models.IntegerField()
+    date = models.DateTimeField()
+    doctor = models.ForeignKey(Employee, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', '-date'], name='archived_treatment_patient_idx'),
+        ]
+
+
+# 処置の保管の進み具合（移し終えた最後の処置の日時・ID）
+# 保管用の表にはこの日時以前の処置しかないため、処置履歴はこれより前を検索する場合だけ保管用の表を読む
+class TreatmentArchiveWatermark(models.Model):
+    archived_through = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+# 薬剤の在庫（処置の登録と同じトランザクションで F() により増減する）
+class MedicineStock(models.Model):
+    medicine = models.OneToOneField(Medicine, on_delete=models.CASCADE, primary_key=True, related_name='stock')
+    on_hand = models.IntegerField(default=0)  # 在庫数（入荷で増え、処置で減る）
+
+
+# 薬剤ごとの日別の使用量（処置の履歴を集計せずに消費量を求めるため）
+class MedicineDailyUsage(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
+    date = models.DateField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'date'], name='medicine_daily_usage_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'medicine'], name='medicine_daily_usage_date_idx'),
+        ]
+
+
+# 薬剤ごとの月別の使用量（month は月初日）
+class MedicineMonthlyUsage(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
+    month = models.DateField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'month'], name='medicine_monthly_usage_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'medicine'], name='medicine_monthly_usage_idx'),
+        ]
+
+
+# 医師・薬剤ごとの月別の使用量（month は月初日）
+class DoctorMonthlyUsage(models.Model):
+    doctor = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='+')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
+    month = models.DateField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'medicine', 'month'], name='doctor_monthly_usage_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'doctor'], name='doctor_monthly_usage_idx'),
+        ]
+
+
+# 仕入先が扱う薬剤
+class SupplierMedicine(models.Model):
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE)
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='suppliers')
+    lot_size = models.IntegerField(default=1)  # 発注単位
+    preferred = models.BooleanField(default=False)  # 優先して発注する仕入先
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['supplier', 'medicine'], name='supplier_medicine_unique'),
+        ]
+
+
+# 発注（発注案 → 発注済み → 入荷済み）
+class StockOrder(models.Model):
+    class Status(models.IntegerChoices):
+        PROPOSED = 1, '発注案'
+        ORDERED = 2, '発注済み'
+        RECEIVED = 3, '入荷済み'
+        CANCELLED = 4, '取消'
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
+    supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT)
+    quantity = models.IntegerField()
+    status = models.IntegerField(choices=Status.choices, default=Status.PROPOSED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expected_date = models.DateField()  # 入荷予定日（発注日 + 納期）
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'medicine'], name='stock_order_status_idx'),
+        ]
+
+
+# バックグラウンドで実行する処理（run_workers が取り出して実行する）
+class Job(models.Model):
+    class Status(models.IntegerChoices):
+        QUEUED = 1, '待機中'
+        RUNNING = 2, '実行中'
+        SUCCEEDED = 3, '完了'
+        FAILED = 4, '失敗'
+
+    kind = models.CharField(max_length=32)
+    params = models.JSONField(default=dict)
+    status = models.IntegerField(choices=Status.choices, default=Status.QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # 進み具合（処理済みの件数 / 全体の件数、最後に報告された内容）
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(Employee, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField()  # この日時以降に実行する（再試行の待ち時間）
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # 実行中のワーカーと、その最終応答日時（応答が途絶えた処理は待機中に戻す）
+    worker = models.CharField(max_length=64, blank=True, default='')
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_idx'),
+            models.Index(fields=['created_by', '-created_at'], name='job_created_by_idx'),
+        ]
+
+
+# バックグラウンド処理の種類ごとのロック行
+# 同時実行数に上限のある種類は、この行をロックしてから実行中の件数を数えて取り出す（複数の run_workers でも上限を超えない）
+class JobKindLock(models.Model):
+    kind = models.CharField(max_length=32, primary_key=True)
+    locked_at = models.DateTimeField()
+
+
+# テーブルごとの最終更新日時（登録・変更・削除のたびに進める）
+# 一覧画面の Last-Modified / ETag を、一覧を検索せずに1行の参照で求めるために使う
+class TableWatermark(models.Model):
+    table = models.CharField(max_length=32, primary_key=True)
+    updated_at = models.DateTimeField()
+
+
+# 患者名検索インデックス（正規化済みの氏名）
+class PatientSearchEntry(models.Model):
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    last_name_norm = models.CharField(max_length=64, db_index=True)
+    first_name_norm = models.CharField(max_length=64, db_index=True)
+    full_name_norm = models.CharField(max_length=128, db_index=True)
+
+
+# 患者名検索インデックス（n-gram トークン）
+class PatientSearchGram(models.Model):
+    gram = models.CharField(max_length=2)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='search_grams')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gram', 'patient'], name='patient_search_gram_unique'),
+        ]
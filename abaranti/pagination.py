@@ -0,0 +1,176 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+
+# -------------------------------------------------------------------
+# カーソル（キーセット）ページネーション
+# OFFSET/COUNT(*) を使わず、前ページ末尾のキー値から続きを取得する
+# -------------------------------------------------------------------
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder は日時をミリ秒に切り捨てるため、マイクロ秒まで残す
+    # （切り捨てると、同じミリ秒の行がキーの比較で飛ばされる・重複する）
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat(timespec='microseconds')
+        return super().default(o)
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, approximate_total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_total = approximate_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    def __init__(self, queryset, ordering, per_page=10, with_total=False):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.per_page = per_page
+        self.with_total = with_total
+        ordering = list(ordering)
+        # 並び順を一意にするため、最後に主キーを必ず含める
+        pk_name = self.model._meta.pk.name
+        if not any(key.lstrip('-') in (pk_name, 'pk') for key in ordering):
+            ordering.append(pk_name)
+        self.ordering = ordering
+        self.fields = [self.model._meta.get_field(key.lstrip('-')) for key in ordering]
+
+    # --- トークンの変換 ---------------------------------------------
+    # 件数（with_total）は先頭ページでだけ求め、以降のページはカーソルに持たせて引き継ぐ
+    def encode_cursor(self, obj, direction, total=None):
+        data = {'k': [getattr(obj, field.attname) for field in self.fields], 'd': direction}
+        if total is not None:
+            data['t'] = total
+        raw = json.dumps(data, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            values = data['k']
+            direction = data['d']
+            total = data.get('t')
+            if direction not in ('n', 'p') or len(values) != len(self.fields):
+                return None
+            if total is not None and (type(total) is not int or total < 0):
+                return None
+            return [field.to_python(value) for field, value in zip(self.fields, values)], direction, total
+        except (ValueError, KeyError, TypeError, binascii.Error, UnicodeDecodeError):
+            # 不正なトークンは先頭ページ扱い
+            return None
+
+    # --- 検索条件の組み立て -----------------------------------------
+    def _keyset_filter(self, values, reverse):
+        # (a, b, c) > (x, y, z) を a > x OR (a = x AND b > y) OR ... に展開する
+        condition = Q()
+        equal = Q()
+        for key, field, value in zip(self.ordering, self.fields, values):
+            descending = key.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field.attname}__{lookup}': value})
+            equal &= Q(**{field.attname: value})
+        return condition
+
+    def _order_by(self, reverse):
+        if not reverse:
+            return self.ordering
+        return [key[1:] if key.startswith('-') else '-' + key for key in self.ordering]
+
+    def _fetch(self, queryset, decoded, reverse):
+        if decoded is not None:
+            queryset = queryset.filter(self._keyset_filter(decoded[0], reverse))
+        # 1件多く取得して次ページの有無を判定する
+        return list(queryset.order_by(*self._order_by(reverse))[:self.per_page + 1])
+
+    def _fetch_rows(self, decoded, reverse):
+        return self._fetch(self.queryset, decoded, reverse)
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        reverse = decoded is not None and decoded[1] == 'p'
+        rows = self._fetch_rows(decoded, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        total = None
+        if self.with_total:
+            total = decoded[2] if decoded is not None else None
+            if total is None:
+                total = approximate_count(self.queryset)
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = self.encode_cursor(rows[-1], 'n', total)
+            if decoded is not None and (has_more or not reverse):
+                previous_cursor = self.encode_cursor(rows[0], 'p', total)
+        return CursorPage(rows, next_cursor, previous_cursor, total)
+
+
+class TieredCursorPaginator(CursorPaginator):
+    # 新しい行の表（queryset）と、古い行を移した保管用の表（cold_queryset）を1つの並びとしてページ分割する
+    # 並び順の先頭は降順のキー（例: -date）とし、保管用の表の行はそのキーがすべて cold_until 以前であること
+    # 保管用の表は、ページが新しい行だけで埋まらない場合（または前のページが cold_until 以前に及ぶ場合）だけ検索する
+    def __init__(self, queryset, cold_queryset, ordering, cold_until, per_page=10):
+        super().__init__(queryset, ordering, per_page)
+        if not self.ordering[0].startswith('-'):
+            raise ValueError('TieredCursorPaginator の並び順の先頭は降順にしてください。')
+        self.cold_queryset = cold_queryset
+        self.cold_until = cold_until
+
+    def _needs_cold(self, rows, decoded, reverse):
+        if self.cold_until is None:
+            return False
+        if reverse:
+            # 前のページ（新しい方向）: カーソルが cold_until より新しければ、保管用の表に該当する行はない
+            return decoded[0][0] <= self.cold_until
+        return len(rows) <= self.per_page or getattr(rows[-1], self.fields[0].attname) <= self.cold_until
+
+    def _fetch_rows(self, decoded, reverse):
+        rows = self._fetch(self.queryset, decoded, reverse)
+        if not self._needs_cold(rows, decoded, reverse):
+            return rows
+        rows += self._fetch(self.cold_queryset, decoded, reverse)
+        # 両方の結果を並び順どおりに並べ直す（安定ソートを後ろのキーから順に適用する）
+        for key, field in reversed(list(zip(self._order_by(reverse), self.fields))):
+            rows.sort(key=lambda row: getattr(row, field.attname), reverse=key.startswith('-'))
+        return rows[:self.per_page + 1]
+
+
+def approximate_count(queryset):
+    # 絞り込みのない全件一覧であれば、統計情報の概算件数を使う（COUNT(*) を避ける）
+    connection = connections[queryset.db]
+    if not queryset.query.where and connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] is not None:
+            return row[0]
+    return queryset.count()
@@ -0,0 +1,99 @@
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# -------------------------------------------------------------------
+# 参照用レプリカへの振り分け
+# 検索・一覧の画面（read_from_replica を付けた画面）の読み込みだけをレプリカに送り、
+# 書き込みと確認画面からの登録はすべてプライマリに送る
+# 書き込みを行った従業員の読み込みは、一定時間プライマリに固定する（自分の書き込みが見えるように）
+# -------------------------------------------------------------------
+PRIMARY = 'default'
+
+# このリクエストの読み込み先と、このリクエストで書き込みを行ったか
+_read_database = ContextVar('abaranti_read_database', default=PRIMARY)
+_written = ContextVar('abaranti_written', default=False)
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def replica_alias():
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def current_read_database():
+    # このリクエストの読み込み先（書き込み後はプライマリ）
+    return PRIMARY if _written.get() else _read_database.get()
+
+
+def pin_cache_key(user_pk):
+    return f'abaranti:replica_pin:{user_pk}'
+
+
+def is_pinned(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    return cache.get(pin_cache_key(user.pk)) is not None
+
+
+def pin_to_primary(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        cache.set(pin_cache_key(user.pk), 1, getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def mark_writes(execute, sql, params, many, context):
+    # connection.execute_wrapper から呼ばれ、書き込みの SQL を実行したことを記録する
+    # （get_or_create の検索なども書き込み先を問い合わせるため、振り分けの判断では記録しない）
+    if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        _written.set(True)
+    return execute(sql, params, many, context)
+
+
+def read_from_replica(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = replica_alias()
+        if alias is None or is_pinned(request):
+            return view(request, *args, **kwargs)
+        token = _read_database.set(alias)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_database.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # 同じリクエスト内で書き込んだ後はプライマリから読む
+        return current_read_database()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製のため、どちらから読んだオブジェクトでも関連付けてよい
+        return True
+
+
+class ReplicaPinMiddleware:
+    # 書き込みを行ったリクエストの後、その従業員の読み込みをプライマリに固定する
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _written.set(False)
+        try:
+            with connections[PRIMARY].execute_wrapper(mark_writes):
+                response = self.get_response(request)
+            if _written.get():
+                pin_to_primary(request)
+        finally:
+            _written.reset(token)
+        return response
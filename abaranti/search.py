@@ -0,0 +1,124 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from .models import Patient, PatientSearchEntry, PatientSearchGram
+from .text import normalize
+
+# 検索結果の最大件数
+SEARCH_LIMIT = 50
+
+# 一致の種類（小さいほど上位）
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_PARTIAL = 2
+
+
+# -------------------------------------------------------------------
+# n-gram（部分一致検索のトークン。正規化は text.normalize）
+# -------------------------------------------------------------------
+def ngrams(text):
+    # 1文字の検索にも対応できるよう、1-gram と 2-gram の両方を作る
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+# -------------------------------------------------------------------
+# インデックスの更新
+# -------------------------------------------------------------------
+def index_patient(patient):
+    last_name = normalize(patient.last_name)
+    first_name = normalize(patient.first_name)
+    with transaction.atomic():
+        PatientSearchEntry.objects.update_or_create(
+            patient=patient,
+            defaults={
+                'last_name_norm': last_name,
+                'first_name_norm': first_name,
+                'full_name_norm': last_name + first_name,
+            },
+        )
+        grams = ngrams(last_name) | ngrams(first_name)
+        existing = set(PatientSearchGram.objects.filter(patient=patient).values_list('gram', flat=True))
+        PatientSearchGram.objects.filter(patient=patient, gram__in=existing - grams).delete()
+        PatientSearchGram.objects.bulk_create(
+            [PatientSearchGram(gram=gram, patient=patient) for gram in grams - existing]
+        )
+
+
+def bulk_index(patients, batch_size=1000):
+    # 新規に登録した患者をまとめてインデックスに追加する（bulk_create ではシグナルが呼ばれないため）
+    entries = []
+    grams = []
+    for patient in patients:
+        last_name = normalize(patient.last_name)
+        first_name = normalize(patient.first_name)
+        entries.append(PatientSearchEntry(patient=patient, last_name_norm=last_name,
+                                          first_name_norm=first_name, full_name_norm=last_name + first_name))
+        grams.extend(PatientSearchGram(gram=gram, patient=patient)
+                     for gram in ngrams(last_name) | ngrams(first_name))
+    PatientSearchEntry.objects.bulk_create(entries, batch_size=batch_size)
+    PatientSearchGram.objects.bulk_create(grams, batch_size=batch_size)
+
+
+def rebuild_index(batch_size=1000):
+    # 削除から再登録までを1トランザクションで行い、再作成中も検索には作り直す前のインデックスが見えるようにする
+    with transaction.atomic():
+        PatientSearchGram.objects.all().delete()
+        PatientSearchEntry.objects.all().delete()
+        batch = []
+        count = 0
+        for patient in Patient.objects.order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(patient)
+            count += 1
+            if len(batch) >= batch_size:
+                bulk_index(batch, batch_size)
+                batch = []
+        bulk_index(batch, batch_size)
+    return count
+
+
+# -------------------------------------------------------------------
+# 検索
+# -------------------------------------------------------------------
+NAME_FIELDS = ('search_entry__last_name_norm', 'search_entry__first_name_norm', 'search_entry__full_name_norm')
+
+
+def _names_match(lookup, term):
+    return reduce(or_, (Q(**{f'{field}__{lookup}': term}) for field in NAME_FIELDS))
+
+
+def _candidates(term):
+    # 語の n-gram をすべて含む患者（患者ごとに集計し、一致した n-gram の数で判定する。インデックス参照のみ）
+    grams = ngrams(term) if len(term) == 1 else {term[i:i + 2] for i in range(len(term) - 1)}
+    return Q(pk__in=PatientSearchGram.objects.filter(gram__in=grams).values('patient_id')
+             .annotate(hits=Count('gram')).filter(hits=len(grams)).values('patient_id'))
+
+
+def _rank(term):
+    # 一致の種類（一致しない語も部分一致と同じ値とし、一致した語の数が同じ患者どうしの順位は変えない）
+    return Case(
+        When(_names_match('exact', term), then=Value(RANK_EXACT)),
+        When(_names_match('startswith', term), then=Value(RANK_PREFIX)),
+        default=Value(RANK_PARTIAL), output_field=IntegerField(),
+    )
+
+
+def search_patients(query, limit=SEARCH_LIMIT):
+    terms = [term for term in (normalize(word) for word in query.split()) if term]
+    if not terms:
+        return []
+
+    # 候補の絞り込み・順位付け・件数の制限をすべて SQL で行い、上位 limit 件の患者だけを取得する
+    # 順位: 一致した語の数 → 語ごとの一致の種類（完全一致 > 前方一致 > 部分一致）→ 患者ID
+    matched = sum((Case(When(_names_match('contains', term), then=Value(1)), default=Value(0),
+                        output_field=IntegerField()) for term in terms), Value(0))
+    score = sum((_rank(term) for term in terms), Value(0))
+    return list(
+        Patient.objects.filter(reduce(or_, (_candidates(term) for term in terms)))
+        .annotate(matched=matched, score=score).filter(matched__gt=0)
+        .order_by('-matched', 'score', 'pk')[:limit]
+    )
@@ -0,0 +1,238 @@
+import csv
+import random
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import catalog, fragments, usage
+from .expiry import adjust_count
+from .models import (Employee, GazetteerEntry, Hospital, Medicine, MedicineStock, Patient, Supplier, SupplierMedicine,
+                     Treatment)
+from .search import bulk_index
+from .watermarks import touch
+
+# -------------------------------------------------------------------
+# 性能測定用のデータ生成
+# 乱数の種を固定し、同じ件数なら毎回同じデータが登録されるようにする
+# -------------------------------------------------------------------
+DEFAULT_VOLUMES = {
+    'hospitals': 2_000,
+    'medicines': 500,
+    'suppliers': 20,
+    'patients': 100_000,
+    'treatments': 5_000_000,
+}
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+# 性能測定でログインする従業員
+BENCHMARK_USERS = {
+    'reception': ('BENCH01', Employee.Role.RECEPTION),
+    'doctor': ('BENCH02', Employee.Role.DOCTOR),
+}
+BENCHMARK_PASSWORD = 'benchmark'
+
+LAST_NAMES = (
+    ('佐藤', 'サトウ'), ('鈴木', 'スズキ'), ('高橋', 'タカハシ'), ('田中', 'タナカ'), ('伊藤', 'イトウ'),
+    ('渡辺', 'ワタナベ'), ('山本', 'ヤマモト'), ('中村', 'ナカムラ'), ('小林', 'コバヤシ'), ('加藤', 'カトウ'),
+    ('吉田', 'ヨシダ'), ('山田', 'ヤマダ'), ('佐々木', 'ササキ'), ('山口', 'ヤマグチ'), ('松本', 'マツモト'),
+    ('井上', 'イノウエ'), ('木村', 'キムラ'), ('林', 'ハヤシ'), ('斎藤', 'サイトウ'), ('清水', 'シミズ'),
+    ('山崎', 'ヤマザキ'), ('森', 'モリ'), ('池田', 'イケダ'), ('橋本', 'ハシモト'), ('阿部', 'アベ'),
+    ('石川', 'イシカワ'), ('山下', 'ヤマシタ'), ('中島', 'ナカジマ'), ('石井', 'イシイ'), ('小川', 'オガワ'),
+    ('前田', 'マエダ'), ('岡田', 'オカダ'), ('長谷川', 'ハセガワ'), ('藤田', 'フジタ'), ('後藤', 'ゴトウ'),
+    ('近藤', 'コンドウ'), ('村上', 'ムラカミ'), ('遠藤', 'エンドウ'), ('青木', 'アオキ'), ('坂本', 'サカモト'),
+)
+FIRST_NAMES = (
+    # ((男, 読み), (女, 読み))
+    (('太郎', 'タロウ'), ('花子', 'ハナコ')), (('翔太', 'ショウタ'), ('美咲', 'ミサキ')),
+    (('大輔', 'ダイスケ'), ('陽子', 'ヨウコ')), (('健一', 'ケンイチ'), ('恵子', 'ケイコ')),
+    (('拓也', 'タクヤ'), ('優子', 'ユウコ')), (('直樹', 'ナオキ'), ('由美', 'ユミ')),
+    (('和也', 'カズヤ'), ('真由美', 'マユミ')), (('達也', 'タツヤ'), ('裕子', 'ユウコ')),
+    (('誠', 'マコト'), ('直美', 'ナオミ')), (('浩二', 'コウジ'), ('智子', 'トモコ')),
+    (('蓮', 'レン'), ('陽菜', 'ヒナ')), (('悠真', 'ユウマ'), ('結衣', 'ユイ')),
+    (('大翔', 'ヒロト'), ('葵', 'アオイ')), (('湊', 'ミナト'), ('さくら', 'サクラ')),
+    (('陽翔', 'ハルト'), ('凛', 'リン')), (('一郎', 'イチロウ'), ('久美子', 'クミコ')),
+    (('修', 'オサム'), ('明美', 'アケミ')), (('隆', 'タカシ'), ('幸子', 'サチコ')),
+    (('進', 'ススム'), ('和子', 'カズコ')), (('清', 'キヨシ'), ('節子', 'セツコ')),
+)
+HOSPITAL_SUFFIXES = ('病院', '総合病院', '中央病院', '記念病院', '医療センター', 'クリニック')
+MEDICINE_NAMES = (
+    'ロキソプロフェン', 'アセトアミノフェン', 'アムロジピン', 'メトホルミン', 'ランソプラゾール',
+    'ファモチジン', 'レバミピド', 'クラリスロマイシン', 'アモキシシリン', 'セフカペン',
+    'プレドニゾロン', 'ロスバスタチン', 'カンデサルタン', 'ビソプロロール', 'ワルファリン',
+    'フロセミド', 'モンテルカスト', 'フェキソフェナジン', 'ゾルピデム', 'エチゾラム',
+)
+MEDICINE_FORMS = (('錠', '錠'), ('カプセル', 'C'), ('散', 'g'), ('シロップ', 'mL'), ('注', 'A'))
+
+
+def load_places():
+    # 同梱の地名辞書から、町域または市区町村まである行を住所の材料にする
+    with open(GAZETTEER_PATH, encoding='utf-8', newline='') as f:
+        return [(row['prefecture'], row['municipality'], row['town']) for row in csv.DictReader(f)
+                if row['municipality']]
+
+
+def random_address(rng, places):
+    prefecture, municipality, town = rng.choice(places)
+    number = f'{rng.randint(1, 9)}-{rng.randint(1, 30)}-{rng.randint(1, 20)}'
+    return f'{prefecture}{municipality}{town}{number}', town or municipality
+
+
+def random_phone(rng):
+    return f'0{rng.randint(3, 99)}-{rng.randint(100, 9999)}-{rng.randint(1000, 9999)}'
+
+
+def ensure_benchmark_users():
+    for username, role in BENCHMARK_USERS.values():
+        if not Employee.objects.filter(pk=username).exists():
+            Employee.objects.create_user(username=username, password=BENCHMARK_PASSWORD, first_name='測定',
+                                         last_name='用', role=role)
+
+
+def generate_hospitals(rng, count, places):
+    locate = lru_cache(maxsize=None)(GazetteerEntry.objects.locate)
+    for i in range(1, count + 1):
+        address, place = random_address(rng, places)
+        hospital = Hospital(
+            hospital_id=f'H{i:07d}',
+            hospital_name=f'{place}{rng.choice(HOSPITAL_SUFFIXES)}',
+            hospital_address=address,
+            phone_number=random_phone(rng),
+            capital=rng.randrange(100, 100_000, 100),
+            emergency=rng.choice((0, 1)),
+        )
+        hospital.update_address_components(locate=locate)
+        yield hospital
+
+
+def generate_medicines(rng, count):
+    for i in range(1, count + 1):
+        form, unit = MEDICINE_FORMS[i % len(MEDICINE_FORMS)]
+        name = f'{MEDICINE_NAMES[i % len(MEDICINE_NAMES)]}{form}{rng.choice((1, 2.5, 5, 10, 20, 100))}'
+        yield Medicine(medicineid=f'M{i:07d}', medicinename=name, unit=unit)
+
+
+def generate_suppliers(rng, count, places):
+    for i in range(1, count + 1):
+        address, place = random_address(rng, places)
+        yield Supplier(supplier_id=f'S{i:07d}', supplier_name=f'{place}薬品', supplier_address=address,
+                       phone_number=random_phone(rng), capital=rng.randrange(1000, 100_000, 100),
+                       delivery_time=rng.randint(1, 14))
+
+
+def generate_stock(rng, medicines, suppliers):
+    # 薬剤ごとに1〜3社の仕入先と、初期在庫を設定する
+    for i in range(1, medicines + 1):
+        medicine_id = f'M{i:07d}'
+        yield MedicineStock(medicine_id=medicine_id, on_hand=rng.randint(0, 5000))
+        for n, supplier in enumerate(rng.sample(range(1, suppliers + 1), min(rng.randint(1, 3), suppliers))):
+            yield SupplierMedicine(supplier_id=f'S{supplier:07d}', medicine_id=medicine_id,
+                                   lot_size=rng.choice((1, 10, 100)), preferred=n == 0)
+
+
+def generate_patients(rng, count, today):
+    for i in range(1, count + 1):
+        gender = rng.choice((0, 1))
+        last_name, last_name_kana = rng.choice(LAST_NAMES)
+        first_name, first_name_kana = rng.choice(FIRST_NAMES)[gender]
+        patient = Patient(
+            patient_id=f'P{i:07d}',
+            last_name=last_name,
+            first_name=first_name,
+            last_name_kana=last_name_kana,
+            first_name_kana=first_name_kana,
+            gender=gender,
+            birthdate=date(1930, 1, 1) + timedelta(days=rng.randrange(365 * 90)),
+            insurance_number=f'{rng.randrange(10 ** 8):08d}',
+            # 期限切れ〜3年後まで（期限確認の各区分に患者が入るようにする）
+            insurance_exp=today + timedelta(days=rng.randint(-180, 365 * 3)),
+        )
+        patient.update_blocking_keys()
+        yield patient
+
+
+def generate_treatments(rng, count, patients, medicines, today):
+    # 直近2年間に分散させる。先頭の患者には多めに割り当て、処置履歴の多い患者として測定に使う
+    start = timezone.make_aware(datetime.combine(today - timedelta(days=730), time.min))
+    heavy = max(count // 100, 1)
+    for i in range(count):
+        patient = 1 if i < heavy else rng.randint(1, patients)
+        yield Treatment(
+            patient_id=f'P{patient:07d}',
+            medicine_id=f'M{rng.randint(1, medicines):07d}',
+            quantity=rng.randint(1, 30),
+            date=start + timedelta(seconds=rng.randrange(730 * 86400)),
+            doctor_id=BENCHMARK_USERS['doctor'][0],
+        )
+
+
+def _batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_treatments(treatments):
+    # 処置日時は auto_now_add のため登録時の日時になる。生成した日時（直近2年間）は登録後に主キーを指定して書き込む
+    # 登録した行の主キーは、登録前の最大値より大きい主キーを順に読んで求める（bulk_create で主キーが返らない MySQL でも同じ）
+    dates = [treatment.date for treatment in treatments]
+    last_id = Treatment.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    Treatment.objects.bulk_create(treatments)
+    ids = Treatment.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+    for treatment, pk, day in zip(treatments, ids, dates, strict=True):
+        treatment.pk = pk
+        treatment.date = day
+    Treatment.objects.bulk_update(treatments, ['date'])
+
+
+def seed(volumes=None, random_seed=0, batch_size=5000, progress=None):
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    rng = random.Random(random_seed)
+    today = date.today()
+    places = load_places()
+    report = progress or (lambda kind, done, total: None)
+
+    ensure_benchmark_users()
+    steps = (
+        ('hospitals', generate_hospitals(rng, volumes['hospitals'], places)),
+        ('medicines', generate_medicines(rng, volumes['medicines'])),
+        ('suppliers', generate_suppliers(rng, volumes['suppliers'], places)),
+        ('stock', generate_stock(rng, volumes['medicines'], volumes['suppliers'])),
+        ('patients', generate_patients(rng, volumes['patients'], today)),
+        ('treatments', generate_treatments(rng, volumes['treatments'], volumes['patients'], volumes['medicines'],
+                                           today)),
+    )
+    for kind, objects in steps:
+        done = 0
+        for batch in _batches(objects, batch_size):
+            with transaction.atomic():
+                for model in dict.fromkeys(type(obj) for obj in batch):
+                    rows = [obj for obj in batch if type(obj) is model]
+                    if model is Treatment:
+                        create_treatments(rows)
+                    else:
+                        model.objects.bulk_create(rows)
+                if kind == 'patients':
+                    # bulk_create ではシグナルが呼ばれないため、検索インデックスと期限集計をここで更新する
+                    bulk_index(batch)
+                    for insurance_exp, count in Counter(patient.insurance_exp for patient in batch).items():
+                        adjust_count(insurance_exp, count)
+            done += len(batch)
+            report(kind, done, volumes.get(kind, done))
+    # 処置は bulk_create で登録したため、使用量の集計表は最後にまとめて作る
+    usage.rebuild()
+    catalog.invalidate()
+    fragments.invalidate()
+    for table in ('hospital', 'medicine', 'patient'):
+        touch(table)
+    return volumes
@@ -0,0 +1,123 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog, fragments, typeahead, usage
+from .watermarks import touch
+from .archive import moving_to_archive
+from .backends import invalidate_employee
+from .expiry import adjust_count
+from .models import ArchivedTreatment, Employee, Hospital, Medicine, Patient, Treatment
+from .search import index_patient
+from .stock import record_treatments
+
+
+# 患者の登録・更新時に検索インデックスを更新する
+# （削除時はインデックス行も CASCADE で削除される）
+@receiver(post_save, sender=Patient)
+def update_patient_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    index_patient(instance)
+
+
+# 患者の候補表示のインデックス（このプロセス分）を更新する（コミット後に反映）
+@receiver(post_save, sender=Patient)
+def update_patient_typeahead(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(lambda: typeahead.index.update(instance))
+
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_typeahead(sender, instance, **kwargs):
+    def remove():
+        typeahead.index.remove(instance.pk)
+        typeahead.record_deletion()
+    transaction.on_commit(remove)
+
+
+# 薬剤マスタの変更時にキャッシュの世代を進める（コミット後に反映）
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def invalidate_medicine_catalog(sender, **kwargs):
+    transaction.on_commit(catalog.invalidate)
+
+
+# 他病院の登録・変更時に一覧・検索結果のキャッシュの世代を進める（コミット後に反映）
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def invalidate_hospital_fragments(sender, **kwargs):
+    transaction.on_commit(fragments.invalidate)
+
+
+# 保険証有効期限の集計表を差分で更新する
+@receiver(pre_save, sender=Patient)
+def remember_insurance_exp(sender, instance, raw=False, **kwargs):
+    # 新しいインスタンスでも、登録済みの患者IDで保存すると既存の行の上書きになるため、保存前の期限を読む
+    if raw:
+        instance._previous_insurance_exp = None
+    elif getattr(instance, '_loaded_insurance_exp', None) is not None:
+        instance._previous_insurance_exp = instance._loaded_insurance_exp
+    else:
+        instance._previous_insurance_exp = (
+            Patient.objects.filter(pk=instance.pk).values_list('insurance_exp', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Patient)
+def update_insurance_expiry_count(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_insurance_exp', None)
+    if previous != instance.insurance_exp:
+        adjust_count(previous, -1)
+        adjust_count(instance.insurance_exp, 1)
+    instance._loaded_insurance_exp = instance.insurance_exp
+
+
+@receiver(post_delete, sender=Patient)
+def remove_insurance_expiry_count(sender, instance, **kwargs):
+    adjust_count(getattr(instance, '_loaded_insurance_exp', None) or instance.insurance_exp, -1)
+
+
+# 他病院・薬剤・患者の登録・変更・削除時にテーブルの最終更新日時を進める（条件付き GET 用）
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def touch_table_watermark(sender, raw=False, **kwargs):
+    if raw:
+        return
+    touch(sender._meta.model_name)
+
+
+# 処置を1件ずつ登録した場合の在庫・使用量の更新（bulk_create の場合は呼び出し側で更新する）
+# Treatment.save が登録とこの更新を1トランザクションで囲む
+@receiver(post_save, sender=Treatment)
+def update_medicine_stock(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    record_treatments([instance])
+
+
+# 処置の削除時は使用量の集計表だけを戻す（患者の削除に伴う削除、保管用の表からの削除を含む）
+# 記録を削除しても払い出した薬剤は棚に戻らないため、在庫数は変えない（戻す場合は stock.adjust で補正する）
+# 保管用の表へ移すための削除は処置の取り消しではないため、集計表は戻さない
+@receiver(post_delete, sender=Treatment)
+@receiver(post_delete, sender=ArchivedTreatment)
+def remove_medicine_usage(sender, instance, **kwargs):
+    if moving_to_archive():
+        return
+    usage.record([instance], sign=-1)
+
+
+# 従業員の更新時にログイン中の従業員のキャッシュを破棄する
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_cache(sender, instance, **kwargs):
+    invalidate_employee(instance.username)
+    # コミット前に他のリクエストが古い値をキャッシュしても残らないよう、コミット後にも破棄する
+    transaction.on_commit(lambda: invalidate_employee(instance.username))
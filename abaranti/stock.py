@@ -0,0 +1,98 @@
+import math
+from collections import Counter
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from . import usage
+from .models import MedicineDailyUsage, MedicineStock, StockOrder, SupplierMedicine
+from .usage import increment
+
+# -------------------------------------------------------------------
+# 薬剤の在庫
+# 処置の登録と同じトランザクションで、在庫数と使用量の集計表（usage）を F() で増減する
+# 処置を削除しても払い出した薬剤は棚に戻らないため、削除時は使用量の集計表だけを戻す（在庫数の補正は adjust で行う）
+# 発注案は日別の使用量（直近 STOCK_ROLLING_DAYS 日）と仕入先の納期から求め、処置の履歴は参照しない
+# -------------------------------------------------------------------
+OPEN_STATUSES = (StockOrder.Status.PROPOSED, StockOrder.Status.ORDERED)
+
+
+def record_treatments(treatments):
+    # 処置の登録（INSERT）と同じトランザクション内で呼ぶ
+    # 同時に登録されても行ロックの順序が揃うよう、薬剤IDの順に更新する
+    dispensed = Counter()
+    for treatment in treatments:
+        dispensed[treatment.medicine_id] += treatment.quantity
+    for medicine_id in sorted(dispensed):
+        increment(MedicineStock, {'medicine_id': medicine_id}, 'on_hand', -dispensed[medicine_id])
+    usage.record(treatments)
+
+
+def adjust(medicine_id, delta):
+    # 棚卸し・返品（使わなかった薬剤を棚に戻した場合）などによる在庫数の補正
+    with transaction.atomic():
+        increment(MedicineStock, {'medicine_id': medicine_id}, 'on_hand', delta)
+
+
+def receive(order):
+    with transaction.atomic():
+        order = StockOrder.objects.select_for_update().get(pk=order.pk)
+        if order.status not in OPEN_STATUSES:
+            raise ValueError(f'発注 {order.pk} は入荷できる状態ではありません。')
+        order.status = StockOrder.Status.RECEIVED
+        order.save(update_fields=['status'])
+        increment(MedicineStock, {'medicine_id': order.medicine_id}, 'on_hand', order.quantity)
+    return order
+
+
+def consumption_rates(today=None, days=None):
+    # 薬剤ごとの1日あたりの使用量（直近 days 日の平均）
+    today = today or date.today()
+    days = days or getattr(settings, 'STOCK_ROLLING_DAYS', 28)
+    totals = (MedicineDailyUsage.objects.filter(date__gt=today - timedelta(days=days), date__lte=today)
+              .values_list('medicine_id').annotate(total=Sum('quantity')))
+    return {medicine_id: total / days for medicine_id, total in totals}
+
+
+def propose_orders(today=None, save=True):
+    # 戻り値: (発注案のリスト, 仕入先が登録されていない使用中の薬剤IDのリスト)
+    today = today or date.today()
+    safety_days = getattr(settings, 'STOCK_SAFETY_DAYS', 3)
+    review_days = getattr(settings, 'STOCK_REVIEW_DAYS', 7)
+
+    rates = consumption_rates(today)
+    on_hand = dict(MedicineStock.objects.values_list('medicine_id', 'on_hand'))
+    on_order = dict(StockOrder.objects.filter(status__in=OPEN_STATUSES)
+                    .values_list('medicine_id').annotate(total=Sum('quantity')))
+    # 薬剤ごとに、優先の仕入先 → 納期の短い仕入先を選ぶ
+    links = {}
+    for link in (SupplierMedicine.objects.select_related('supplier')
+                 .order_by('medicine_id', '-preferred', 'supplier__delivery_time', 'supplier_id')):
+        links.setdefault(link.medicine_id, link)
+
+    orders = []
+    unlinked = []
+    for medicine_id, rate in sorted(rates.items()):
+        if rate <= 0:
+            continue
+        link = links.get(medicine_id)
+        if link is None:
+            unlinked.append(medicine_id)
+            continue
+        lead_time = link.supplier.delivery_time
+        safety_stock = rate * safety_days
+        # 在庫数 + 未入荷の発注数が、納期中の使用量 + 安全在庫を下回ったら発注する
+        position = on_hand.get(medicine_id, 0) + on_order.get(medicine_id, 0)
+        if position > rate * lead_time + safety_stock:
+            continue
+        target = rate * (lead_time + review_days) + safety_stock
+        lot_size = max(link.lot_size, 1)
+        quantity = max(math.ceil((target - position) / lot_size), 1) * lot_size
+        orders.append(StockOrder(medicine_id=medicine_id, supplier=link.supplier, quantity=quantity,
+                                 expected_date=today + timedelta(days=lead_time)))
+    if save and orders:
+        StockOrder.objects.bulk_create(orders)
+    return orders, unlinked
+
@@ -1,3 +1,1378 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import F
+from django.template.backends.django import Template as DjangoTemplate
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, benchmark, catalog, duplicates, expiry, jobs, metrics, search, stock, typeahead, usage
+from .address import parse_address
+from .db.pool import ConnectionPool
+from .export import export_chunks
+from .forms import MedicationInstructionLineForm
+from .geo import grid_cell, nearest
+from .models import (ArchivedTreatment, DoctorMonthlyUsage, Employee, GazetteerEntry, Hospital, InsuranceExpiryCount,
+                     Job, Medicine, MedicineDailyUsage, MedicineMonthlyUsage, MedicineStock, Patient, StockOrder,
+                     Supplier, SupplierMedicine, Treatment)
+from .pagination import CursorPaginator
+from .routers import ReplicaPinMiddleware, is_pinned
+from .seed import seed
+from .text import normalize
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# 処置履歴APIの発行クエリ数（件数に関わらず一定であること）
+@override_settings(CACHES=LOCMEM_CACHES)
+class TreatmentHistoryQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Employee.objects.create_user(username='D0001', password='password', first_name='太郎',
+                                                  last_name='医師', role=Employee.Role.DOCTOR)
+        cls.patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                             birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                             insurance_exp=date(2030, 3, 31))
+        cls.medicines = [Medicine.objects.create(medicineid=f'M{i:04d}', medicinename=f'薬剤{i}', unit='錠')
+                         for i in range(5)]
+
+    def setUp(self):
+        cache.clear()
+
+    def add_treatments(self, count):
+        Treatment.objects.bulk_create([
+            Treatment(patient=self.patient, medicine=self.medicines[i % len(self.medicines)], quantity=1)
+            for i in range(count)
+        ])
+
+    def fetch_history(self):
+        # 処置履歴（薬剤を結合）の1クエリのみ（セッション・ログイン中の従業員はキャッシュから読む）
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('treatment_history_api'), {'patient_id': self.patient.patient_id})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.client.force_login(self.doctor)
+        self.client.get(reverse('treatment_history_api'), {'patient_id': self.patient.patient_id})
+        self.add_treatments(3)
+        self.assertEqual(len(self.fetch_history()['treatments']), 3)
+        self.add_treatments(60)
+        data = self.fetch_history()
+        self.assertEqual(len(data['treatments']), 20)
+        self.assertTrue(all(row['medicinename'] for row in data['treatments']))
+
+    def test_cursor_pages_across_rows_in_same_millisecond(self):
+        # 一括確定した処置（同じミリ秒に登録された複数行）でも、前後のページで欠けも重複もしない
+        self.add_treatments(50)
+        same_millisecond = timezone.now().replace(microsecond=500000)
+        for i, pk in enumerate(Treatment.objects.order_by('id').values_list('id', flat=True)):
+            Treatment.objects.filter(pk=pk).update(date=same_millisecond + timedelta(microseconds=i % 3 * 10))
+        expected = list(Treatment.objects.order_by('-date', 'id').values_list('id', flat=True))
+        self.client.force_login(self.doctor)
+
+        def fetch(cursor=None):
+            params = {'patient_id': self.patient.patient_id}
+            if cursor:
+                params['cursor'] = cursor
+            return self.client.get(reverse('treatment_history_api'), params).json()
+
+        pages = [fetch()]
+        while pages[-1]['next_cursor']:
+            pages.append(fetch(pages[-1]['next_cursor']))
+        self.assertEqual([row['id'] for page in pages for row in page['treatments']], expected)
+        page = pages[-1]
+        backward = [row['id'] for row in page['treatments']]
+        while page['previous_cursor']:
+            page = fetch(page['previous_cursor'])
+            backward = [row['id'] for row in page['treatments']] + backward
+        self.assertEqual(backward, expected)
+        # 画面（check_treatment_history）も同じカーソルで2ページ目を表示する
+        response = self.client.get(reverse('check_treatment_history'),
+                                   {'patient_id': self.patient.patient_id, 'cursor': pages[0]['next_cursor']})
+        self.assertEqual([treatment.id for treatment in response.context['treatments']], expected[20:40])
+
+
+# カーソルページネーション（キーの日時が同じミリ秒・同じ値の行を欠かさず、重複せずにたどれること）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                         birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                         insurance_exp=date(2030, 3, 31))
+        medicine = Medicine.objects.create(medicineid='M0001', medicinename='薬剤1', unit='錠')
+        Treatment.objects.bulk_create([Treatment(patient=patient, medicine=medicine, quantity=1)
+                                       for _ in range(200)])
+        # すべて同じミリ秒（マイクロ秒だけが異なる・同じ値の行を含む）にする
+        base = timezone.now().replace(microsecond=123000)
+        for i, pk in enumerate(Treatment.objects.order_by('id').values_list('id', flat=True)):
+            Treatment.objects.filter(pk=pk).update(date=base + timedelta(microseconds=i % 7 * 100))
+        cls.expected = list(Treatment.objects.order_by('-date', 'id').values_list('id', flat=True))
+
+    def test_walks_every_page_forward_and_backward(self):
+        paginator = CursorPaginator(Treatment.objects.all(), ('-date', 'id'), per_page=20)
+        pages = [paginator.get_page()]
+        while pages[-1].next_cursor:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        forward = [treatment.id for page in pages for treatment in page]
+        self.assertEqual(forward, self.expected)
+
+        page = pages[-1]
+        backward = [treatment.id for treatment in page]
+        while page.previous_cursor:
+            page = paginator.get_page(page.previous_cursor)
+            backward = [treatment.id for treatment in page] + backward
+        self.assertEqual(backward, self.expected)
+
+    def test_total_is_counted_on_first_page_only(self):
+        paginator = CursorPaginator(Treatment.objects.all(), ('-date', 'id'), per_page=20, with_total=True)
+        with self.assertNumQueries(2):
+            page = paginator.get_page()
+        self.assertEqual(page.approximate_total, 200)
+        # 2ページ目以降は件数をカーソルから引き継ぎ、COUNT(*) を発行しない
+        with self.assertNumQueries(1):
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(page.approximate_total, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.get_page(page.previous_cursor).approximate_total, 200)
+
+
+# 患者名検索（正規化・n-gram インデックス・SQL での順位付け）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class PatientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = [('P0001', '林', 'はなこ'), ('P0002', '林田', '太郎'), ('P0003', '小林', '花子'),
+                 ('P0004', '山田', '花子'), ('P0005', '山田', '太郎')]
+        cls.patients = {
+            patient_id: Patient.objects.create(patient_id=patient_id, last_name=last_name, first_name=first_name,
+                                               gender=1, birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                               insurance_exp=date(2030, 3, 31))
+            for patient_id, last_name, first_name in names
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self, query, **kwargs):
+        return [patient.pk for patient in search.search_patients(query, **kwargs)]
+
+    def test_normalize(self):
+        self.assertEqual(normalize('ﾔﾏﾀﾞ　はなこ'), 'ヤマダハナコ')
+        self.assertEqual(normalize(' ＡＢＣ１２３ '), 'abc123')
+
+    def test_ranks_exact_prefix_partial_in_sql(self):
+        # 候補の絞り込みから件数の制限までを1クエリで行う
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids('林'), ['P0001', 'P0002', 'P0003'])
+        self.assertEqual(self.ids('林', limit=2), ['P0001', 'P0002'])
+        self.assertEqual(self.ids('山田 花子'), ['P0004', 'P0003', 'P0005'])
+        # ひらがな・カタカナ、全角・半角の違いは区別しない
+        self.assertEqual(self.ids('ﾊﾅｺ'), ['P0001'])
+        self.assertEqual(self.ids('田林'), [])
+
+    def test_signals_update_index(self):
+        patient = self.patients['P0005']
+        patient.first_name = '次郎'
+        patient.save()
+        self.assertEqual(self.ids('太郎'), ['P0002'])
+        self.assertEqual(self.ids('次郎'), ['P0005'])
+        Patient.objects.create(patient_id='P0006', last_name='森', first_name='次郎', gender=0,
+                               birthdate=date(1990, 1, 1), insurance_number='87654321',
+                               insurance_exp=date(2030, 3, 31))
+        self.assertEqual(self.ids('次郎'), ['P0005', 'P0006'])
+        patient.delete()
+        self.assertEqual(self.ids('次郎'), ['P0006'])
+        self.assertEqual(search.rebuild_index(), 5)
+        self.assertEqual(self.ids('次郎'), ['P0006'])
+
+
+# 住所の分解（名前の途中に「市・区・町・村」を含む市区町村で切れないこと）
+class AddressParserTests(SimpleTestCase):
+    def parts(self, address):
+        parsed = parse_address(address)
+        return parsed['address_municipality'], parsed['address_town'], parsed['address_number']
+
+    def test_compound_municipality_names(self):
+        self.assertEqual(self.parts('長野県大町市大町1234'), ('大町市', '大町', '1234'))
+        self.assertEqual(self.parts('東京都東村山市本町1-2-3'), ('東村山市', '本町', '1-2-3'))
+        self.assertEqual(self.parts('新潟県十日町市本町一丁目1'), ('十日町市', '本町', '1-1'))
+        self.assertEqual(self.parts('三重県四日市市諏訪町1-5'), ('四日市市', '諏訪町', '1-5'))
+        self.assertEqual(self.parts('群馬県佐波郡玉村町下新田1'), ('佐波郡玉村町', '下新田', '1'))
+
+    def test_ordinary_municipality_names(self):
+        self.assertEqual(self.parts('東京都新宿区西新宿二丁目8番1号'), ('新宿区', '西新宿', '2-8-1'))
+        self.assertEqual(self.parts('神奈川県横浜市中区山下町1'), ('横浜市中区', '山下町', '1'))
+        self.assertEqual(self.parts('千葉県市川市八幡1-1'), ('市川市', '八幡', '1-1'))
+        self.assertEqual(self.parts('長野県北佐久郡軽井沢町軽井沢1'), ('北佐久郡軽井沢町', '軽井沢', '1'))
+
+    def test_city_is_matched_before_county(self):
+        # 町域名・市の名前に含まれる「郡」で郡部と誤らない
+        self.assertEqual(self.parts('奈良県大和郡山市北郡山町248-4'), ('大和郡山市', '北郡山町', '248-4'))
+        self.assertEqual(self.parts('愛知県蒲郡市旭町17-1'), ('蒲郡市', '旭町', '17-1'))
+        self.assertEqual(self.parts('福島県郡山市朝日1-23-7'), ('郡山市', '朝日', '1-23-7'))
+        self.assertEqual(self.parts('奈良県天理市郡山町1'), ('天理市', '郡山町', '1'))
+        # 郡名の途中の「市」、郡部の町名の先頭の「市」では切らない
+        self.assertEqual(self.parts('奈良県高市郡明日香村岡55'), ('高市郡明日香村', '岡', '55'))
+        self.assertEqual(self.parts('栃木県芳賀郡市貝町市塙1280'), ('芳賀郡市貝町', '市塙', '1280'))
+        self.assertEqual(self.parts('東京都千代田区市ヶ谷1'), ('千代田区', '市ヶ谷', '1'))
+
+    def test_components_fit_columns(self):
+        # 分解できない長い住所でも、各列の長さを超えない
+        hospital = Hospital(hospital_address='北海道' + 'あ' * 40 + '町' + '-'.join(['1'] * 20))
+        hospital.update_address_components(locate=lambda *args: None)
+        for name in ('address_municipality', 'address_town', 'address_number'):
+            self.assertLessEqual(len(getattr(hospital, name)), Hospital._meta.get_field(name).max_length)
+        self.assertEqual(len(hospital.address_municipality), 32)
+
+
+# 近くの救急病院の検索（格子番号・探索範囲の拡大・住所からの位置の特定）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class NearestHospitalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        places = [('東京都', '新宿区', 35.6938, 139.7034), ('東京都', '千代田区', 35.6940, 139.7536),
+                  ('神奈川県', '横浜市', 35.4437, 139.6380), ('大阪府', '大阪市', 34.6937, 135.5023)]
+        # 同梱の地名辞書に依存しないよう、試験用の地点だけにする
+        GazetteerEntry.objects.all().delete()
+        for i, (prefecture, municipality, latitude, longitude) in enumerate(places):
+            GazetteerEntry.objects.create(prefecture=prefecture, municipality=municipality, latitude=latitude,
+                                          longitude=longitude)
+            Hospital.objects.create(hospital_id=f'H{i:04d}', hospital_name=f'{municipality}病院',
+                                    hospital_address=f'{prefecture}{municipality}1-1', phone_number='03-1234-5678',
+                                    capital=1000, emergency=1)
+        # 救急対応なしの病院（既定では対象外）
+        Hospital.objects.create(hospital_id='H0100', hospital_name='新宿診療所', hospital_address='東京都新宿区2-2',
+                                phone_number='03-1234-5678', capital=1000, emergency=0)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.employee)
+
+    def fetch(self, **params):
+        return self.client.get(reverse('hospital_nearest'), params)
+
+    def test_grid_cell(self):
+        self.assertEqual(grid_cell(35.6938, 139.7034), (713, 2794))
+        # 負の座標は切り捨てで隣の格子になる
+        self.assertEqual(grid_cell(-0.01, -0.01), (-1, -1))
+        self.assertEqual((Hospital.objects.get(pk='H0000').grid_y, Hospital.objects.get(pk='H0000').grid_x),
+                         (713, 2794))
+
+    def test_search_widens_until_k_hospitals_are_found(self):
+        hospitals = Hospital.objects.filter(emergency=1)
+        # 近くで k 件がそろえば、最初の範囲の検索だけで終わる
+        with self.assertNumQueries(1):
+            self.assertEqual([hospital.pk for _, hospital in nearest(hospitals, 35.6938, 139.7034, k=1)], ['H0000'])
+        # 遠くの病院まで含める場合は、範囲を倍々に広げて探す
+        with CaptureQueriesContext(connection) as queries:
+            found = nearest(hospitals, 35.6938, 139.7034, k=4)
+        self.assertEqual([hospital.pk for _, hospital in found], ['H0000', 'H0001', 'H0002', 'H0003'])
+        self.assertGreater(len(queries), 1)
+        self.assertAlmostEqual(found[-1][0], 396, delta=5)
+
+    def test_view_by_coordinates_and_address(self):
+        data = self.fetch(lat='35.6938', lon='139.7034', k='2').json()
+        self.assertEqual([row['hospital_id'] for row in data['hospitals']], ['H0000', 'H0001'])
+        data = self.fetch(lat='35.6938', lon='139.7034', k='2', emergency='all').json()
+        self.assertEqual({row['hospital_id'] for row in data['hospitals']}, {'H0000', 'H0100'})
+        # 住所の場合は地名辞書から位置を求める（町域が登録されていなければ市区町村の代表地点）
+        data = self.fetch(address='東京都千代田区丸の内1-9', k='1').json()
+        self.assertEqual((data['latitude'], data['hospitals'][0]['hospital_id']), (35.6940, 'H0001'))
+        self.assertEqual(self.fetch(address='どこか').status_code, 400)
+
+    def test_rejects_invalid_coordinates(self):
+        for lat, lon in [('inf', '139.7'), ('nan', '139.7'), ('1e308', '139.7'), ('35.6', '-inf'), ('90.1', '0'),
+                         ('0', '180.5'), ('abc', '139.7')]:
+            response = self.fetch(lat=lat, lon=lon)
+            self.assertEqual(response.status_code, 400, (lat, lon))
+            self.assertIn('error', response.json())
+
+
+# 他病院検索（資本金の範囲・救急対応・住所の組み合わせ、資本金順のページ分割）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class HospitalCapitalSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        addresses = ('東京都新宿区西新宿1-1', '東京都千代田区丸の内1-1', '神奈川県横浜市中区山下町1')
+        for i in range(30):
+            Hospital.objects.create(hospital_id=f'H{i:04d}', hospital_name=f'病院{i}', hospital_address=addresses[i % 3],
+                                    phone_number='03-1234-5678', capital=(i * 7) % 10 * 100, emergency=i % 2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.employee)
+
+    def search(self, **params):
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get(reverse('hospital_search_by_capital'),
+                                       {**params, **({'cursor': cursor} if cursor else {})})
+            page = response.context['page_obj']
+            ids += [hospital.hospital_id for hospital in page]
+            cursor = page.next_cursor
+            if not cursor:
+                return ids
+
+    def expected(self, queryset, *ordering):
+        return list(queryset.order_by(*ordering, 'hospital_id').values_list('hospital_id', flat=True))
+
+    def test_combined_filters_page_in_capital_order(self):
+        self.assertEqual(self.search(capital_min='200', capital_max='700', emergency='1', sort='-capital'),
+                         self.expected(Hospital.objects.filter(capital__range=(200, 700), emergency=1), '-capital'))
+        self.assertEqual(self.search(capital_min='300', address='東京都千代田区'),
+                         self.expected(Hospital.objects.filter(capital__gte=300, address_municipality='千代田区'),
+                                       'capital'))
+        # 条件なしは全件を資本金の昇順で
+        self.assertEqual(self.search(sort=''), self.expected(Hospital.objects.all(), 'capital'))
+
+    def test_invalid_range_shows_form(self):
+        response = self.client.get(reverse('hospital_search_by_capital'), {'capital_min': '500', 'capital_max': '100'})
+        self.assertTemplateUsed(response, 'capital_confirmation.html')
+        self.assertIn('資本金の下限は上限以下の値を入力してください。', response.context['form'].non_field_errors())
+
+    def test_range_filter_uses_composite_index(self):
+        plan = Hospital.objects.filter(emergency=1, capital__gte=200).order_by('capital', 'hospital_id').explain()
+        self.assertIn('hospital_emergency_capital_idx', plan)
+        plan = Hospital.objects.filter(capital__range=(200, 500)).order_by('capital', 'hospital_id').explain()
+        self.assertIn('hospital_capital_idx', plan)
+
+
+# 他病院登録（入力→確認→登録）1回あたりの DB 書き込み回数の比較
+@override_settings(CACHES=LOCMEM_CACHES)
+class WizardStateWriteCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+
+    def count_writes(self, hospital_id):
+        # セッションのバックエンドはミドルウェアの生成時に決まるため、クライアントを作り直す
+        self.client = self.client_class()
+        self.client.force_login(self.employee)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('hospital_register'), {
+                'hospital_id': hospital_id, 'hospital_name': '新宿病院', 'hospital_address': '東京都新宿区西新宿2-8-1',
+                'phone_number': '03-1234-5678', 'capital': '1000', 'emergency': '1',
+            })
+            self.client.get(reverse('hospital_registration_confirm'))
+            self.client.post(reverse('hospital_registration_confirm'), {'action': 'confirm'})
+        self.assertTrue(Hospital.objects.filter(pk=hospital_id).exists())
+        return sum(1 for query in queries.captured_queries
+                   if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')))
+
+    def test_cache_store_writes_less_than_db_session(self):
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.db',
+                           WIZARD_STATE_STORE='abaranti.wizard.SessionWizardStore'):
+            db_writes = self.count_writes('H0001')
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.cache',
+                           WIZARD_STATE_STORE='abaranti.wizard.CacheWizardStore'):
+            cache_writes = self.count_writes('H0002')
+        # DB セッション: 病院の INSERT・最終更新日時の UPDATE + セッションの UPDATE 2回
+        # キャッシュ: 病院の INSERT・最終更新日時の UPDATE のみ
+        self.assertEqual(cache_writes, 2)
+        self.assertLess(cache_writes, db_writes)
+
+
+# ログイン中の従業員のキャッシュ（レプリカを使わずにプライマリへの検索だけを数える）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class CachedEmployeeBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+
+    def test_authenticated_requests_do_not_query_employee(self):
+        self.client.force_login(self.employee)
+        self.client.get(reverse('hospital_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('hospital_list'))
+        self.assertFalse([query for query in queries.captured_queries if 'abaranti_employee' in query['sql']])
+
+    def test_employee_update_invalidates_cache(self):
+        self.client.force_login(self.employee)
+        self.client.post(reverse('employee_update'), {'first_name': '次郎', 'last_name': '受付'})
+        self.client.post(reverse('employee_update_confirm'), {'action': 'confirm'})
+        response = self.client.get(reverse('hospital_list'))
+        self.assertEqual(response.wsgi_request.user.first_name, '次郎')
+
+    def test_password_change_logs_out(self):
+        self.client.force_login(self.employee)
+        self.client.get(reverse('hospital_list'))
+        self.employee.set_password('changed')
+        self.employee.save()
+        response = self.client.get(reverse('hospital_list'))
+        self.assertEqual(response.status_code, 302)
+
+
+# 参照用レプリカへの振り分け（テストではプライマリとは別のテスト用 DB をレプリカとする）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE='replica')
+class ReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        # レプリカにはまだ反映されていない状態を作る
+        Hospital.objects.create(hospital_id='H0001', hospital_name='プライマリ病院', hospital_address='東京都新宿区西新宿2-8-1',
+                                phone_number='03-1234-5678', capital=1000, emergency=1)
+        Hospital.objects.using('replica').create(hospital_id='H0002', hospital_name='レプリカ病院',
+                                                 hospital_address='東京都新宿区西新宿2-8-1',
+                                                 phone_number='03-1234-5678', capital=1000, emergency=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def hospital_ids(self):
+        response = self.client.get(reverse('hospital_list'))
+        return [hospital.hospital_id for hospital in response.context['page_obj']]
+
+    def test_search_views_read_from_replica(self):
+        self.client.force_login(self.employee)
+        self.assertEqual(self.hospital_ids(), ['H0002'])
+
+    def test_reads_are_pinned_to_primary_after_write(self):
+        self.client.force_login(self.employee)
+        self.client.post(reverse('hospital_register'), {
+            'hospital_id': 'H0003', 'hospital_name': '新宿病院', 'hospital_address': '東京都新宿区西新宿2-8-1',
+            'phone_number': '03-1234-5678', 'capital': '1000', 'emergency': '1',
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('hospital_registration_confirm'), {'action': 'confirm'})
+        self.assertFalse(Hospital.objects.using('replica').filter(pk='H0003').exists())
+        self.assertEqual(self.hospital_ids(), ['H0001', 'H0003'])
+        with self.settings(REPLICA_PIN_SECONDS=0):
+            self.client.post(reverse('hospital_update', args=['H0001']), {
+                'hospital_name': 'プライマリ病院', 'hospital_address': '東京都新宿区西新宿2-8-1',
+                'phone_number': '03-1234-5678', 'capital': '2000', 'emergency': '1',
+            })
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('hospital_update_confirm', args=['H0001']), {'action': 'confirm'})
+        # 固定の期限が切れるとレプリカに戻る
+        self.assertEqual(self.hospital_ids(), ['H0002'])
+
+    def test_only_executed_writes_pin_to_primary(self):
+        request = RequestFactory().get('/')
+        request.user = self.employee
+        defaults = {'hospital_name': '新宿病院', 'hospital_address': '東京都新宿区西新宿2-8-1',
+                    'phone_number': '03-1234-5678', 'capital': 1000, 'emergency': 1}
+
+        def lookup(request):
+            # 登録済みのため検索だけで終わる（書き込み先は問い合わせるが書き込みはしない）
+            Hospital.objects.get_or_create(pk='H0001', defaults=defaults)
+            return HttpResponse()
+
+        def create(request):
+            Hospital.objects.get_or_create(pk='H0003', defaults=defaults)
+            return HttpResponse()
+
+        ReplicaPinMiddleware(lookup)(request)
+        self.assertFalse(is_pinned(request))
+        ReplicaPinMiddleware(create)(request)
+        self.assertTrue(is_pinned(request))
+
+
+# 性能測定（少量のデータで全画面が測定できること）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None, TYPEAHEAD_BUILD_IN_BACKGROUND=False)
+class BenchmarkSmokeTests(TestCase):
+    # 測定ではすべての接続（レプリカを含む）のクエリを数える
+    databases = '__all__'
+
+    def test_all_scenarios_respond(self):
+        seed({'hospitals': 30, 'medicines': 5, 'patients': 50, 'treatments': 500}, batch_size=100)
+        # 処置日時は直近2年間に分散し、処置日時の項目の定義（auto_now_add）は変えない
+        self.assertFalse(Treatment.objects.filter(date__gt=timezone.now() - timedelta(minutes=5)).exists())
+        self.assertGreater(Treatment.objects.dates('date', 'month').count(), 12)
+        self.assertTrue(Treatment._meta.get_field('date').auto_now_add)
+        results = benchmark.run(iterations=1)
+        self.assertEqual({name: result['status'] for name, result in results.items()},
+                         {name: 200 for name in results})
+        self.assertEqual(benchmark.compare(results, results), [])
+
+
+# リクエストの計測と /metrics の出力
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client.force_login(self.employee)
+
+    def test_metrics_endpoint_exposes_histograms(self):
+        self.client.get(reverse('hospital_list'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('abaranti_request_duration_seconds_count{view="hospital_list"} 1', body)
+        self.assertIn('abaranti_db_queries_bucket{view="hospital_list",le="+Inf"} 1', body)
+        self.assertIn('abaranti_template_render_seconds_count{view="hospital_list"} 1', body)
+        # 描画時間は設定のテンプレートのバックエンドで計測し、Django のテンプレートは書き換えない
+        self.assertIsNot(DjangoTemplate.render, metrics.TimedTemplate.render)
+
+    def test_streaming_response_queries_are_counted(self):
+        Hospital.objects.create(hospital_id='H0001', hospital_name='新宿病院', hospital_address='東京都新宿区西新宿2-8-1',
+                                phone_number='03-1234-5678', capital=1000, emergency=1)
+        response = self.client.get(reverse('export_data', args=['hospitals']))
+        # 送信し終えるまでは記録しない（クエリは送信中に発行される）
+        self.assertNotIn('export_data', metrics._series['abaranti_db_queries'])
+        self.assertIn('新宿病院', b''.join(response.streaming_content).decode())
+        self.assertGreaterEqual(metrics._series['abaranti_db_queries']['export_data'].sum, 1)
+
+    def test_duplicate_queries_are_counted(self):
+        stats = metrics.RequestStats()
+        with connection.execute_wrapper(stats):
+            for medicineid in ('M0001', 'M0002', 'M0003'):
+                Medicine.objects.filter(pk=medicineid).first()
+        self.assertEqual(list(stats.duplicates().values()), [3])
+
+    def test_slow_request_log(self):
+        with self.settings(SLOW_REQUEST_THRESHOLD=0), self.assertLogs('abaranti.slow_requests') as logs:
+            self.client.get(reverse('hospital_list'))
+        self.assertIn('hospital_list', logs.output[0])
+        self.assertIn('abaranti_hospital', logs.output[0])
+
+
+# 他病院の一覧・検索結果の描画結果のキャッシュ
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class HospitalFragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        cls.hospital = Hospital.objects.create(hospital_id='H0001', hospital_name='新宿病院',
+                                               hospital_address='東京都新宿区西新宿2-8-1',
+                                               phone_number='03-1234-5678', capital=1000, emergency=1)
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client.force_login(self.employee)
+
+    def test_cached_pages_do_not_query_hospitals(self):
+        self.client.get(reverse('hospital_list'))
+        self.client.post(reverse('hospital_search_by_address'), {'address': '東京都新宿区'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('hospital_list'))
+            # 空白の有無など表記の揺れがあっても同じキャッシュを使う
+            response = self.client.post(reverse('hospital_search_by_address'), {'address': '東京都 新宿区'})
+        self.assertContains(response, '新宿病院')
+        self.assertFalse([query for query in queries.captured_queries if 'abaranti_hospital' in query['sql']])
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('abaranti_fragment_cache_hits_total{view="hospital_list"} 1', body)
+        self.assertIn('abaranti_fragment_cache_misses_total{view="hospital_search_by_address"} 1', body)
+
+    def test_update_confirm_invalidates_cache(self):
+        self.client.get(reverse('hospital_list'))
+        self.client.post(reverse('hospital_update', args=['H0001']), {
+            'hospital_name': '西新宿病院', 'hospital_address': '東京都新宿区西新宿2-8-1',
+            'phone_number': '03-1234-5678', 'capital': '1000', 'emergency': '1',
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('hospital_update_confirm', args=['H0001']), {'action': 'confirm'})
+        self.assertContains(self.client.get(reverse('hospital_list')), '西新宿病院')
+
+
+# 条件付き GET（ETag / Last-Modified）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        Hospital.objects.create(hospital_id='H0001', hospital_name='新宿病院', hospital_address='東京都新宿区西新宿2-8-1',
+                                phone_number='03-1234-5678', capital=1000, emergency=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.employee)
+
+    def test_unchanged_list_returns_304_without_querying_hospitals(self):
+        response = self.client.get(reverse('hospital_list'))
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('hospital_list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries.captured_queries if 'abaranti_hospital' in query['sql']])
+        response = self.client.get(reverse('hospital_list'),
+                                   headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+        # 別のページ・並び順は別の ETag になる
+        response = self.client.get(reverse('hospital_list'), {'sort': 'capital'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_change_invalidates_etag(self):
+        etag = self.client.get(reverse('hospital_list'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Hospital.objects.filter(pk='H0001').first().save()
+        response = self.client.get(reverse('hospital_list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+
+# 患者の候補表示（プロセス内の前方一致インデックス）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None, TYPEAHEAD_BUILD_IN_BACKGROUND=False,
+                   TYPEAHEAD_SYNC_INTERVAL=0)
+class PatientTypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+        seed({'hospitals': 1, 'medicines': 1, 'patients': 2000, 'treatments': 1}, batch_size=1000)
+        Patient.objects.create(patient_id='P9000001', last_name='東海林', first_name='実', last_name_kana='ショウジ',
+                               first_name_kana='ミノル', gender=0, birthdate=date(1970, 5, 1),
+                               insurance_number='12345678', insurance_exp=date(2030, 3, 31))
+
+    def setUp(self):
+        cache.clear()
+        typeahead.index = typeahead.PrefixIndex()
+        self.client.force_login(self.employee)
+
+    def suggest(self, query):
+        return self.client.get(reverse('patient_autocomplete'), {'q': query}).json()
+
+    def test_falls_back_to_db_while_index_is_cold(self):
+        typeahead.index.building = True
+        data = self.suggest('しょうじ')
+        self.assertEqual(data['source'], 'db')
+        self.assertEqual([row['patient_id'] for row in data['results']], ['P9000001'])
+
+    def test_index_matches_id_name_and_kana(self):
+        self.assertEqual(self.suggest('p900')['results'][0]['patient_id'], 'P9000001')
+        self.assertEqual(self.suggest('東海林実')['results'][0]['patient_id'], 'P9000001')
+        data = self.suggest('ｼｮｳｼﾞ')
+        self.assertEqual(data['source'], 'index')
+        self.assertEqual(data['results'][0]['birthdate'], '1970-05-01')
+        self.assertEqual(len(self.suggest('佐')['results']), typeahead.TYPEAHEAD_LIMIT)
+
+    def test_signals_update_index(self):
+        self.suggest('p')
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = Patient.objects.get(pk='P9000001')
+            patient.last_name_kana = 'トウカイリン'
+            patient.save()
+        self.assertEqual(self.suggest('しょうじ')['results'], [])
+        self.assertEqual(self.suggest('とうかい')['results'][0]['patient_id'], 'P9000001')
+        with self.captureOnCommitCallbacks(execute=True):
+            patient.delete()
+        self.assertEqual(self.suggest('とうかい')['results'], [])
+
+    def test_lookup_is_fast(self):
+        typeahead.index.build()
+        started = time.perf_counter()
+        for _ in range(1000):
+            typeahead.index.lookup('サ')  # 候補の多い1文字の検索
+        self.assertLess((time.perf_counter() - started) / 1000, 0.001)
+
+
+# 薬剤マスタのキャッシュ（プロセス内に保持し、世代番号の変化で読み直す）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class MedicineCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog.invalidate()
+
+    def create(self, medicine_id, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.create(medicineid=medicine_id, medicinename=name, unit='錠')
+
+    def test_reloads_only_when_generation_changes(self):
+        self.create('M0001', '薬剤1')
+        self.assertEqual(catalog.get_catalog(), {'M0001': ('薬剤1', '錠')})
+        # 世代が同じ間は DB を読まない（入力画面の選択肢も同じ）
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get_medicine('M0001').medicinename, '薬剤1')
+            self.assertIn('M0001', str(MedicationInstructionLineForm()['medicine']))
+        # 登録・変更・削除の確定後に世代が進み、次の参照で読み直す
+        self.create('M0002', '薬剤2')
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.filter(pk='M0001').update(medicinename='変更前')
+            medicine = Medicine.objects.get(pk='M0001')
+            medicine.medicinename = '変更後'
+            medicine.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(catalog.get_catalog(), {'M0001': ('変更後', '錠'), 'M0002': ('薬剤2', '錠')})
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.filter(pk='M0002').delete()
+        self.assertIsNone(catalog.get_medicine('M0002'))
+
+    def test_other_process_update_is_detected_by_generation(self):
+        self.create('M0001', '薬剤1')
+        catalog.get_catalog()
+        # 他のプロセスでの変更（このプロセスの保持内容は古いまま、共有の世代番号だけが進む）
+        Medicine.objects.filter(pk='M0001').update(medicinename='他で変更')
+        cache.incr(catalog.GENERATION_KEY)
+        self.assertEqual(catalog.get_medicine('M0001').medicinename, '他で変更')
+
+
+# 薬剤投与指示（複数行の入力 → 確認 → 1回の INSERT での登録）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class MedicationInstructionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Employee.objects.create_user(username='D0001', password='password', first_name='太郎',
+                                                  last_name='医師', role=Employee.Role.DOCTOR)
+        cls.patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                             birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                             insurance_exp=date(2030, 3, 31))
+        for i in range(3):
+            Medicine.objects.create(medicineid=f'M{i:04d}', medicinename=f'薬剤{i}', unit='錠')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.doctor)
+        self.input_url = reverse('medication_instruction', args=[self.patient.patient_id])
+        self.confirm_url = reverse('confirm_treatment', args=[self.patient.patient_id])
+
+    def enter(self, *lines):
+        data = {'form-TOTAL_FORMS': str(len(lines)), 'form-INITIAL_FORMS': '0'}
+        for i, (medicine, quantity) in enumerate(lines):
+            data[f'form-{i}-medicine'] = medicine
+            data[f'form-{i}-quantity'] = quantity
+        return self.client.post(self.input_url, data)
+
+    def test_input_errors(self):
+        response = self.enter(('M0000', ''), ('', '2'))
+        self.assertEqual([form.non_field_errors() for form in response.context['formset']][:2],
+                         [['数量を入力してください。'], ['薬剤を選択してください。']])
+        response = self.enter(('', ''))
+        self.assertEqual(response.context['formset'].non_form_errors(), ['薬剤を1件以上入力してください。'])
+        response = self.enter(('M0000', '1'), ('M9999', '1'))
+        self.assertEqual(response.context['formset'].non_form_errors(), ['存在しない薬剤が含まれています: M9999'])
+
+    def test_confirm_inserts_all_lines_at_once(self):
+        self.assertRedirects(self.enter(('M0000', '3'), ('', ''), ('M0001', '5'), ('M0002', '1')), self.confirm_url)
+        response = self.client.get(self.confirm_url)
+        self.assertEqual([(treatment.medicine.medicinename, treatment.quantity)
+                          for treatment in response.context['treatments']], [('薬剤0', 3), ('薬剤1', 5), ('薬剤2', 1)])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.confirm_url, {'action': 'confirm'})
+        inserts = [query for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "abaranti_treatment"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(sorted(Treatment.objects.values_list('medicine_id', 'quantity', 'doctor_id')),
+                         [('M0000', 3, 'D0001'), ('M0001', 5, 'D0001'), ('M0002', 1, 'D0001')])
+
+    def test_medicine_deleted_before_confirm_returns_to_input(self):
+        self.enter(('M0000', '3'), ('M0001', '5'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            Medicine.objects.filter(pk='M0001').delete()
+        # 薬剤マスタのキャッシュがまだ古い場合も、登録の直前の検証で戻す（一部の行だけを登録しない）
+        response = self.client.post(self.confirm_url, {'action': 'confirm'})
+        self.assertRedirects(response, self.input_url, fetch_redirect_response=False)
+        self.assertFalse(Treatment.objects.exists())
+        self.assertContains(self.client.get(self.input_url), '存在しない薬剤が含まれています: M0001')
+        # キャッシュの破棄後は、確認画面の表示の時点で戻す
+        for callback in callbacks:
+            callback()
+        response = self.client.get(self.confirm_url)
+        self.assertRedirects(response, self.input_url)
+        self.assertEqual([str(message) for message in get_messages(response.wsgi_request)],
+                         ['存在しない薬剤が含まれています: M0001'])
+
+
+# 薬剤の在庫（処置の登録で減り、日別の使用量から発注案を作成する）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None, STOCK_ROLLING_DAYS=10, STOCK_SAFETY_DAYS=2,
+                   STOCK_REVIEW_DAYS=5)
+class MedicineStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Employee.objects.create_user(username='D0001', password='password', first_name='太郎',
+                                                  last_name='医師', role=Employee.Role.DOCTOR)
+        cls.patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                             birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                             insurance_exp=date(2030, 3, 31))
+        cls.medicines = [Medicine.objects.create(medicineid=f'M{i:04d}', medicinename=f'薬剤{i}', unit='錠')
+                         for i in range(3)]
+        cls.fast = Supplier.objects.create(supplier_id='S0001', supplier_name='速達薬品', supplier_address='東京都',
+                                           phone_number='03-1234-5678', capital=1000, delivery_time=2)
+        cls.slow = Supplier.objects.create(supplier_id='S0002', supplier_name='遠方薬品', supplier_address='沖縄県',
+                                           phone_number='098-123-4567', capital=1000, delivery_time=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_confirm_updates_stock_in_same_transaction(self):
+        MedicineStock.objects.create(medicine=self.medicines[0], on_hand=100)
+        self.client.force_login(self.doctor)
+        url = reverse('medication_instruction', args=[self.patient.patient_id])
+        self.client.post(url, {
+            'form-TOTAL_FORMS': '3', 'form-INITIAL_FORMS': '0',
+            'form-0-medicine': 'M0000', 'form-0-quantity': '3',
+            'form-1-medicine': 'M0001', 'form-1-quantity': '5',
+            'form-2-medicine': 'M0000', 'form-2-quantity': '2',
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('confirm_treatment', args=[self.patient.patient_id]), {'action': 'confirm'})
+        self.assertEqual(Treatment.objects.count(), 3)
+        # 在庫行がない薬剤は、使用量の分だけマイナスの在庫として作成する
+        self.assertEqual(dict(MedicineStock.objects.values_list('medicine_id', 'on_hand')),
+                         {'M0000': 95, 'M0001': -5})
+        self.assertEqual(dict(MedicineDailyUsage.objects.values_list('medicine_id', 'quantity')),
+                         {'M0000': 5, 'M0001': 5})
+
+    def test_single_treatment_and_rebuild(self):
+        Treatment.objects.create(patient=self.patient, medicine=self.medicines[2], quantity=4)
+        self.assertEqual(MedicineStock.objects.get(pk='M0002').on_hand, -4)
+        self.assertEqual(usage.rebuild(), {'daily': 1, 'monthly': 1, 'doctor': 0})
+        self.assertEqual(MedicineDailyUsage.objects.get().quantity, 4)
+
+    def test_single_treatment_rolls_back_with_stock_update(self):
+        # 在庫の更新に失敗した場合は、処置の登録も取り消す
+        with mock.patch('abaranti.signals.record_treatments', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            Treatment.objects.create(patient=self.patient, medicine=self.medicines[1], quantity=4)
+        self.assertFalse(Treatment.objects.exists())
+
+    def test_propose_orders_from_daily_usage(self):
+        today = date(2030, 1, 31)
+        # M0000: 1日10錠、優先の仕入先（納期10日）、発注単位50
+        # M0001: 1日1錠で在庫が十分 / M0002: 仕入先なし
+        for day in range(10):
+            MedicineDailyUsage.objects.create(medicine=self.medicines[0], date=today - timedelta(days=day),
+                                              quantity=10)
+            MedicineDailyUsage.objects.create(medicine=self.medicines[1], date=today - timedelta(days=day),
+                                              quantity=1)
+            MedicineDailyUsage.objects.create(medicine=self.medicines[2], date=today - timedelta(days=day),
+                                              quantity=1)
+        MedicineStock.objects.create(medicine=self.medicines[0], on_hand=30)
+        MedicineStock.objects.create(medicine=self.medicines[1], on_hand=100)
+        SupplierMedicine.objects.create(supplier=self.fast, medicine=self.medicines[0])
+        SupplierMedicine.objects.create(supplier=self.slow, medicine=self.medicines[0], lot_size=50, preferred=True)
+        SupplierMedicine.objects.create(supplier=self.fast, medicine=self.medicines[1])
+
+        orders, unlinked = stock.propose_orders(today)
+        self.assertEqual(unlinked, ['M0002'])
+        self.assertEqual(len(orders), 1)
+        order = StockOrder.objects.get()
+        # 目標 10 * (10 + 5) + 10 * 2 = 170、不足 140 を発注単位 50 に切り上げる
+        self.assertEqual((order.medicine_id, order.supplier_id, order.quantity, order.expected_date),
+                         ('M0000', 'S0002', 150, date(2030, 2, 10)))
+        # 未入荷の発注数は在庫に含めるため、続けて実行しても重ねて発注しない
+        self.assertEqual(stock.propose_orders(today)[0], [])
+        stock.receive(order)
+        self.assertEqual(MedicineStock.objects.get(pk='M0000').on_hand, 180)
+
+
+# 薬剤使用量の集計表（処置の登録・削除で増減し、報告は集計表だけを読む）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class MedicineUsageRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Employee.objects.create_user(username='D0001', password='password', first_name='太郎',
+                                                  last_name='医師', role=Employee.Role.DOCTOR)
+        cls.patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                             birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                             insurance_exp=date(2030, 3, 31))
+        cls.medicine = Medicine.objects.create(medicineid='M0001', medicinename='薬剤1', unit='錠')
+
+    def setUp(self):
+        cache.clear()
+
+    def usage(self):
+        return (dict(MedicineDailyUsage.objects.values_list('date', 'quantity')),
+                dict(MedicineMonthlyUsage.objects.values_list('month', 'quantity')),
+                dict(DoctorMonthlyUsage.objects.values_list('month', 'quantity')))
+
+    def test_rollups_follow_inserts_and_deletes(self):
+        today = timezone.localdate()
+        month = today.replace(day=1)
+        first = Treatment.objects.create(patient=self.patient, medicine=self.medicine, quantity=3, doctor=self.doctor)
+        Treatment.objects.create(patient=self.patient, medicine=self.medicine, quantity=4)
+        self.assertEqual(self.usage(), ({today: 7}, {month: 7}, {month: 3}))
+        first.delete()
+        self.assertEqual(self.usage(), ({today: 4}, {month: 4}, {month: 0}))
+        # 患者の削除に伴う処置の削除も差し引く
+        self.patient.delete()
+        self.assertEqual(self.usage(), ({today: 0}, {month: 0}, {month: 0}))
+        # 記録を削除しても払い出した薬剤は戻らないため、在庫数は変わらない（戻す場合は明示的に補正する）
+        self.assertEqual(MedicineStock.objects.get(pk='M0001').on_hand, -7)
+        stock.adjust('M0001', 3)
+        self.assertEqual(MedicineStock.objects.get(pk='M0001').on_hand, -4)
+
+    def test_rebuild_matches_incremental_counts(self):
+        for quantity in (1, 2, 5):
+            Treatment.objects.create(patient=self.patient, medicine=self.medicine, quantity=quantity,
+                                     doctor=self.doctor)
+        incremental = self.usage()
+        self.assertEqual(usage.rebuild(), {'daily': 1, 'monthly': 1, 'doctor': 1})
+        self.assertEqual(self.usage(), incremental)
+
+    def test_report_reads_only_rollups(self):
+        # 集計表だけを作成する（処置の表は空のまま）
+        today = date(2030, 1, 31)
+        for day in range(60):
+            MedicineDailyUsage.objects.create(medicine=self.medicine, date=today - timedelta(days=day), quantity=2)
+        MedicineMonthlyUsage.objects.create(medicine=self.medicine, month=date(2030, 1, 1), quantity=62)
+        self.client.force_login(self.doctor)
+        self.client.get(reverse('medicine_usage_report'))
+        # 集計表の検索1クエリのみ
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('medicine_usage_report'), {
+                'period': 'day', 'date_from': '2030-01-25', 'date_to': '2030-01-31', 'medicine': 'M0001'})
+        self.assertEqual(len(response.context['rows']), 7)
+        self.assertEqual(response.context['total'], 14)
+        response = self.client.get(reverse('medicine_usage_report'), {
+            'period': 'month', 'date_from': '2029-12-15', 'date_to': '2030-01-15'})
+        self.assertEqual([(row['period'], row['quantity']) for row in response.context['rows']],
+                         [(date(2030, 1, 1), 62)])
+
+
+# 古い処置の保管（一定件数ずつ移し、処置履歴は必要な場合だけ保管用の表を読む）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class TreatmentArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Employee.objects.create_user(username='D0001', password='password', first_name='太郎',
+                                                  last_name='医師', role=Employee.Role.DOCTOR)
+        cls.patient = Patient.objects.create(patient_id='P0001', last_name='山田', first_name='花子', gender=1,
+                                             birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                             insurance_exp=date(2030, 3, 31))
+        medicine = Medicine.objects.create(medicineid='M0001', medicinename='薬剤1', unit='錠')
+        # 0〜44日前の正午に1件ずつ
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        for days in range(45):
+            treatment = Treatment.objects.create(patient=cls.patient, medicine=medicine, quantity=1)
+            Treatment.objects.filter(pk=treatment.pk).update(date=noon - timedelta(days=days))
+        cls.newest_first = list(Treatment.objects.order_by('-date', 'id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.cutoff = archive.archive_cutoff(days=20)
+
+    def history(self, cursor=None, **params):
+        params = {'patient_id': self.patient.patient_id, **params}
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('treatment_history_api'), params).json()
+
+    def test_archive_is_resumable_and_keeps_rollups(self):
+        rollups = list(MedicineDailyUsage.objects.values_list('date', 'quantity'))
+        self.assertEqual(archive.archive_treatments(self.cutoff, batch_size=10, max_batches=1), 10)
+        self.assertEqual(archive.archived_through(), ArchivedTreatment.objects.latest('date').date)
+        self.assertEqual(archive.archive_treatments(self.cutoff, batch_size=10), 14)
+        self.assertEqual((Treatment.objects.count(), ArchivedTreatment.objects.count()), (21, 24))
+        self.assertFalse(Treatment.objects.filter(date__lt=self.cutoff).exists())
+        self.assertEqual(list(MedicineDailyUsage.objects.values_list('date', 'quantity')), rollups)
+
+    def test_history_pages_across_archive_boundary_within_same_timestamp(self):
+        # 30日前の同じミリ秒に一括確定した処置を、途中まで保管用の表へ移す（同じ日時の行が両方の表にまたがる）
+        same_visit = Treatment.objects.filter(date__lt=self.cutoff).latest('date').date.replace(microsecond=250000)
+        visit = Treatment.objects.bulk_create([
+            Treatment(patient=self.patient, medicine_id='M0001', quantity=1) for _ in range(30)
+        ])
+        for i, treatment in enumerate(visit):
+            Treatment.objects.filter(pk=treatment.pk).update(date=same_visit + timedelta(microseconds=i % 4))
+        rollups = list(MedicineDailyUsage.objects.values_list('date', 'quantity'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.archive_treatments(self.cutoff, batch_size=10, max_batches=3), 30)
+        self.assertTrue(ArchivedTreatment.objects.filter(date__gte=same_visit).exists())
+        self.assertTrue(Treatment.objects.filter(date__gte=same_visit, date__lt=self.cutoff).exists())
+        # 移すための削除では使用量の集計表を戻さない
+        self.assertEqual(list(MedicineDailyUsage.objects.values_list('date', 'quantity')), rollups)
+
+        expected = [pk for _, pk in sorted(
+            [(-row[0].timestamp(), row[1]) for model in (Treatment, ArchivedTreatment)
+             for row in model.objects.values_list('date', 'id')]
+        )]
+        self.client.force_login(self.doctor)
+        pages = [self.history()]
+        while pages[-1]['next_cursor']:
+            pages.append(self.history(pages[-1]['next_cursor']))
+        self.assertEqual([row['id'] for page in pages for row in page['treatments']], expected)
+        page = pages[-1]
+        backward = [row['id'] for row in page['treatments']]
+        while page['previous_cursor']:
+            page = self.history(page['previous_cursor'])
+            backward = [row['id'] for row in page['treatments']] + backward
+        self.assertEqual(backward, expected)
+
+    def test_rebuild_and_export_include_archive(self):
+        # 処置日時は登録後に書き換えているため、先に処置の表から作り直したものを基準にする
+        usage.rebuild()
+        rollups = (sorted(MedicineDailyUsage.objects.values_list('date', 'quantity')),
+                   sorted(MedicineMonthlyUsage.objects.values_list('month', 'quantity')))
+        archive.archive_treatments(self.cutoff)
+        usage.rebuild()
+        self.assertEqual((sorted(MedicineDailyUsage.objects.values_list('date', 'quantity')),
+                          sorted(MedicineMonthlyUsage.objects.values_list('month', 'quantity'))), rollups)
+        # 出力は新しい処置と保管した処置を主キーの順に合わせ、期間が保管した日時より新しければ保管用の表を読まない
+        lines = b''.join(export_chunks('treatments', {})).decode().splitlines()[1:]
+        self.assertEqual([int(line.split(',')[0]) for line in lines], sorted(self.newest_first))
+        date_from = timezone.localdate() - timedelta(days=5)
+        with self.assertNumQueries(1):
+            lines = b''.join(export_chunks('treatments', {'date_from': date_from})).decode().splitlines()[1:]
+        self.assertEqual(len(lines), 6)
+
+    def test_history_reads_archive_only_when_needed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            archive.archive_treatments(self.cutoff)
+        self.client.force_login(self.doctor)
+        self.history()
+        # 1ページ目は新しい処置だけで埋まるため、保管用の表は読まない
+        with self.assertNumQueries(1):
+            page = self.history()
+        ids = [row['id'] for row in page['treatments']]
+        while page['next_cursor']:
+            page = self.history(page['next_cursor'])
+            ids += [row['id'] for row in page['treatments']]
+        self.assertEqual(ids, self.newest_first)
+        # 前のページへ戻っても、新しい処置と保管した処置の境目で欠けない
+        previous = self.history(page['previous_cursor'])
+        self.assertEqual([row['id'] for row in previous['treatments']], self.newest_first[20:40])
+        # 期間が保管した日時より新しければ、ページが埋まらなくても保管用の表は読まない
+        date_from = (timezone.localdate() - timedelta(days=5)).isoformat()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.history(date_from=date_from)['treatments']), 6)
+
+
+# 保険証有効期限の区分ごとの件数（有効期限ごとの集計表を差分で更新する）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class InsuranceExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+
+    def setUp(self):
+        cache.clear()
+        self.today = date.today()
+        # 期限切れ 2件 / 7日以内 1件 / 30日以内 2件（7日以内を含む） / 90日以内 3件 / それ以降 1件
+        for i, days in enumerate([-10, -1, 3, 20, 60, 365]):
+            Patient.objects.create(patient_id=f'P{i:04d}', last_name='山田', first_name='花子', gender=1,
+                                   birthdate=date(1980, 1, 1), insurance_number='12345678',
+                                   insurance_exp=self.today + timedelta(days=days))
+
+    def counts(self):
+        return {bucket: count for bucket, _, count in expiry.bucket_counts()}
+
+    def direct_counts(self):
+        return {bucket: Patient.objects.filter(expiry.bucket_filter(bucket)).count()
+                for bucket, _ in expiry.EXPIRY_BUCKETS}
+
+    def test_counts_follow_create_change_and_delete(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.counts(), {'expired': 2, '7': 1, '30': 2, '90': 3})
+        # 期限の変更（読み込んだ患者・読み込み直した患者）と削除で、旧・新の日付の件数を増減する
+        patient = Patient.objects.get(pk='P0005')
+        patient.insurance_exp = self.today + timedelta(days=5)
+        patient.save()
+        patient.insurance_exp = self.today - timedelta(days=3)
+        patient.save()
+        Patient.objects.get(pk='P0000').delete()
+        Patient(pk='P0002', last_name='山田', first_name='花子', gender=1, birthdate=date(1980, 1, 1),
+                insurance_number='12345678', insurance_exp=self.today + timedelta(days=45)).save()
+        self.assertEqual(self.counts(), self.direct_counts())
+        self.assertEqual(self.counts(), {'expired': 2, '7': 0, '30': 1, '90': 3})
+        self.assertFalse(InsuranceExpiryCount.objects.filter(count__lt=0).exists())
+        # 作り直しても同じ件数になる
+        expiry.rebuild_counts()
+        self.assertEqual(self.counts(), {'expired': 2, '7': 0, '30': 1, '90': 3})
+
+    def test_view_pages_selected_bucket(self):
+        self.client.force_login(self.employee)
+        response = self.client.get(reverse('patient_check_insurance_expiry'), {'bucket': '90'})
+        self.assertEqual([patient.patient_id for patient in response.context['expired_patients']],
+                         ['P0002', 'P0003', 'P0004'])
+        self.assertEqual([count for _, _, count in response.context['bucket_counts']], [2, 1, 2, 3])
+        # 不明な区分は期限切れとして扱う
+        response = self.client.get(reverse('patient_check_insurance_expiry'), {'bucket': 'x'})
+        self.assertEqual(response.context['bucket'], 'expired')
+
+
+# マスタデータの一括登録（塊ごとの登録・不正な行の出力・主キーの重複）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class ImportMasterDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = Path(tempfile.mkdtemp())
+
+    def run_import(self, kind, name, content, batch_size=2):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        call_command('import_master_data', kind, str(path), batch_size=batch_size, stdout=io.StringIO())
+        with open(f'{path}.rejects.csv', encoding='utf-8', newline='') as f:
+            return [(int(line), reason) for line, reason, _ in list(csv.reader(f))[1:]]
+
+    def test_csv_rows_are_imported_in_batches(self):
+        Hospital.objects.create(hospital_id='H0001', hospital_name='登録済み', hospital_address='東京都新宿区',
+                                phone_number='03-0000-0000', capital=1, emergency=0)
+        rows = ['hospital_id,hospital_name,hospital_address,phone_number,capital,emergency',
+                ' H0001 ,重複（前後の空白）,東京都新宿区,03-0000-0001,100,1',
+                'H0002,病院2,東京都新宿区西新宿,03-0000-0002,200,1',
+                'H0003,病院3,東京都港区,03-0000-0003,abc,0',
+                'H0004,病院4,東京都港区,03-0000-0004,400,0',
+                'H0002,重複（別の塊）,東京都港区,03-0000-0005,500,0',
+                'H0005 ,病院5,東京都渋谷区,03-0000-0006,600,1']
+        # 6行を2行ずつの塊で登録する
+        with CaptureQueriesContext(connection) as queries:
+            rejects = self.run_import('hospitals', 'hospitals.csv', '\n'.join(rows) + '\n')
+        self.assertEqual(sum(query['sql'].startswith('INSERT') for query in queries.captured_queries), 3)
+        # 不正な行・重複する行だけを除き、同じ塊の他の行は登録する
+        self.assertEqual([line for line, _ in rejects], [2, 4, 6])
+        self.assertEqual(rejects[0][1], '主キーが重複しています')
+        self.assertEqual(rejects[2][1], '主キーが重複しています')
+        self.assertEqual(Hospital.objects.get(pk='H0001').hospital_name, '登録済み')
+        self.assertEqual(sorted(Hospital.objects.values_list('pk', flat=True)),
+                         ['H0001', 'H0002', 'H0004', 'H0005'])
+        self.assertEqual(Hospital.objects.get(pk='H0002').address_municipality, '新宿区')
+
+    def test_jsonl_lines_that_are_not_objects_are_rejected(self):
+        patient = {'patient_id': 'P0001', 'last_name': '山田', 'first_name': '花子', 'gender': 1,
+                   'birthdate': '1980-01-01', 'insurance_number': '12345678', 'insurance_exp': '2030-03-31'}
+        lines = [json.dumps(patient, ensure_ascii=False), '[]', '1', '{bad', '',
+                 json.dumps(dict(patient, patient_id='P0002'), ensure_ascii=False),
+                 json.dumps(dict(patient, patient_id='P0001'), ensure_ascii=False)]
+        rejects = self.run_import('patients', 'patients.jsonl', '\n'.join(lines) + '\n')
+        self.assertEqual(rejects, [(2, 'JSON の形式が正しくありません'), (3, 'JSON の形式が正しくありません'),
+                                   (4, 'JSON の形式が正しくありません'), (7, '主キーが重複しています')])
+        self.assertEqual(sorted(Patient.objects.values_list('pk', flat=True)), ['P0001', 'P0002'])
+        # 一括登録でも検索インデックスと期限の集計を更新する
+        self.assertEqual({patient.pk for patient in search.search_patients('山田')}, {'P0001', 'P0002'})
+        self.assertEqual(InsuranceExpiryCount.objects.get(insurance_exp=date(2030, 3, 31)).count, 2)
+
+
+# 患者の重複候補（検出キーによる登録時の警告と、登録済みの患者のまとまりの検出）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None)
+class DuplicatePatientTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.employee = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                    last_name='受付', role=Employee.Role.RECEPTION)
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, patient_id, last_name, last_name_kana, birthdate, insurance_number):
+        return Patient.objects.create(patient_id=patient_id, last_name=last_name, first_name='花子',
+                                      last_name_kana=last_name_kana, first_name_kana='ハナコ', gender=1,
+                                      birthdate=birthdate, insurance_number=insurance_number,
+                                      insurance_exp=date(2030, 3, 31))
+
+    def test_registration_warns_with_single_lookup(self):
+        self.create('P0001', '高橋', 'タカハシ', date(1980, 1, 1), '1234-5678')
+        self.create('P0002', '佐藤', 'サトウ', date(1990, 5, 5), '87654321')
+        self.client.force_login(self.employee)
+        self.client.post(reverse('patient_register'), {
+            'patient_id': 'P0003', 'last_name': '髙橋', 'first_name': '花子', 'last_name_kana': 'たかはし',
+            'first_name_kana': 'ﾊﾅｺ', 'gender': '1', 'birthdate': '1980-01-01', 'insurance_number': '8765 4321',
+            'confirm_insurance_number': '8765 4321', 'insurance_exp': '2030-03-31',
+        })
+        response = self.client.get(reverse('patient_registration_confirm'))
+        self.assertEqual([(patient.patient_id, reasons) for patient, reasons in response.context['duplicates']],
+                         [('P0001', ['読み・生年月日']), ('P0002', ['保険証記号番号'])])
+        with self.assertNumQueries(1):
+            duplicates.probable_duplicates({'last_name': '髙橋', 'first_name': '花子', 'last_name_kana': 'タカハシ',
+                                            'first_name_kana': 'ハナコ', 'birthdate': date(1980, 1, 1),
+                                            'insurance_number': ''})
+        # 警告は表示するだけで、確認すれば登録できる
+        self.client.post(reverse('patient_registration_confirm'), {'action': 'confirm'})
+        self.assertEqual(Patient.objects.get(pk='P0003').birthdate, date(1980, 1, 1))
+
+    def test_find_clusters_joins_keys_transitively(self):
+        self.create('P0001', '高橋', 'タカハシ', date(1980, 1, 1), '11111111')
+        self.create('P0002', '髙橋', 'タカハシ', date(1980, 1, 1), '22222222')
+        self.create('P0003', '鈴木', 'スズキ', date(1970, 2, 2), '2222-2222')
+        self.create('P0004', '田中', 'タナカ', date(1960, 3, 3), '33333333')
+        self.create('P0005', '田中', 'タナカ', date(1960, 3, 4), '44444444')
+        self.create('P0006', '伊藤', 'イトウ', date(1985, 4, 4), '55555555')
+        self.create('P0007', '伊藤', 'イトウ', date(1985, 4, 4), '66666666')
+        # 変更後の値でキーを作り直す
+        Patient.objects.filter(pk='P0007').update(updated_at=timezone.now() - timedelta(days=1))
+        patient = Patient.objects.get(pk='P0007')
+        patient.birthdate = date(1985, 4, 5)
+        patient.save(update_fields=['birthdate'])
+        self.assertEqual(duplicates.find_clusters(batch_size=1), [['P0001', 'P0002', 'P0003']])
+        # 一部の項目だけの保存でも最終更新日時が進み、差分の取得の対象になる
+        self.assertGreater(Patient.objects.get(pk='P0007').updated_at, timezone.now() - timedelta(minutes=1))
+
+
+# バックグラウンド処理（登録 → run_workers での実行・再試行 → 処理状況の確認）
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASE=None, JOB_RETRY_DELAY=0, JOB_PROGRESS_INTERVAL=0,
+                   JOB_OUTPUT_DIR=tempfile.mkdtemp(), JOB_IMPORT_DIR=tempfile.mkdtemp())
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reception = Employee.objects.create_user(username='R0001', password='password', first_name='花子',
+                                                     last_name='受付', role=Employee.Role.RECEPTION)
+        cls.other = Employee.objects.create_user(username='R0002', password='password', first_name='次郎',
+                                                 last_name='受付', role=Employee.Role.RECEPTION)
+        for i in range(3):
+            Hospital.objects.create(hospital_id=f'H{i:04d}', hospital_name=f'病院{i}', hospital_address='東京都新宿区',
+                                    phone_number='03-1234-5678', capital=1000, emergency=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def run_workers(self):
+        call_command('run_workers', once=True, inline=True, stdout=open('/dev/null', 'w'))
+
+    def test_background_export_reports_progress(self):
+        self.client.force_login(self.reception)
+        response = self.client.get(reverse('export_data', args=['hospitals']), {'background': '1'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], '待機中')
+
+        self.run_workers()
+        status = self.client.get(status_url).json()
+        self.assertEqual((status['status'], status['progress'], status['total']), ('完了', 3, 3))
+        download = self.client.get(status['download_url'])
+        self.assertEqual(b''.join(download.streaming_content).decode().count('\n'), 4)
+        # 登録した本人以外には見えない
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        job = jobs.enqueue('import_master_data', {'kind': 'hospitals', 'path': 'nonexistent.csv'}, max_attempts=2)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+        self.assertIn('見つかりません', job.error)
+
+    def test_claim_respects_concurrency_and_requeues_stale(self):
+        stale = jobs.enqueue('export', {'kind': 'hospitals', 'filters': {}})
+        Job.objects.filter(pk=stale.pk).update(status=Job.Status.RUNNING, attempts=1,
+                                               heartbeat_at=timezone.now() - timedelta(hours=1))
+        queued = jobs.enqueue('export', {'kind': 'hospitals', 'filters': {}})
+        rebuild = jobs.enqueue('rebuild_insurance_expiry_counts')
+        with self.settings(JOB_CONCURRENCY={'export': 1}):
+            # 実行中の export が上限に達しているため、次の export は取り出さない
+            self.assertEqual(jobs.claim('test').pk, rebuild.pk)
+            self.assertIsNone(jobs.claim('test'))
+            # 応答の途絶えた処理は待機中に戻り、空いた枠で先に待っていた export を取り出す
+            jobs.requeue_stale()
+            self.assertEqual(Job.objects.get(pk=stale.pk).status, Job.Status.QUEUED)
+            self.assertEqual(jobs.claim('test').pk, queued.pk)
+            self.assertIsNone(jobs.claim('test'))
+
+    def test_claim_checks_limit_while_claiming(self):
+        # 候補を選んだ後に他のワーカーが同じ種類を実行中にしても、取り出す時の確認で上限を守る
+        running = jobs.enqueue('import_master_data', {'kind': 'hospitals', 'path': 'a.csv'})
+        queued = jobs.enqueue('import_master_data', {'kind': 'hospitals', 'path': 'b.csv'})
+        Job.objects.filter(pk=running.pk).update(status=Job.Status.RUNNING, heartbeat_at=timezone.now())
+        with self.settings(JOB_CONCURRENCY={'import_master_data': 1}), \
+                mock.patch('abaranti.jobs.saturated_kinds', return_value=[]):
+            self.assertIsNone(jobs.claim('test'))
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.Status.QUEUED)
+
+    def test_finished_job_does_not_overwrite_reclaimed_attempt(self):
+        job = jobs.enqueue('rebuild_insurance_expiry_counts')
+        claimed = jobs.claim('test')
+
+        def reclaimed(params, progress):
+            # 実行している間に応答が途絶えたとされ、他のワーカーが取り出し直した
+            Job.objects.filter(pk=job.pk).update(worker='other', attempts=F('attempts') + 1)
+            return {}
+
+        with mock.patch.dict(jobs.HANDLERS, {'rebuild_insurance_expiry_counts': reclaimed}):
+            jobs.run_job(claimed.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts), (Job.Status.RUNNING, 'other', 2))
+        # 失敗の記録も同じ
+        jobs.fail(claimed, 'error')
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.Status.RUNNING)
+
+    def test_inline_worker_sends_heartbeat_without_progress(self):
+        jobs.enqueue('rebuild_insurance_expiry_counts')
+
+        def slow(params, progress):
+            time.sleep(0.2)
+            return {}
+
+        with self.settings(JOB_STALE_SECONDS=0.03), mock.patch('abaranti.jobs.heartbeat') as heartbeat, \
+                mock.patch.dict(jobs.HANDLERS, {'rebuild_insurance_expiry_counts': slow}):
+            self.run_workers()
+        self.assertTrue(heartbeat.called)
+
+    def test_import_path_is_restricted_to_import_dir(self):
+        staff = Employee.objects.create_user(username='S0001', password='password', first_name='一郎',
+                                             last_name='管理', role=Employee.Role.RECEPTION, is_staff=True)
+        self.client.force_login(staff)
+        for path in ('/etc/passwd', '../outside.csv', ''):
+            self.client.post(reverse('job_enqueue', args=['import_master_data']), {'kind': 'hospitals', 'path': path})
+        self.assertFalse(Job.objects.exists())
+        self.client.post(reverse('job_enqueue', args=['import_master_data']),
+                         {'kind': 'hospitals', 'path': 'hospitals.csv'})
+        self.assertEqual(Job.objects.get().params['path'], 'hospitals.csv')
+        # 画面を通さずに登録された処理も、実行する時に確かめる
+        job = jobs.enqueue('import_master_data', {'kind': 'hospitals', 'path': '/etc/passwd'}, max_attempts=1)
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn('取り込み用のディレクトリ', job.error)
+
+
+# DB 接続のプール（作り直し・再利用前の確認・最大接続数）
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, size=2, recycle=300, timeout=0.05):
+        pool = ConnectionPool(size, recycle, timeout, (sqlite3.DatabaseError, sqlite3.InterfaceError))
+        self.addCleanup(pool.clear)
+        return pool
+
+    def connect(self):
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def test_idle_connection_is_reused_until_recycle(self):
+        pool = self.make_pool()
+        raw = pool.acquire(self.connect)
+        pool.release(raw)
+        self.assertIs(pool.acquire(self.connect), raw)
+        self.assertEqual((pool.created, pool.reused), (1, 1))
+        pool.release(raw)
+        # RECYCLE 秒以上使われていない接続は閉じて作り直す
+        pool.recycle = 0
+        self.assertIsNot(pool.acquire(self.connect), raw)
+        self.assertEqual((pool.created, pool.reused), (2, 1))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            raw.execute('SELECT 1')
+
+    def test_dead_connection_is_replaced(self):
+        pool = self.make_pool()
+        raw = pool.acquire(self.connect)
+        pool.release(raw)
+        raw.close()  # プールにある間に切断された
+        with self.assertLogs('abaranti.db.pool', 'DEBUG'):
+            self.assertIsNot(pool.acquire(self.connect), raw)
+        self.assertEqual((pool.created, pool.reused), (2, 0))
+
+    def test_unexpected_errors_are_not_swallowed(self):
+        pool = self.make_pool()
+        raw = mock.Mock()
+        raw.cursor.side_effect = RuntimeError('driver bug')
+        pool.release(pool.acquire(lambda: raw))
+        with self.assertRaises(RuntimeError):
+            pool.acquire(self.connect)
+        # 確認に失敗しても貸出枠は戻す
+        self.assertTrue(pool.slots.acquire(blocking=False))
+
+    def test_connections_are_limited_to_size(self):
+        pool = self.make_pool(size=1)
+        raw = pool.acquire(self.connect)
+        with self.assertRaises(OperationalError):
+            pool.acquire(self.connect)
+        self.assertEqual(pool.created, 1)
+        pool.release(raw)
+        self.assertIs(pool.acquire(self.connect), raw)
@@ -0,0 +1,38 @@
+import hashlib
+import unicodedata
+
+# -------------------------------------------------------------------
+# 正規化
+# 全角/半角（NFKC）とひらがな/カタカナを揃え、空白を取り除く
+# -------------------------------------------------------------------
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    chars = []
+    for ch in text:
+        if ch.isspace():
+            continue
+        # ひらがなをカタカナに揃える
+        if 'ぁ' <= ch <= 'ゖ':
+            ch = chr(ord(ch) + 0x60)
+        chars.append(ch)
+    return ''.join(chars)
+
+
+# -------------------------------------------------------------------
+# 患者の重複候補の検出キー（ブロッキングキー）
+# 同じキーを持つ患者だけを比較するため、全患者との総当たりをせずに索引の検索1回で候補を求められる
+# -------------------------------------------------------------------
+def name_birth_key(last_name, first_name, last_name_kana, first_name_kana, birthdate):
+    # 読み（未登録の場合は氏名）+ 生年月日。漢字の異体字・表記ゆれがあっても読みが同じなら一致する
+    reading = normalize(last_name_kana + first_name_kana) or normalize(last_name + first_name)
+    if not reading or not birthdate:
+        return ''
+    return f'{reading}|{birthdate}'
+
+
+def insurance_key(insurance_number):
+    # 保険証記号番号は記号・空白を除いて揃え、ハッシュ値だけを索引に持つ
+    digits = ''.join(ch for ch in normalize(insurance_number) if ch.isalnum())
+    if not digits:
+        return ''
+    return hashlib.sha256(digits.encode()).hexdigest()
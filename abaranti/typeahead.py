@@ -0,0 +1,189 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+from .models import Patient
+from .routers import PRIMARY
+from .text import normalize
+from .watermarks import get_watermark
+
+# -------------------------------------------------------------------
+# 患者の候補表示（入力途中の患者ID・氏名・読みからの前方一致）
+# ワーカープロセスごとに「正規化した語 + 区切り + 患者ID」の整列済みリストを持ち、二分探索で引く
+# 自プロセスの変更はシグナルで即時に反映し、他プロセスの変更は患者テーブルの最終更新日時を見て差分を取り込む
+# -------------------------------------------------------------------
+TYPEAHEAD_LIMIT = 10
+SEPARATOR = '\x00'
+# 患者の削除は差分では検知できないため、回数を共有して全体を作り直す
+DELETIONS_KEY = 'abaranti:typeahead:deletions'
+# 差分の取り込みで、サーバー間の時刻のずれを見込んで遡る時間
+SYNC_MARGIN = timedelta(seconds=5)
+
+PATIENT_FIELDS = ('patient_id', 'last_name', 'first_name', 'last_name_kana', 'first_name_kana', 'birthdate')
+
+
+def patient_keys(values):
+    patient_id, last_name, first_name, last_kana, first_kana = (normalize(value) for value in values[:5])
+    keys = {patient_id, last_name, first_name, last_name + first_name, last_kana, first_kana, last_kana + first_kana}
+    keys.discard('')
+    return keys
+
+
+def to_result(values):
+    return dict(zip(PATIENT_FIELDS, values))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.entries = []   # 整列済み「語 + 区切り + 患者ID」
+        self.patients = {}  # 患者ID → 表示用の値
+        self.keys = {}      # 患者ID → 登録した語（更新・削除時に取り除くため）
+        self.lock = threading.Lock()
+        self.ready = False
+        self.building = False
+        self.synced_at = None
+        self.deletions = None
+        self.checked_at = 0.0
+
+    # ---- 更新 ----
+    def _remove(self, patient_id):
+        for key in self.keys.pop(patient_id, ()):
+            entry = key + SEPARATOR + patient_id
+            i = bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+        self.patients.pop(patient_id, None)
+
+    def _add(self, values):
+        patient_id = values[0]
+        self._remove(patient_id)
+        keys = patient_keys(values)
+        for key in keys:
+            insort(self.entries, key + SEPARATOR + patient_id)
+        self.keys[patient_id] = keys
+        self.patients[patient_id] = values
+
+    def update(self, patient):
+        if self.ready:
+            with self.lock:
+                self._add(tuple(getattr(patient, field) for field in PATIENT_FIELDS))
+
+    def remove(self, patient_id):
+        if self.ready:
+            with self.lock:
+                self._remove(patient_id)
+
+    def build(self):
+        deletions = cache.get(DELETIONS_KEY, 0)
+        watermark = get_watermark('patient')
+        entries = []
+        patients = {}
+        keys = {}
+        rows = Patient.objects.using(PRIMARY).values_list(*PATIENT_FIELDS).iterator(chunk_size=5000)
+        for values in rows:
+            patient_keys_ = patient_keys(values)
+            entries.extend(key + SEPARATOR + values[0] for key in patient_keys_)
+            patients[values[0]] = values
+            keys[values[0]] = patient_keys_
+        entries.sort()
+        with self.lock:
+            self.entries, self.patients, self.keys = entries, patients, keys
+            self.synced_at, self.deletions = watermark, deletions
+            self.ready = True
+            self.building = False
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        finally:
+            self.building = False
+            connections.close_all()
+
+    def ensure_built(self):
+        # 初回は作成を始めるだけで、作成が終わるまでは DB で検索する
+        with self.lock:
+            if self.ready or self.building:
+                return
+            self.building = True
+        if getattr(settings, 'TYPEAHEAD_BUILD_IN_BACKGROUND', True):
+            threading.Thread(target=self._build_in_background, daemon=True).start()
+        else:
+            try:
+                self.build()
+            finally:
+                self.building = False
+
+    def sync(self):
+        # 他プロセスでの変更を取り込む（確認は TYPEAHEAD_SYNC_INTERVAL 秒に1回）
+        now = time.monotonic()
+        if now - self.checked_at < getattr(settings, 'TYPEAHEAD_SYNC_INTERVAL', 1.0):
+            return
+        self.checked_at = now
+        if cache.get(DELETIONS_KEY, 0) != self.deletions:
+            self.ready = False
+            self.ensure_built()
+            return
+        watermark = get_watermark('patient')
+        if watermark <= self.synced_at:
+            return
+        rows = Patient.objects.using(PRIMARY).filter(updated_at__gte=self.synced_at - SYNC_MARGIN)
+        with self.lock:
+            for values in rows.values_list(*PATIENT_FIELDS):
+                self._add(values)
+            self.synced_at = watermark
+
+    # ---- 検索 ----
+    def lookup(self, term, limit=TYPEAHEAD_LIMIT):
+        entries = self.entries
+        results = []
+        seen = set()
+        i = bisect_left(entries, term)
+        while i < len(entries) and len(results) < limit:
+            entry = entries[i]
+            if not entry.startswith(term):
+                break
+            patient_id = entry[entry.index(SEPARATOR) + 1:]
+            values = self.patients.get(patient_id)
+            if values is not None and patient_id not in seen:
+                seen.add(patient_id)
+                results.append(values)
+            i += 1
+        return results
+
+
+index = PrefixIndex()
+
+
+def lookup_db(term, limit=TYPEAHEAD_LIMIT):
+    # 候補表示のインデックスの作成中は、患者名検索のインデックス（前方一致）を使う
+    query = (Q(patient_id__istartswith=term) | Q(search_entry__last_name_norm__startswith=term)
+             | Q(search_entry__first_name_norm__startswith=term) | Q(search_entry__full_name_norm__startswith=term)
+             | Q(last_name_kana__startswith=term) | Q(first_name_kana__startswith=term))
+    return list(Patient.objects.filter(query).order_by('patient_id').values_list(*PATIENT_FIELDS)[:limit])
+
+
+def suggest(query, limit=TYPEAHEAD_LIMIT):
+    # 戻り値: (候補のリスト, 'index' または 'db')
+    term = normalize(query)
+    if not term:
+        return [], 'index'
+    if index.ready:
+        index.sync()
+    if not index.ready:
+        index.ensure_built()
+    if index.ready:
+        return [to_result(values) for values in index.lookup(term, limit)], 'index'
+    return [to_result(values) for values in lookup_db(term, limit)], 'db'
+
+
+def record_deletion():
+    try:
+        cache.incr(DELETIONS_KEY)
+    except ValueError:
+        cache.add(DELETIONS_KEY, 1, timeout=None)
@@ -8,7 +8,34 @@ urlpatterns = [
     path('', views.login_view, name='login'),  # ログイン画面をルートURLに設定
     path('logout/', auth_views.LogoutView.as_view(next_page='/'), name='logout'),
     path('error/', views.error_view, name='error'),  # エラー画面のURLパターン
+    path('menu/', views.menu, name='menu'),
     path('employee/register/', views.employee_register, name='employee_register'),
     path('employee/register/confirm/', views.employee_registration_confirm, name='employee_registration_confirm'),
+    path('patient/insurance/expiry/', views.patient_check_insurance_expiry, name='patient_check_insurance_expiry'),
+    path('patient/register/', views.patient_register, name='patient_register'),
+    path('patient/register/confirm/', views.patient_registration_confirm, name='patient_registration_confirm'),
+    path('patient/search/', views.patient_search_by_name, name='patient_search_by_name'),
+    path('api/patient/autocomplete/', views.patient_autocomplete, name='patient_autocomplete'),
+    path('treatment/<str:patient_id>/instruction/', views.medication_instruction, name='medication_instruction'),
+    path('treatment/<str:patient_id>/instruction/confirm/', views.confirm_treatment, name='confirm_treatment'),
+    path('treatment/history/', views.check_treatment_history, name='check_treatment_history'),
+    path('api/treatment/history/', views.treatment_history_api, name='treatment_history_api'),
+    path('report/medicine/usage/', views.medicine_usage_report, name='medicine_usage_report'),
+    path('export/<str:kind>/', views.export_data, name='export_data'),
+    path('hospital/search/', views.hospital_search_by_capital, name='hospital_search_by_capital'),
+    path('hospital/search/address/', views.hospital_search_by_address, name='hospital_search_by_address'),
+    path('hospital/nearest/', views.hospital_nearest, name='hospital_nearest'),
+    path('employee/update/', views.employee_update, name='employee_update'),
+    path('employee/update/confirm/', views.employee_update_confirm, name='employee_update_confirm'),
+    path('hospital/register/', views.hospital_register, name='hospital_register'),
+    path('hospital/register/confirm/', views.hospital_registration_confirm, name='hospital_registration_confirm'),
+    path('hospital/list/', views.hospital_list, name='hospital_list'),
+    path('hospital/<str:hospital_id>/update/', views.hospital_update, name='hospital_update'),
+    path('hospital/<str:hospital_id>/update/confirm/', views.hospital_update_confirm, name='hospital_update_confirm'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<str:kind>/enqueue/', views.job_enqueue, name='job_enqueue'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/download/', views.job_download, name='job_download'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
@@ -0,0 +1,116 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import ArchivedTreatment, DoctorMonthlyUsage, MedicineDailyUsage, MedicineMonthlyUsage, Treatment
+
+# -------------------------------------------------------------------
+# 薬剤の使用量の集計表（日別・月別・医師別）
+# 処置の登録・削除と同じトランザクションで F() により増減し、報告画面は処置の表ではなく集計表だけを読む
+# （報告の所要時間は処置の件数ではなく、対象期間の日数・月数で決まる）
+# -------------------------------------------------------------------
+
+
+def increment(model, lookup, field, delta):
+    updated = model.objects.filter(**lookup).update(**{field: F(field) + delta})
+    if not updated:
+        try:
+            with transaction.atomic():
+                model.objects.create(**lookup, **{field: delta})
+        except IntegrityError:
+            # 同時に作成された場合は加算し直す
+            model.objects.filter(**lookup).update(**{field: F(field) + delta})
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def record(treatments, sign=1):
+    # sign: 登録時は 1、削除時は -1
+    # 同時に登録されても行ロックの順序が揃うよう、キーの順に更新する
+    daily = Counter()
+    monthly = Counter()
+    doctors = Counter()
+    for treatment in treatments:
+        day = timezone.localdate(treatment.date)
+        daily[treatment.medicine_id, day] += treatment.quantity
+        monthly[treatment.medicine_id, month_of(day)] += treatment.quantity
+        if treatment.doctor_id:
+            doctors[treatment.doctor_id, treatment.medicine_id, month_of(day)] += treatment.quantity
+    for (medicine_id, day), quantity in sorted(daily.items()):
+        increment(MedicineDailyUsage, {'medicine_id': medicine_id, 'date': day}, 'quantity', sign * quantity)
+    for (medicine_id, month), quantity in sorted(monthly.items()):
+        increment(MedicineMonthlyUsage, {'medicine_id': medicine_id, 'month': month}, 'quantity', sign * quantity)
+    for (doctor_id, medicine_id, month), quantity in sorted(doctors.items()):
+        increment(DoctorMonthlyUsage, {'doctor_id': doctor_id, 'medicine_id': medicine_id, 'month': month},
+                  'quantity', sign * quantity)
+
+
+def rebuild(batch_size=1000):
+    # 集計表を処置の履歴（保管用の表へ移した処置を含む）から作り直す（一括登録したデータ・項目追加前のデータの取り込み用）
+    # 戻り値: 集計表ごとの行数
+    daily = Counter()
+    doctors = Counter()
+    with transaction.atomic():
+        # 新しい処置と保管した処置を同じトランザクションで読み、保管の途中でも二重に数えない・欠けないようにする
+        for model in (Treatment, ArchivedTreatment):
+            rows = (model.objects.annotate(day=TruncDate('date')).values_list('medicine_id', 'day')
+                    .annotate(total=Sum('quantity')).order_by())
+            for medicine_id, day, total in rows:
+                daily[medicine_id, day] += total
+            rows = (model.objects.filter(doctor__isnull=False)
+                    .annotate(month=TruncMonth('date', output_field=DateField()))
+                    .values_list('doctor_id', 'medicine_id', 'month').annotate(total=Sum('quantity')).order_by())
+            for doctor_id, medicine_id, month, total in rows:
+                doctors[doctor_id, medicine_id, month] += total
+        # 月別は処置の表ではなく、日別の集計から求める
+        monthly = Counter()
+        for (medicine_id, day), quantity in daily.items():
+            monthly[medicine_id, month_of(day)] += quantity
+
+        for model in (MedicineDailyUsage, MedicineMonthlyUsage, DoctorMonthlyUsage):
+            model.objects.all().delete()
+        MedicineDailyUsage.objects.bulk_create(
+            [MedicineDailyUsage(medicine_id=medicine_id, date=day, quantity=quantity)
+             for (medicine_id, day), quantity in daily.items()],
+            batch_size=batch_size,
+        )
+        MedicineMonthlyUsage.objects.bulk_create(
+            [MedicineMonthlyUsage(medicine_id=medicine_id, month=month, quantity=quantity)
+             for (medicine_id, month), quantity in monthly.items()],
+            batch_size=batch_size,
+        )
+        DoctorMonthlyUsage.objects.bulk_create(
+            [DoctorMonthlyUsage(doctor_id=doctor_id, medicine_id=medicine_id, month=month, quantity=quantity)
+             for (doctor_id, medicine_id, month), quantity in doctors.items()],
+            batch_size=batch_size,
+        )
+    return {'daily': len(daily), 'monthly': len(monthly), 'doctor': len(doctors)}
+
+
+# ---- 報告用の検索（集計表だけを読む） ----
+REPORT_PERIODS = (('day', '日別'), ('month', '月別'), ('doctor', '医師別（月別）'))
+
+
+def report(period, date_from, date_to, medicine_id=None):
+    # 戻り値: (期間, [医師ID,] 薬剤ID, 薬剤名, 単位, 使用量) の辞書のリスト（期間・薬剤の順）
+    if period == 'day':
+        rows = MedicineDailyUsage.objects.filter(date__range=(date_from, date_to))
+        period_field = 'date'
+        keys = ('date',)
+    else:
+        model = DoctorMonthlyUsage if period == 'doctor' else MedicineMonthlyUsage
+        rows = model.objects.filter(month__range=(month_of(date_from), month_of(date_to)))
+        period_field = 'month'
+        keys = ('month', 'doctor_id') if period == 'doctor' else ('month',)
+    if medicine_id:
+        rows = rows.filter(medicine_id=medicine_id)
+    rows = rows.exclude(quantity=0).order_by(*keys, 'medicine_id')
+    return [
+        {'period': row[period_field], **row}
+        for row in rows.values(*keys, 'medicine_id', 'medicine__medicinename', 'medicine__unit', 'quantity')
+    ]
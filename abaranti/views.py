@@ -1,15 +1,37 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import authenticate, login
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from .forms import LoginForm, EmployeeRegistrationForm, EmployeeUpdateForm, HospitalRegistrationForm, \
-    HospitalUpdateForm, PatientRegistrationForm, PatientInsuranceChangeForm, MedicationInstructionForm
-from .models import Employee, Patient, Hospital, Treatment, Medicine
-from django.db.models import Q
-from datetime import date
-from django.core.paginator import Paginator
+    HospitalUpdateForm, PatientRegistrationForm, HospitalSearchForm, TreatmentHistoryForm, \
+    MedicationInstructionFormSet, ExportForm, MedicineUsageReportForm
+from .models import Employee, Patient, Hospital, Treatment, ArchivedTreatment, GazetteerEntry, Job
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
+from .pagination import CursorPaginator, TieredCursorPaginator
+from .catalog import get_medicine
+from .wizard import get_wizard_store
+from .expiry import EXPIRY_BUCKETS, bucket_counts, bucket_filter
+from .search import search_patients
+from .typeahead import suggest
+from .stock import record_treatments
+from .archive import archived_through
+from .duplicates import probable_duplicates
+from .jobs import enqueue, import_path
+from .usage import report as usage_report
+from .address import address_query, parse_address
+from .geo import nearest
+from django.http import JsonResponse, Http404, StreamingHttpResponse, HttpResponse, HttpResponseForbidden, FileResponse
+from .export import EXPORT_FIELDS, export_chunks
+from .routers import read_from_replica
+from .metrics import render_prometheus
+from .fragments import cached_render
+from .watermarks import conditional_on
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.views.decorators.http import require_POST
 from django.contrib.auth.hashers import make_password
-from django.contrib.auth import get_user_model
 
 
 # -------------------------------------------------------------------
@@ -72,7 +94,7 @@ def employee_register(request):
                 # ハッシュ化されたパスワードで保存
                 form.cleaned_data['password'] = make_password(form.cleaned_data['password'])
                 # 登録確認画面にリダイレクト
-                request.session['form_data'] = form.cleaned_data
+                get_wizard_store(request).save('employee_register', form.cleaned_data)
                 return redirect('employee_registration_confirm')
     else:
         form = EmployeeRegistrationForm()
@@ -83,18 +105,21 @@ def employee_register(request):
 @login_required
 def employee_registration_confirm(request):
     if request.method == 'POST':
-        if 'confirm' in request.POST:
-            # 登録処理
-            form_data = request.session.get('form_data')
-            Employee.objects.create_user(**form_data)
-            del request.session['form_data']
+        if request.POST.get('action') == 'confirm':
+            # 登録処理（パスワードはハッシュ化済みのため create_user ではなく create で保存）
+            store = get_wizard_store(request)
+            form_data = store.load('employee_register')
+            if not form_data:
+                return redirect('employee_register')
+            Employee.objects.create(**form_data)
+            store.clear('employee_register')
             messages.success(request, '従業員を登録しました。')
             return redirect('employee_register')  # 登録画面に戻る
-        elif 'back' in request.POST:
+        elif request.POST.get('action') == 'back':
             # 登録画面に戻る
             return redirect('employee_register')
     else:
-        form_data = request.session.get('form_data')
+        form_data = get_wizard_store(request).load('employee_register')
         if not form_data:
             # セッションにデータがない場合はエラー
             return redirect('employee_register')
@@ -104,35 +129,40 @@ def employee_registration_confirm(request):
 
 @login_required
 def employee_update(request):
+    # request.user はキャッシュされた従業員情報のため、更新用にモデルを読み込む
+    employee = get_object_or_404(Employee, pk=request.user.pk)
     if request.method == 'POST':
-        form = EmployeeUpdateForm(request.POST, instance=request.user)
+        form = EmployeeUpdateForm(request.POST, instance=employee)
         if form.is_valid():
             # 変更確認画面にリダイレクト
-            request.session['form_data'] = form.cleaned_data
+            get_wizard_store(request).save('employee_update', form.cleaned_data)
             return redirect('employee_update_confirm')
     else:
-        form = EmployeeUpdateForm(instance=request.user)
+        form = EmployeeUpdateForm(instance=employee)
     return render(request, 'employee_update.html', {'form': form})
 
 
 @login_required
 def employee_update_confirm(request):
     if request.method == 'POST':
-        if 'confirm' in request.POST:
+        if request.POST.get('action') == 'confirm':
             # 変更処理
-            form_data = request.session.get('form_data')
-            employee = request.user
+            store = get_wizard_store(request)
+            form_data = store.load('employee_update')
+            if not form_data:
+                return redirect('employee_update')
+            employee = get_object_or_404(Employee, pk=request.user.pk)
             employee.first_name = form_data['first_name']
             employee.last_name = form_data['last_name']
             employee.save()
-            del request.session['form_data']
+            store.clear('employee_update')
             messages.success(request, '従業員情報を変更しました。')
             return redirect('menu')  # メニュー画面に戻る
-        elif 'back' in request.POST:
+        elif request.POST.get('action') == 'back':
             # 変更画面に戻る
             return redirect('employee_update')
     else:
-        form_data = request.session.get('form_data')
+        form_data = get_wizard_store(request).load('employee_update')
         if not form_data:
             # セッションにデータがない場合はエラー
             return redirect('employee_update')
@@ -153,7 +183,7 @@ def hospital_register(request):
                 messages.error(request, 'この病院IDは既に登録されています。')
             else:
                 # 登録確認画面にリダイレクト
-                request.session['form_data'] = form.cleaned_data
+                get_wizard_store(request).save('hospital_register', form.cleaned_data)
                 return redirect('hospital_registration_confirm')
     else:
         form = HospitalRegistrationForm()
@@ -163,44 +193,129 @@ def hospital_register(request):
 @login_required
 def hospital_registration_confirm(request):
     if request.method == 'POST':
-        if 'confirm' in request.POST:
+        if request.POST.get('action') == 'confirm':
             # 登録処理
-            form_data = request.session.get('form_data')
+            store = get_wizard_store(request)
+            form_data = store.load('hospital_register')
+            if not form_data:
+                return redirect('hospital_register')
             Hospital.objects.create(**form_data)
-            del request.session['form_data']
+            store.clear('hospital_register')
             messages.success(request, '病院を登録しました。')
             return redirect('hospital_register')  # 登録画面に戻る
-        elif 'back' in request.POST:
+        elif request.POST.get('action') == 'back':
             # 登録画面に戻る
             return redirect('hospital_register')
     else:
-        form_data = request.session.get('form_data')
+        form_data = get_wizard_store(request).load('hospital_register')
         if not form_data:
             # セッションにデータがない場合はエラー
             return redirect('hospital_register')
     return render(request, 'hospital_registration_confirm.html', {'form_data': form_data})
 
 
+# -------------------------------------------------------------------
+# 患者登録機能 (P101)
+# 確認画面で、検出キーが一致する既存の患者を重複の可能性として表示する（索引の検索1回）
+# -------------------------------------------------------------------
+@login_required
+def patient_register(request):
+    if request.method == 'POST':
+        form = PatientRegistrationForm(request.POST)
+        if form.is_valid():
+            get_wizard_store(request).save('patient_register', form.cleaned_data)
+            return redirect('patient_registration_confirm')
+    else:
+        form = PatientRegistrationForm()
+    return render(request, 'patient_registration.html', {'form': form})
+
+
 @login_required
+def patient_registration_confirm(request):
+    store = get_wizard_store(request)
+    form_data = store.load('patient_register')
+    if not form_data:
+        return redirect('patient_register')
+    # 日付はウィザードの状態に文字列で保存している
+    for field in ('birthdate', 'insurance_exp'):
+        form_data[field] = date.fromisoformat(form_data[field])
+    if request.method == 'POST':
+        if request.POST.get('action') == 'confirm':
+            Patient.objects.create(**form_data)
+            store.clear('patient_register')
+            messages.success(request, '患者を登録しました。')
+            return redirect('patient_register')
+        elif request.POST.get('action') == 'back':
+            return redirect('patient_register')
+    return render(request, 'patient_registration_confirm.html', {
+        'form_data': form_data,
+        'duplicates': probable_duplicates(form_data),
+    })
+
+
+# 一覧の並び順（キーセットページネーションのキー）
+HOSPITAL_LIST_ORDERINGS = {
+    'hospital_id': ('hospital_id',),
+    'capital': ('capital', 'hospital_id'),
+    '-capital': ('-capital', 'hospital_id'),
+}
+
+
+@login_required
+@read_from_replica
+@conditional_on('hospital')
 def hospital_list(request):
-    hospitals = Hospital.objects.all()
-    paginator = Paginator(hospitals, 10)  # 1ページあたり10件表示
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return render(request, 'hospitalitiran.html', {'page_obj': page_obj})
+    sort = request.GET.get('sort', 'hospital_id')
+    if sort not in HOSPITAL_LIST_ORDERINGS:
+        sort = 'hospital_id'
+    cursor = request.GET.get('cursor')
+
+    def get_context():
+        paginator = CursorPaginator(Hospital.objects.all(), HOSPITAL_LIST_ORDERINGS[sort], per_page=10,
+                                    with_total=True)  # 1ページあたり10件表示
+        return {'page_obj': paginator.get_page(cursor), 'sort': sort}
 
+    # 並び順・カーソルごとに描画結果をキャッシュする（他病院の変更で破棄）
+    return cached_render(request, 'hospital_list', {'sort': sort, 'cursor': cursor}, 'hospitalitiran.html',
+                         get_context)
 
+
+# 他病院検索（資本金の範囲・救急対応・住所・並び順）
 @login_required
+@read_from_replica
+@conditional_on('hospital')
 def hospital_search_by_capital(request):
-    if request.method == 'POST':
-        capital = request.POST['capital']
-        try:
-            capital = int(capital)
-            hospitals = Hospital.objects.filter(capital__gte=capital)
-            return render(request, 'hospital_search_result.html', {'hospitals': hospitals})
-        except ValueError:
-            messages.error(request, '資本金には数値を入力してください。')
-    return render(request, 'capital_confirmation.html')
+    form = HospitalSearchForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'capital_confirmation.html', {'form': form})
+
+    hospitals = Hospital.objects.all()
+    if form.cleaned_data['capital_min'] is not None:
+        hospitals = hospitals.filter(capital__gte=form.cleaned_data['capital_min'])
+    if form.cleaned_data['capital_max'] is not None:
+        hospitals = hospitals.filter(capital__lte=form.cleaned_data['capital_max'])
+    if form.cleaned_data['emergency'] is not None:
+        hospitals = hospitals.filter(emergency=form.cleaned_data['emergency'])
+    if form.cleaned_data['address']:
+        hospitals = hospitals.filter(address_query(form.cleaned_data['address']))
+    ordering = (form.cleaned_data['sort'] or 'capital', 'hospital_id')
+    cursor = request.GET.get('cursor')
+    query = request.GET.copy()
+    query.pop('cursor', None)
+
+    def get_context():
+        paginator = CursorPaginator(hospitals, ordering, per_page=10)
+        page_obj = paginator.get_page(cursor)
+        context = {'hospitals': page_obj, 'page_obj': page_obj, 'query_string': query.urlencode()}
+        if settings.DEBUG:
+            # デバッグ時は実行計画を表示し、インデックスが使われているか確認できるようにする
+            context['query_plan'] = hospitals.order_by(*ordering).explain()
+        return context
+
+    # 検索条件は正規化した値（住所は分解後の値）でキャッシュのキーにする
+    params = {**form.cleaned_data, 'address': parse_address(form.cleaned_data['address'] or ''), 'cursor': cursor,
+              'query_string': query.urlencode()}
+    return cached_render(request, 'hospital_search_by_capital', params, 'hospital_search_result.html', get_context)
 
 
 @login_required
@@ -210,32 +325,38 @@ def hospital_update(request, hospital_id):
         form = HospitalUpdateForm(request.POST, instance=hospital)
         if form.is_valid():
             # 変更確認画面にリダイレクト
-            request.session['form_data'] = form.cleaned_data
+            get_wizard_store(request).save('hospital_update', {**form.cleaned_data, 'hospital_id': hospital_id})
             return redirect('hospital_update_confirm', hospital_id=hospital_id)
+    else:
+        form = HospitalUpdateForm(instance=hospital)
+    return render(request, 'change_hospital_info.html', {'form': form, 'hospital': hospital})
 
 
 @login_required
 def hospital_update_confirm(request, hospital_id):
     hospital = get_object_or_404(Hospital, pk=hospital_id)
     if request.method == 'POST':
-        if 'confirm' in request.POST:
+        if request.POST.get('action') == 'confirm':
             # 変更処理
-            form_data = request.session.get('form_data')
+            store = get_wizard_store(request)
+            form_data = store.load('hospital_update')
+            if not form_data or form_data['hospital_id'] != hospital_id:
+                return redirect('hospital_update', hospital_id=hospital_id)
             hospital.hospital_name = form_data['hospital_name']
             hospital.hospital_address = form_data['hospital_address']
             hospital.phone_number = form_data['phone_number']
             hospital.capital = form_data['capital']
             hospital.emergency = form_data['emergency']
             hospital.save() # 変更を保存
-            del request.session['form_data']  # セッションデータの削除
+            store.clear('hospital_update')  # 入力内容の削除
             messages.success(request, '病院情報を変更しました。')
             return redirect('hospital_list')  # 一覧画面に戻る
-        elif 'back' in request.POST:
+        elif request.POST.get('action') == 'back':
             # 変更画面に戻る
             return redirect('hospital_update', hospital_id=hospital_id)
     else:
-        form_data = request.session.get('form_data')
-        if not form_data:
+        form_data = get_wizard_store(request).load('hospital_update')
+        if not form_data or form_data['hospital_id'] != hospital_id:
             # セッションにデータがない場合はエラー
             return redirect('hospital_update', hospital_id=hospital_id)
 
@@ -244,26 +365,361 @@ def hospital_update_confirm(request, hospital_id):
 
 # P103 患者名検索機能
 @login_required
+@read_from_replica
 def patient_search_by_name(request):
     if request.method == 'POST':
         patient_name = request.POST['patientName']
-        # 空白で分割して、部分一致検索
-        names = patient_name.split()
-        query = Q()
-        for name in names:
-            query |= Q(first_name__icontains=name) | Q(last_name__icontains=name)
-        patients = Patient.objects.filter(query)
+        # 空白で分割して、検索インデックスから順位付きで取得
+        patients = search_patients(patient_name)
         return render(request, 'patient_search_result.html', {'patients': patients})  # 修正
     else:
         return render(request, 'patient_search_by_name.html')
 
 
+# 患者の候補表示（入力途中の患者ID・氏名・読みから上位10件を返す JSON API）
+@login_required
+def patient_autocomplete(request):
+    results, source = suggest(request.GET.get('q', ''))
+    return JsonResponse({'results': results, 'source': source})
+
+
 # H103 住所→他病院検索機能
 @login_required
+@read_from_replica
 def hospital_search_by_address(request):
     if request.method == 'POST':
         address = request.POST['address']
-        hospitals = Hospital.objects.filter(hospital_address__icontains=address)
-        return render(request, 'hospital_search_result.html', {'hospitals': hospitals})
+        # 分解済みの住所列（インデックス）で検索
+        hospitals = Hospital.objects.filter(address_query(address)).order_by('hospital_id')
+        return cached_render(request, 'hospital_search_by_address', parse_address(address),
+                             'hospital_search_result.html', lambda: {'hospitals': hospitals})
     else:
         return render(request, 'hospital_search_by_address.html')
+
+
+# 近くの救急対応病院の検索（JSON API）
+NEAREST_MAX = 50
+
+
+@login_required
+def hospital_nearest(request):
+    try:
+        if request.GET.get('lat') and request.GET.get('lon'):
+            latitude = float(request.GET['lat'])
+            longitude = float(request.GET['lon'])
+            # 範囲外の値（NaN・無限大を含む）は格子番号を求められないため受け付けない
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError
+        else:
+            # 住所が指定された場合は地名辞書から代表地点を求める
+            parts = parse_address(request.GET.get('address', ''))
+            entry = GazetteerEntry.objects.locate(parts['address_prefecture'], parts['address_municipality'],
+                                                  parts['address_town'])
+            if entry is None:
+                return JsonResponse({'error': '位置を特定できませんでした。'}, status=400)
+            latitude, longitude = entry.latitude, entry.longitude
+        k = min(max(int(request.GET.get('k', 5)), 1), NEAREST_MAX)
+    except ValueError:
+        return JsonResponse({'error': '検索条件が正しくありません。'}, status=400)
+
+    hospitals = Hospital.objects.filter(grid_y__isnull=False)
+    if request.GET.get('emergency', '1') != 'all':
+        hospitals = hospitals.filter(emergency=1)  # 既定では救急対応ありのみ
+    results = [
+        {
+            'hospital_id': hospital.hospital_id,
+            'hospital_name': hospital.hospital_name,
+            'hospital_address': hospital.hospital_address,
+            'phone_number': hospital.phone_number,
+            'emergency': hospital.emergency,
+            'distance_km': round(distance, 2),
+        }
+        for distance, hospital in nearest(hospitals, latitude, longitude, k)
+    ]
+    return JsonResponse({'latitude': latitude, 'longitude': longitude, 'hospitals': results})
+
+
+# -------------------------------------------------------------------
+# 処置履歴確認機能 (D103)
+# -------------------------------------------------------------------
+TREATMENT_HISTORY_PER_PAGE = 20
+
+
+def _treatment_history_page(form, cursor):
+    # 患者ID・期間で絞り込み、薬剤を結合して新しい順に1ページ分を取得する
+    # 保管用の表は、期間が移し終えた日時以前に及び、かつページが新しい処置だけで埋まらない場合に読む
+    filters = {'patient_id': form.cleaned_data['patient_id']}
+    cold_until = archived_through()
+    if form.cleaned_data['date_from']:
+        start = timezone.make_aware(datetime.combine(form.cleaned_data['date_from'], time.min))
+        filters['date__gte'] = start
+        if cold_until is not None and start > cold_until:
+            cold_until = None
+    if form.cleaned_data['date_to']:
+        end = datetime.combine(form.cleaned_data['date_to'] + timedelta(days=1), time.min)
+        filters['date__lt'] = timezone.make_aware(end)
+    paginator = TieredCursorPaginator(
+        Treatment.objects.filter(**filters).select_related('medicine'),
+        ArchivedTreatment.objects.filter(**filters).select_related('medicine'),
+        ('-date', 'id'), cold_until, per_page=TREATMENT_HISTORY_PER_PAGE,
+    )
+    return paginator.get_page(cursor)
+
+
+@login_required
+def check_treatment_history(request):
+    form = TreatmentHistoryForm(request.GET or None)
+    context = {'form': form}
+    if form.is_valid():
+        page_obj = _treatment_history_page(form, request.GET.get('cursor'))
+        query = request.GET.copy()
+        query.pop('cursor', None)
+        context.update({
+            'treatments': page_obj,
+            'page_obj': page_obj,
+            'patient_id': form.cleaned_data['patient_id'],
+            'query_string': query.urlencode(),
+        })
+    return render(request, 'check_treatment_history.html', context)
+
+
+@login_required
+def treatment_history_api(request):
+    form = TreatmentHistoryForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    page_obj = _treatment_history_page(form, request.GET.get('cursor'))
+    return JsonResponse({
+        'patient_id': form.cleaned_data['patient_id'],
+        'treatments': [
+            {
+                'id': treatment.id,
+                'date': treatment.date,
+                'medicineid': treatment.medicine_id,
+                'medicinename': treatment.medicine.medicinename,
+                'unit': treatment.medicine.unit,
+                'quantity': treatment.quantity,
+            }
+            for treatment in page_obj
+        ],
+        'next_cursor': page_obj.next_cursor,
+        'previous_cursor': page_obj.previous_cursor,
+    })
+
+
+# -------------------------------------------------------------------
+# 薬剤投与指示機能 (D101, D102)
+# -------------------------------------------------------------------
+@login_required
+def medication_instruction(request, patient_id):
+    patient = get_object_or_404(Patient, pk=patient_id)
+    if request.method == 'POST':
+        formset = MedicationInstructionFormSet(request.POST)
+        if formset.is_valid():
+            # 確認画面用に [薬剤ID, 数量] の組だけを保存する
+            get_wizard_store(request).save('treatment', {'patient_id': patient.patient_id, 'lines': formset.lines})
+            return redirect('confirm_treatment', patient_id=patient.patient_id)
+    else:
+        formset = MedicationInstructionFormSet()
+    return render(request, 'medication_instruction.html', {'formset': formset, 'patient': patient})
+
+
+def _treatment_formset(lines):
+    # 保存した [薬剤ID, 数量] の組を、入力画面のフォームセットの形に戻す
+    data = {'form-TOTAL_FORMS': str(len(lines)), 'form-INITIAL_FORMS': '0'}
+    for i, (medicine_id, quantity) in enumerate(lines):
+        data[f'form-{i}-medicine'] = medicine_id
+        data[f'form-{i}-quantity'] = str(quantity)
+    return MedicationInstructionFormSet(data)
+
+
+@login_required
+def confirm_treatment(request, patient_id):
+    store = get_wizard_store(request)
+    treatment_data = store.load('treatment')
+    if not treatment_data or treatment_data['patient_id'] != patient_id:
+        # セッションにデータがない場合は入力画面に戻る
+        return redirect('medication_instruction', patient_id=patient_id)
+
+    # 薬剤名は薬剤マスタのキャッシュから表示する
+    # 入力後に削除された薬剤があれば、行を落とさずに入力画面へ戻す
+    medicines = {medicine_id: get_medicine(medicine_id) for medicine_id, _ in treatment_data['lines']}
+    missing = sorted(medicine_id for medicine_id, medicine in medicines.items() if medicine is None)
+    if missing:
+        messages.error(request, f'存在しない薬剤が含まれています: {", ".join(missing)}')
+        return redirect('medication_instruction', patient_id=patient_id)
+    treatments = [Treatment(patient_id=patient_id, medicine=medicines[medicine_id], quantity=quantity,
+                            doctor_id=request.user.pk)
+                  for medicine_id, quantity in treatment_data['lines']]
+    if request.method == 'POST':
+        if request.POST.get('action') == 'confirm':
+            # 登録の直前に、入力画面と同じフォームセットで薬剤の存在をもう一度確かめる（DB を1回検索）
+            formset = _treatment_formset(treatment_data['lines'])
+            if not formset.is_valid():
+                for error in formset.non_form_errors():
+                    messages.error(request, error)
+                return redirect('medication_instruction', patient_id=patient_id)
+            # 全行を1トランザクション・1回の INSERT で登録し、同じトランザクションで在庫を減らす
+            with transaction.atomic():
+                Treatment.objects.bulk_create(treatments)
+                record_treatments(treatments)
+            store.clear('treatment')
+            messages.success(request, '薬剤投与指示を登録しました。')
+            return redirect('check_treatment_history')
+        elif request.POST.get('action') == 'back':
+            return redirect('medication_instruction', patient_id=patient_id)
+    return render(request, 'confirm_treatment.html', {'treatments': treatments, 'patient_id': patient_id})
+
+
+# -------------------------------------------------------------------
+# 薬剤使用量の報告（日別・月別・医師別）
+# 処置の表は集計せず、使用量の集計表だけを読む
+# -------------------------------------------------------------------
+@login_required
+@read_from_replica
+def medicine_usage_report(request):
+    today = date.today()
+    form = MedicineUsageReportForm(request.GET or {'period': 'day', 'date_from': today.replace(day=1),
+                                                   'date_to': today})
+    context = {'form': form}
+    if form.is_valid():
+        rows = usage_report(form.cleaned_data['period'], form.cleaned_data['date_from'],
+                            form.cleaned_data['date_to'], form.cleaned_data['medicine'])
+        context.update({'rows': rows, 'period': form.cleaned_data['period'],
+                        'total': sum(row['quantity'] for row in rows)})
+    return render(request, 'medicine_usage_report.html', context)
+
+
+# -------------------------------------------------------------------
+# 保険証期限確認機能 (P104)
+# -------------------------------------------------------------------
+@login_required
+@conditional_on('patient', vary=lambda request: date.today())  # 期限の区分は日付で変わる
+def patient_check_insurance_expiry(request):
+    bucket = request.GET.get('bucket', 'expired')
+    if bucket not in dict(EXPIRY_BUCKETS):
+        bucket = 'expired'
+    # 件数は集計表から、一覧は有効期限のインデックスを使ってページ単位で取得する
+    patients = Patient.objects.filter(bucket_filter(bucket))
+    paginator = CursorPaginator(patients, ('insurance_exp', 'patient_id'), per_page=20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'patient_check_insurance_expiry.html', {
+        'expired_patients': page_obj,
+        'page_obj': page_obj,
+        'bucket': bucket,
+        'bucket_counts': bucket_counts(),
+    })
+
+
+# -------------------------------------------------------------------
+# データ出力 (CSV / JSON)
+# -------------------------------------------------------------------
+@login_required
+def export_data(request, kind):
+    if kind not in EXPORT_FIELDS:
+        raise Http404
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    if form.cleaned_data['background']:
+        # 件数の多い出力はワーカーでファイルに書き出し、完了後に処理状況の画面からダウンロードする
+        job = enqueue('export', {'kind': kind, 'filters': request.GET.dict()}, user=request.user)
+        return JsonResponse(job_payload(job), status=202)
+    output_format = form.cleaned_data['format'] or 'csv'
+    # gzip はクライアントが対応している場合のみ、送信しながら圧縮する
+    compress = form.cleaned_data['gzip'] and 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = StreamingHttpResponse(
+        export_chunks(kind, form.cleaned_data, output_format, compress),
+        content_type='application/json' if output_format == 'json' else 'text/csv; charset=utf-8',
+    )
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{output_format}"'
+    return response
+
+
+# -------------------------------------------------------------------
+# バックグラウンド処理の登録・処理状況
+# 処理状況はプライマリから読む（ワーカーの更新をすぐに反映するため）
+# -------------------------------------------------------------------
+# 従業員管理の権限（is_staff）で登録できる処理
+MAINTENANCE_JOBS = ('import_master_data', 'rebuild_patient_search_index', 'rebuild_insurance_expiry_counts',
+                    'rebuild_medicine_usage', 'archive_treatments')
+
+
+def job_payload(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.get_status_display(),
+        'finished': job.status in (Job.Status.SUCCEEDED, Job.Status.FAILED),
+        'progress': job.progress,
+        'total': job.total,
+        'message': job.message,
+        'attempts': job.attempts,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+        'status_url': reverse('job_status', args=[job.pk]),
+        'download_url': (reverse('job_download', args=[job.pk])
+                         if job.status == Job.Status.SUCCEEDED and job.kind == 'export' else None),
+    }
+
+
+def _visible_jobs(request):
+    # 登録した本人の処理のみ（is_staff はすべての処理）
+    if request.user.is_staff:
+        return Job.objects.all()
+    return Job.objects.filter(created_by_id=request.user.pk)
+
+
+@login_required
+def job_list(request):
+    return render(request, 'job_list.html', {
+        'jobs': _visible_jobs(request).order_by('-created_at')[:50],
+        'maintenance_jobs': MAINTENANCE_JOBS if request.user.is_staff else (),
+    })
+
+
+@login_required
+def job_status(request, job_id):
+    job = get_object_or_404(_visible_jobs(request), pk=job_id)
+    payload = job_payload(job)
+    if request.user.is_staff:
+        payload.update({'params': job.params, 'result': job.result, 'error': job.error})
+    return JsonResponse(payload)
+
+
+@login_required
+def job_download(request, job_id):
+    job = get_object_or_404(_visible_jobs(request), pk=job_id, kind='export', status=Job.Status.SUCCEEDED)
+    return FileResponse(open(job.result['path'], 'rb'), as_attachment=True, filename=job.result['filename'])
+
+
+@login_required
+@require_POST
+def job_enqueue(request, kind):
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    if kind not in MAINTENANCE_JOBS:
+        raise Http404
+    params = {key: value for key, value in request.POST.items() if key != 'csrfmiddlewaretoken'}
+    if kind == 'import_master_data':
+        # 取り込み用のディレクトリの外のファイルは指定できない
+        try:
+            import_path(params.get('path', ''))
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('job_list')
+    job = enqueue(kind, params, user=request.user)
+    messages.success(request, f'処理 {job.pk}（{kind}）を登録しました。')
+    return redirect('job_list')
+
+
+# -------------------------------------------------------------------
+# 計測値の出力（Prometheus のテキスト形式）
+# -------------------------------------------------------------------
+def metrics(request):
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
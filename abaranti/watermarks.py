@@ -0,0 +1,56 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import TableWatermark
+from .routers import PRIMARY
+
+# -------------------------------------------------------------------
+# テーブルごとの最終更新日時（条件付き GET）
+# 一覧・検索結果の画面は、関係するテーブルの最終更新日時と URL から ETag / Last-Modified を求め、
+# ブラウザの持つ内容が最新であれば一覧を検索せずに 304 を返す
+# -------------------------------------------------------------------
+
+
+def watermark_cache_key(table):
+    return f'abaranti:watermark:{table}'
+
+
+def get_watermark(table):
+    key = watermark_cache_key(table)
+    updated_at = cache.get(key)
+    if updated_at is None:
+        # レプリカの遅延で古い値をキャッシュしないよう、プライマリから読む
+        watermark, _ = TableWatermark.objects.using(PRIMARY).get_or_create(
+            table=table, defaults={'updated_at': timezone.now()})
+        updated_at = watermark.updated_at
+        cache.set(key, updated_at, timeout=None)
+    return updated_at
+
+
+def touch(table):
+    now = timezone.now()
+    if not TableWatermark.objects.filter(table=table).update(updated_at=now):
+        TableWatermark.objects.update_or_create(table=table, defaults={'updated_at': now})
+    transaction.on_commit(lambda: cache.set(watermark_cache_key(table), now, timeout=None))
+
+
+def last_modified(*tables):
+    return max(get_watermark(table) for table in tables)
+
+
+def conditional_on(*tables, vary=None):
+    # tables: 画面の内容が依存するテーブル / vary: 日付など、テーブル以外に内容が依存する値を返す関数
+    def etag(request, *args, **kwargs):
+        parts = [last_modified(*tables).isoformat(), request.get_full_path()]
+        if vary is not None:
+            parts.append(str(vary(request)))
+        return hashlib.md5('\n'.join(parts).encode()).hexdigest()
+
+    def modified(request, *args, **kwargs):
+        return None if vary is not None else last_modified(*tables)
+
+    return condition(etag_func=etag, last_modified_func=modified)
@@ -0,0 +1,84 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# -------------------------------------------------------------------
+# 登録・変更の確認画面までの入力内容（ウィザードの状態）
+# 画面ごとに必要な項目だけを、項目順の値のリストとして保存する
+# -------------------------------------------------------------------
+WIZARD_FIELDS = {
+    'employee_register': ('username', 'first_name', 'last_name', 'password', 'role'),
+    'employee_update': ('first_name', 'last_name'),
+    'hospital_register': ('hospital_id', 'hospital_name', 'hospital_address', 'phone_number', 'capital',
+                          'emergency'),
+    'hospital_update': ('hospital_id', 'hospital_name', 'hospital_address', 'phone_number', 'capital', 'emergency'),
+    'patient_register': ('patient_id', 'last_name', 'first_name', 'last_name_kana', 'first_name_kana', 'gender',
+                         'birthdate', 'insurance_number', 'insurance_exp'),
+    'treatment': ('patient_id', 'lines'),
+}
+
+# 保存形式の版（項目が変わった場合に古い状態を読まないようにする）
+WIZARD_VERSION = 1
+
+
+def pack(name, data):
+    values = []
+    for field in WIZARD_FIELDS[name]:
+        value = data[field]
+        if isinstance(value, date):
+            value = value.isoformat()
+        values.append(value)
+    return [WIZARD_VERSION, *values]
+
+
+def unpack(name, packed):
+    if not packed or packed[0] != WIZARD_VERSION:
+        return None
+    return dict(zip(WIZARD_FIELDS[name], packed[1:]))
+
+
+class SessionWizardStore:
+    # セッションに保存する（セッションのバックエンドに従う）
+    def __init__(self, request):
+        self.session = request.session
+
+    def _key(self, name):
+        return f'wizard:{name}'
+
+    def save(self, name, data):
+        self.session[self._key(name)] = pack(name, data)
+
+    def load(self, name):
+        return unpack(name, self.session.get(self._key(name)))
+
+    def clear(self, name):
+        self.session.pop(self._key(name), None)
+
+
+class CacheWizardStore:
+    # キャッシュに短い有効期限付きで保存する（セッションへの書き込みが発生しない）
+    def __init__(self, request):
+        self.cache = caches[getattr(settings, 'WIZARD_STATE_CACHE', 'default')]
+        self.timeout = getattr(settings, 'WIZARD_STATE_TTL', 900)
+        if request.session.session_key is None:
+            request.session.save()
+        self.prefix = f'wizard:{request.session.session_key}'
+
+    def _key(self, name):
+        return f'{self.prefix}:{name}'
+
+    def save(self, name, data):
+        self.cache.set(self._key(name), pack(name, data), self.timeout)
+
+    def load(self, name):
+        return unpack(name, self.cache.get(self._key(name)))
+
+    def clear(self, name):
+        self.cache.delete(self._key(name))
+
+
+def get_wizard_store(request):
+    store_class = import_string(getattr(settings, 'WIZARD_STATE_STORE', 'abaranti.wizard.CacheWizardStore'))
+    return store_class(request)
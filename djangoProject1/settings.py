@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'abaranti.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'abaranti.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +58,8 @@ ROOT_URLCONF = 'djangoProject1.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # 描画時間を計測する（abaranti.metrics）ほかは DjangoTemplates と同じ
+        'BACKEND': 'abaranti.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -75,17 +80,138 @@ WSGI_APPLICATION = 'djangoProject1.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# DB 接続の再利用は環境変数で設定する
+#   DB_POOL_SIZE     ワーカープロセスごとの接続プールの最大接続数（0 でプールを使わない）
+#   DB_POOL_RECYCLE  この秒数以上使われていないプール内の接続は作り直す
+#   DB_POOL_TIMEOUT  プールに空きがない場合に待つ秒数
+#   DB_CONN_MAX_AGE  プールを使わない場合に接続を持ち続ける秒数（0 でリクエストごとに接続）
+#   DB_CONN_HEALTH_CHECKS  再利用の前に接続を確認する（1 / 0）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'abaranti.db.mysql' if DB_POOL_SIZE else 'django.db.backends.mysql',
         'NAME': 'database1',
         'USER': '211013',
         'PASSWORD': 'password',
         'HOST': 'localhost',
         'PORT': '3306',
+        # プールを使う場合はリクエストの終了時に接続をプールへ返す
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'POOL': {
+            'SIZE': DB_POOL_SIZE or 1,
+            'RECYCLE': int(os.environ.get('DB_POOL_RECYCLE', '300')),
+            'TIMEOUT': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        },
+    }
+}
+
+# 参照用レプリカ（DB_REPLICA_HOST を指定した場合のみ）
+# 検索・一覧の画面の読み込みをレプリカに送る。書き込んだ従業員の読み込みは
+# REPLICA_PIN_SECONDS 秒間プライマリに固定する（レプリカの遅延で自分の書き込みが見えなくならないように）
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    }
+elif sys.argv[1:2] == ['test']:
+    # テストでは振り分けを確認できるよう、同じサーバーに別のテスト用 DB を作ってレプリカとする
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'TEST': {'NAME': f"test_{DATABASES['default']['NAME']}_replica"},
+    }
+
+DATABASE_ROUTERS = ['abaranti.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', '5'))
+
+
+# Cache
+# 薬剤マスタなどのキャッシュの世代番号をワーカープロセス間で共有するため、ファイルキャッシュを使う
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# セッションはキャッシュに保存する（画面遷移ごとのセッションテーブルへの書き込みをなくす）
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+
+# 登録・変更の確認画面までの入力内容の保存先と有効期限（秒）
+WIZARD_STATE_STORE = 'abaranti.wizard.CacheWizardStore'
+WIZARD_STATE_TTL = 900
+
+
+# 他病院の一覧・検索結果の描画結果をキャッシュする秒数（他病院の変更時は世代番号で破棄）
+FRAGMENT_CACHE_TTL = 600
+
+
+# 患者の候補表示のインデックス（ワーカープロセスごとに初回の検索時に作成する）
+# 他プロセスでの患者の変更は TYPEAHEAD_SYNC_INTERVAL 秒ごとに確認して取り込む
+TYPEAHEAD_BUILD_IN_BACKGROUND = True
+TYPEAHEAD_SYNC_INTERVAL = 1.0
+
+
+# 薬剤の発注案（reorder_medicines）
+# 消費量は直近 STOCK_ROLLING_DAYS 日の日別使用量の平均とし、納期中の使用量 + 安全在庫（STOCK_SAFETY_DAYS 日分）を
+# 在庫数 + 未入荷の発注数が下回った薬剤を、次回の見直し（STOCK_REVIEW_DAYS 日後）までの量だけ発注する
+STOCK_ROLLING_DAYS = 28
+STOCK_SAFETY_DAYS = 3
+STOCK_REVIEW_DAYS = 7
+
+
+# 処置の保管（archive_treatments）: この日数より前の処置を保管用の表へ移す
+TREATMENT_ARCHIVE_DAYS = 365
+
+
+# バックグラウンド処理（run_workers）
+# JOB_WORKERS: run_workers 1つあたりの子プロセス数 / JOB_CONCURRENCY: 種類ごとの同時実行数の上限（全ワーカーの合計）
+# 失敗した処理は JOB_MAX_ATTEMPTS 回まで、JOB_RETRY_DELAY 秒から倍々に間隔を空けて再試行する
+# 応答が JOB_STALE_SECONDS 秒途絶えた実行中の処理（ワーカーの停止など）は再試行に回す
+# SQLite では書き込みが1つずつしか行えないため、JOB_WORKERS を小さくする（ロック待ちの失敗は再試行される）
+JOB_WORKERS = 2
+JOB_CONCURRENCY = {
+    'import_master_data': 1,
+    'archive_treatments': 1,
+    'export': 2,
+}
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_STALE_SECONDS = 300
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_OUTPUT_DIR = BASE_DIR / 'job-output'
+# マスタデータの一括登録（import_master_data）で読み込めるファイルの置き場所（この下のファイルだけを受け付ける）
+JOB_IMPORT_DIR = BASE_DIR / 'job-import'
+
+
+# ログイン中の従業員はキャッシュから読み込む（リクエストごとの従業員テーブルの検索をなくす）
+AUTHENTICATION_BACKENDS = ['abaranti.backends.CachedEmployeeBackend']
+EMPLOYEE_CACHE_TTL = 300
+
+
+# リクエストの計測（/metrics で Prometheus に出力する）
+# SLOW_REQUEST_THRESHOLD 秒以上かかったリクエストは、時間のかかったクエリ上位
+# SLOW_REQUEST_TOP_QUERIES 件と重複クエリをログ（abaranti.slow_requests）に出力する
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', '1.0'))
+SLOW_REQUEST_TOP_QUERIES = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'abaranti.slow_requests': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators